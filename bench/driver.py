@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import sys
+import time
+
+# Replays JSON-RPC traffic against mcp_server.py over stdio and reports
+# per-tool latency percentiles, throughput and the server's memory use.
+#
+#   python bench/driver.py                          # starts bench/fake_es.py itself
+#   python bench/driver.py --concurrency 16 --repeat 50 --latency-ms 5
+#   python bench/driver.py --save baseline.json     # record a baseline
+#   python bench/driver.py --compare baseline.json  # exit 1 if p50/p99 regressed
+#
+# The traffic file holds one JSON-RPC request per line (ids are reassigned).
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_TRAFFIC = os.path.join(BENCH_DIR, "traffic.jsonl")
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def load_traffic(path):
+    messages = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                messages.append(json.loads(line))
+    return messages
+
+
+def label(message):
+    if message.get("method") == "tools/call":
+        return message["params"]["name"]
+    return message.get("method", "?")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"fake Elasticsearch did not start on port {port}")
+            await asyncio.sleep(0.05)
+
+
+class Client:
+    """Minimal MCP stdio client that matches replies to requests by id."""
+
+    def __init__(self, process):
+        self.process = process
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            future = self.pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("server exited"))
+
+    def send(self, message):
+        self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+
+    async def call(self, message):
+        if self.reader.done():
+            raise RuntimeError("server exited")
+        message = dict(message, jsonrpc="2.0", id=next(self.ids))
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message["id"]] = future
+        self.send(message)
+        await self.process.stdin.drain()
+        reply = await future
+        return reply, len(json.dumps(reply))
+
+    async def notify(self, method, params=None):
+        self.send({"jsonrpc": "2.0", "method": method, "params": params or {}})
+        await self.process.stdin.drain()
+
+
+def is_error(reply):
+    return "error" in reply or bool(reply.get("result", {}).get("isError"))
+
+
+async def replay(client, messages, concurrency, repeat):
+    stats = {}
+    work = iter([m for _ in range(repeat) for m in messages])
+
+    async def worker():
+        for message in work:
+            started = time.perf_counter()
+            reply, size = await client.call(message)
+            elapsed = (time.perf_counter() - started) * 1000.0
+            entry = stats.setdefault(label(message), {"latencies": [], "errors": 0, "bytes": 0})
+            entry["latencies"].append(elapsed)
+            entry["bytes"] += size
+            if is_error(reply):
+                entry["errors"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return stats, time.perf_counter() - started
+
+
+async def sample_rss(pid, samples, stop):
+    while not stop.is_set():
+        value = rss_kb(pid)
+        if value is not None:
+            samples.append(value)
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def summarize(stats, elapsed, rss_samples):
+    tools = {}
+    for name, entry in sorted(stats.items()):
+        latencies = entry["latencies"]
+        tools[name] = {
+            "calls": len(latencies),
+            "errors": entry["errors"],
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(max(latencies), 3),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "avg_reply_bytes": entry["bytes"] // len(latencies),
+        }
+    calls = sum(t["calls"] for t in tools.values())
+    return {
+        "calls": calls,
+        "errors": sum(t["errors"] for t in tools.values()),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(calls / elapsed, 1) if elapsed else 0.0,
+        "rss_kb": {"start": rss_samples[0], "peak": max(rss_samples), "end": rss_samples[-1]} if rss_samples else None,
+        "tools": tools,
+    }
+
+
+def print_report(report, out=sys.stdout):
+    print(f"{'tool':<22}{'calls':>7}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'bytes':>10}", file=out)
+    for name, t in report["tools"].items():
+        print(f"{name:<22}{t['calls']:>7}{t['errors']:>8}{t['p50_ms']:>10.2f}{t['p99_ms']:>10.2f}{t['max_ms']:>10.2f}{t['avg_reply_bytes']:>10}", file=out)
+    print(f"\n{report['calls']} calls, {report['errors']} errors in {report['seconds']:.2f}s = {report['throughput_rps']} calls/s", file=out)
+    if report["rss_kb"]:
+        rss = report["rss_kb"]
+        print(f"server RSS: start {rss['start'] / 1024:.1f} MB, peak {rss['peak'] / 1024:.1f} MB, end {rss['end'] / 1024:.1f} MB", file=out)
+
+
+def compare(report, baseline, tolerance, min_delta_ms=1.0):
+    """Return lines describing tools whose p50/p99 grew by more than tolerance.
+
+    Differences under min_delta_ms are ignored; sub-millisecond timings are noise.
+    """
+    regressions = []
+    for name, t in report["tools"].items():
+        base = baseline.get("tools", {}).get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if t[key] > base[key] * (1 + tolerance) and t[key] - base[key] > min_delta_ms:
+                regressions.append(f"{name} {key}: {base[key]:.2f} -> {t[key]:.2f}")
+    if baseline.get("throughput_rps") and report["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput_rps']} -> {report['throughput_rps']} calls/s")
+    return regressions
+
+
+async def run(args):
+    fake = None
+    es_url = args.es_url
+    if es_url is None:
+        port = free_port()
+        fake = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(BENCH_DIR, "fake_es.py"), "--port", str(port),
+            "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+            "--docs", str(args.docs), "--doc-bytes", str(args.doc_bytes))
+        await wait_for_port(port)
+        es_url = f"http://127.0.0.1:{port}"
+
+    # Keep profiles in memory: a snapshot would make the next run start warm (and the
+    # fake cluster's profiles would overwrite the ones in the repository's snapshot)
+    env = dict(os.environ, ES_URL=es_url, PYTHONUNBUFFERED="1", MCP_PROFILE_PATH="")
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    server = await asyncio.create_subprocess_exec(
+        sys.executable, args.server, cwd=ROOT_DIR, env=env, limit=64 * 1024 * 1024,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        stderr=None if args.verbose else asyncio.subprocess.DEVNULL)
+    client = Client(server)
+    samples = []
+    stop = asyncio.Event()
+    try:
+        await client.call({"method": "initialize", "params": {"protocolVersion": "2024-11-05", "capabilities": {},
+                                                               "clientInfo": {"name": "bench", "version": "1.0"}}})
+        await client.notify("notifications/initialized")
+        messages = load_traffic(args.traffic)
+        if args.warmup:
+            await replay(client, messages, args.concurrency, 1)
+        sampler = asyncio.ensure_future(sample_rss(server.pid, samples, stop))
+        stats, elapsed = await replay(client, messages, args.concurrency, args.repeat)
+        stop.set()
+        await sampler
+    finally:
+        server.stdin.close()
+        try:
+            await asyncio.wait_for(server.wait(), 5)
+        except asyncio.TimeoutError:
+            server.kill()
+        client.reader.cancel()
+        if fake is not None:
+            fake.terminate()
+            await fake.wait()
+    return summarize(stats, elapsed, samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mcp_server.py against a fake or real Elasticsearch")
+    parser.add_argument("--traffic", default=DEFAULT_TRAFFIC, help="JSON-RPC requests to replay, one per line")
+    parser.add_argument("--server", default=os.path.join(ROOT_DIR, "mcp_server.py"))
+    parser.add_argument("--es-url", help="use this Elasticsearch instead of starting bench/fake_es.py")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--repeat", type=int, default=20, help="times the traffic file is replayed")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="skip the untimed first pass")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="fake Elasticsearch delay per request")
+    parser.add_argument("--jitter-ms", type=float, default=1.0)
+    parser.add_argument("--docs", type=int, default=5000, help="fake documents per index")
+    parser.add_argument("--doc-bytes", type=int, default=256, help="fake document filler size")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra environment for the server, e.g. MCP_QUERY_CACHE_MB=0")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--save", metavar="FILE", help="write the report as JSON (a baseline for --compare)")
+    parser.add_argument("--compare", metavar="FILE", help="fail if p50/p99 or throughput regressed against this report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression for --compare (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes smaller than this for --compare")
+    parser.add_argument("--verbose", action="store_true", help="show the server's stderr")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("\nNo regressions against " + args.compare)
+
+
+if __name__ == "__main__":
+    main()
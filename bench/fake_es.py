@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from collections import Counter
+
+from aiohttp import web
+
+# Elasticsearch stand-in for benchmarks. It serves the endpoints mcp_server.py
+# uses from synthetic in-memory indices, with a configurable delay per request
+# and configurable document size, so runs are repeatable without a cluster.
+# Only term/terms/range/match/bool queries are evaluated; anything else matches
+# every document. Aggregations are limited to terms, cardinality, min, max and
+# stats.
+#
+#   python bench/fake_es.py --port 9250 --latency-ms 5 --docs 10000 --doc-bytes 512
+
+MAKES = ["Tesla", "Toyota", "Ford", "BMW", "Honda", "Kia", "Volvo", "Audi"]
+CITIES = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix", "Seattle"]
+TEXT = {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+MAPPINGS = {
+    "vehicles": {"id": {"type": "long"}, "make": TEXT, "model": TEXT, "year": {"type": "long"},
+                 "type": TEXT, "price": {"type": "long"}, "notes": {"type": "text"}},
+    "people": {"id": {"type": "long"}, "name": TEXT, "age": {"type": "long"}, "city": TEXT, "notes": {"type": "text"}},
+    "registrations": {"vehicle_id": {"type": "long"}, "person_id": {"type": "long"}, "reg_date": {"type": "date"},
+                      "status": {"type": "keyword"}, "notes": {"type": "text"}},
+}
+
+
+def make_docs(index, count, doc_bytes, rng):
+    filler = "x" * doc_bytes
+    docs = []
+    for i in range(1, count + 1):
+        if index == "vehicles":
+            doc = {"id": i, "make": rng.choice(MAKES), "model": f"Model {i % 50}", "year": rng.randint(2000, 2024),
+                   "type": rng.choice(["sedan", "SUV", "electric car"]), "price": rng.randint(10000, 90000)}
+        elif index == "people":
+            doc = {"id": i, "name": f"Person {i}", "age": rng.randint(18, 90), "city": rng.choice(CITIES)}
+        else:
+            doc = {"vehicle_id": rng.randint(1, count), "person_id": rng.randint(1, count),
+                   "reg_date": f"20{rng.randint(10, 24)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+                   "status": rng.choice(["active", "active", "expired"])}
+        if doc_bytes:
+            doc["notes"] = filler
+        docs.append(doc)
+    return docs
+
+
+def _value(doc, field):
+    return doc.get(field[:-len(".keyword")] if field.endswith(".keyword") else field)
+
+
+def matches(doc, query):
+    if not query:
+        return True
+    for kind, spec in query.items():
+        if kind == "bool":
+            if not all(matches(doc, q) for key in ("must", "filter") for q in _clauses(spec.get(key))):
+                return False
+            if any(matches(doc, q) for q in _clauses(spec.get("must_not"))):
+                return False
+            should = _clauses(spec.get("should"))
+            if should and not any(matches(doc, q) for q in should):
+                return False
+        elif kind in ("term", "terms", "match", "range") and isinstance(spec, dict):
+            for field, value in spec.items():
+                if field == "boost":
+                    continue
+                actual = _value(doc, field)
+                if kind == "term":
+                    value = value.get("value") if isinstance(value, dict) else value
+                    if actual != value:
+                        return False
+                elif kind == "terms":
+                    if actual not in value:
+                        return False
+                elif kind == "match":
+                    value = value.get("query") if isinstance(value, dict) else value
+                    if str(value).lower() not in str(actual).lower():
+                        return False
+                elif actual is None or not all(_compare(actual, op, bound) for op, bound in value.items()
+                                               if op in ("gt", "gte", "lt", "lte")):
+                    return False
+    return True
+
+
+def _clauses(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _compare(actual, op, bound):
+    try:
+        return {"gt": actual > bound, "gte": actual >= bound, "lt": actual < bound, "lte": actual <= bound}[op]
+    except TypeError:
+        return False
+
+
+def aggregate(docs, aggs):
+    results = {}
+    for name, spec in (aggs or {}).items():
+        kind = next((k for k in ("terms", "cardinality", "min", "max", "stats") if k in spec), None)
+        if kind is None:
+            continue
+        values = [v for v in (_value(doc, spec[kind]["field"]) for doc in docs) if v is not None]
+        if kind == "terms":
+            results[name] = {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0,
+                             "buckets": [{"key": key, "doc_count": count}
+                                         for key, count in Counter(values).most_common(spec["terms"].get("size", 10))]}
+        elif kind == "cardinality":
+            results[name] = {"value": len(set(values))}
+        else:
+            stats = {"count": len(values), "min": min(values) if values else None, "max": max(values) if values else None}
+            if values and isinstance(values[0], str):
+                # Dates: the fake keeps them as strings
+                stats = {"count": len(values), "min": 0, "max": 0, "min_as_string": stats["min"], "max_as_string": stats["max"]}
+            results[name] = stats if kind == "stats" else {"value": stats["min" if kind == "min" else "max"]}
+    return results
+
+
+class FakeES:
+    def __init__(self, docs=1000, doc_bytes=0, latency_ms=0.0, jitter_ms=0.0, seed=1):
+        rng = random.Random(seed)
+        self.indices = {name: make_docs(name, docs, doc_bytes, rng) for name in MAPPINGS}
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rng = random.Random(seed)
+        self.pits = {}
+        self.pit_ids = itertools.count()
+        self.requests = 0
+
+    async def delay(self):
+        self.requests += 1
+        wait = self.latency + (self.rng.random() * self.jitter if self.jitter else 0)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def missing(self, name):
+        return web.json_response({"error": {"root_cause": [{"type": "index_not_found_exception", "reason": f"no such index [{name}]"}],
+                                            "type": "index_not_found_exception", "reason": f"no such index [{name}]"},
+                                  "status": 404}, status=404)
+
+    @staticmethod
+    async def body(request):
+        if not request.can_read_body:
+            return {}
+        data = await request.read()
+        return json.loads(data) if data.strip() else {}
+
+    def search_response(self, index, body):
+        query = body.get("query")
+        docs = [(i, doc) for i, doc in enumerate(self.indices[index]) if matches(doc, query)]
+        size = int(body.get("size", 10))
+        start = int(body.get("from", 0))
+        if body.get("search_after"):
+            after = int(body["search_after"][-1])
+            start = next((n for n, (i, _) in enumerate(docs) if i > after), len(docs))
+        hits = [{"_index": index, "_id": str(i), "_score": 1.0, "_source": doc, "sort": [i]}
+                for i, doc in docs[start:start + size]]
+        response = {"took": 1, "timed_out": False, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                    "hits": {"total": {"value": len(docs), "relation": "eq"}, "max_score": 1.0, "hits": hits}}
+        if body.get("aggs") or body.get("aggregations"):
+            response["aggregations"] = aggregate([doc for _, doc in docs], body.get("aggs") or body.get("aggregations"))
+        if body.get("pit"):
+            response["pit_id"] = body["pit"]["id"]
+        return response
+
+    async def cat_indices(self, request):
+        await self.delay()
+        return web.json_response([{"health": "green", "status": "open", "index": name, "uuid": f"uuid-{name}",
+                                   "docs.count": str(len(docs))} for name, docs in self.indices.items()])
+
+    async def mapping(self, request):
+        await self.delay()
+        names = request.match_info["index"].split(",")
+        found = {name: {"mappings": {"properties": MAPPINGS[name]}} for name in names if name in self.indices}
+        if not found and len(names) == 1 and request.query.get("ignore_unavailable") != "true":
+            return self.missing(names[0])
+        return web.json_response(found)
+
+    async def stats(self, request):
+        await self.delay()
+        name = request.match_info["index"]
+        if name not in self.indices:
+            return self.missing(name)
+        primaries = {"docs": {"count": len(self.indices[name])}, "refresh": {"total": 1}, "indexing": {"index_total": 0}}
+        return web.json_response({"_all": {"primaries": primaries},
+                                  "indices": {name: {"uuid": f"uuid-{name}", "primaries": primaries}}})
+
+    async def search(self, request):
+        await self.delay()
+        body = await self.body(request)
+        name = request.match_info.get("index")
+        if name is None:
+            name = self.pits.get((body.get("pit") or {}).get("id"))
+        if name not in self.indices:
+            return self.missing(name)
+        return web.json_response(self.search_response(name, body))
+
+    async def msearch(self, request):
+        await self.delay()
+        lines = [json.loads(line) for line in (await request.text()).splitlines() if line.strip()]
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            name = header.get("index")
+            if name in self.indices:
+                responses.append(dict(self.search_response(name, body), status=200))
+            else:
+                responses.append({"error": {"type": "index_not_found_exception", "reason": f"no such index [{name}]"}, "status": 404})
+        return web.json_response({"took": 1, "responses": responses})
+
+    async def count(self, request):
+        await self.delay()
+        name = request.match_info["index"]
+        if name not in self.indices:
+            return self.missing(name)
+        query = (await self.body(request)).get("query")
+        total = sum(1 for doc in self.indices[name] if matches(doc, query))
+        return web.json_response({"count": total, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}})
+
+    async def open_pit(self, request):
+        await self.delay()
+        name = request.match_info["index"]
+        if name not in self.indices:
+            return self.missing(name)
+        pit_id = f"pit-{next(self.pit_ids)}"
+        self.pits[pit_id] = name
+        return web.json_response({"id": pit_id})
+
+    async def close_pit(self, request):
+        await self.delay()
+        body = await self.body(request)
+        found = self.pits.pop(body.get("id"), None) is not None
+        return web.json_response({"succeeded": found, "num_freed": int(found)})
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/_cat/indices", self.cat_indices)
+        app.router.add_post("/_msearch", self.msearch)
+        app.router.add_route("*", "/_search", self.search)
+        app.router.add_delete("/_pit", self.close_pit)
+        app.router.add_get("/{index}/_mapping", self.mapping)
+        app.router.add_get("/{index}/_stats/{metrics}", self.stats)
+        app.router.add_route("*", "/{index}/_search", self.search)
+        app.router.add_route("*", "/{index}/_count", self.count)
+        app.router.add_post("/{index}/_pit", self.open_pit)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Elasticsearch for mcp_server.py benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9250)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra random delay up to this much")
+    parser.add_argument("--docs", type=int, default=1000, help="documents per index")
+    parser.add_argument("--doc-bytes", type=int, default=0, help="size of the filler text field in every document")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    fake = FakeES(args.docs, args.doc_bytes, args.latency_ms, args.jitter_ms, args.seed)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
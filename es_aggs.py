@@ -0,0 +1,143 @@
+import re
+
+import es_validate
+
+# Builds aggregation requests from the aggregate tool's simple spec and
+# flattens the nested bucket response into a compact table.
+
+GROUP_TYPES = ("terms", "date_histogram", "histogram")
+METRIC_TYPES = ("avg", "sum", "min", "max", "stats", "cardinality", "value_count", "percentiles")
+CALENDAR_INTERVALS = {"minute", "1m", "hour", "1h", "day", "1d", "week", "1w", "month", "1M", "quarter", "1q", "year", "1y"}
+# Anything else must be a fixed interval; weeks, months and longer only exist as single calendar units
+FIXED_INTERVAL = re.compile(r"[1-9]\d*(ms|s|m|h|d)")
+STATS_COLUMNS = ("count", "min", "max", "avg", "sum")
+DEFAULT_GROUP_SIZE = 10
+MAX_GROUP_SIZE = 10000
+
+
+def _aggregatable(field, fields, notes):
+    # Text fields cannot be aggregated; switch to their keyword subfield when there is one
+    info = (fields or {}).get(field)
+    if info and info["types"] <= es_validate.ANALYZED_TYPES and info.get("keyword"):
+        notes.append(f"'{field}' is text; aggregated on '{info['keyword']}' instead")
+        return info["keyword"]
+    return field
+
+
+def parse_spec(args, fields=None):
+    """Normalize group_by/metrics arguments; return (groups, metrics, notes)."""
+    notes = []
+    groups = []
+    group_by = args.get("group_by") or []
+    if isinstance(group_by, (str, dict)):
+        group_by = [group_by]
+    for i, group in enumerate(group_by):
+        if isinstance(group, str):
+            group = {"field": group}
+        if not isinstance(group, dict) or not isinstance(group.get("field"), str):
+            raise ValueError(f"group_by[{i}] must be a field name or an object with a field")
+        group_type = group.get("type", "terms")
+        if group_type not in GROUP_TYPES:
+            raise ValueError(f"group_by[{i}].type must be one of {', '.join(GROUP_TYPES)}")
+        if group_type != "terms" and not group.get("interval"):
+            raise ValueError(f"group_by[{i}] of type {group_type} needs an interval (e.g. 'month' or '1y' for dates, 1000 for numbers)")
+        if group_type == "date_histogram":
+            interval = str(group["interval"])
+            if interval not in CALENDAR_INTERVALS and not FIXED_INTERVAL.fullmatch(interval):
+                raise ValueError(f"group_by[{i}] interval '{interval}' is not valid for date_histogram. Use a calendar unit "
+                                 f"({', '.join(sorted(CALENDAR_INTERVALS))}) or a fixed multiple of ms, s, m, h or d "
+                                 f"(e.g. '90m', '7d', '30d'); multiples of weeks, months, quarters or years are not supported.")
+        field = _aggregatable(group["field"], fields, notes) if group_type == "terms" else group["field"]
+        groups.append(dict(group, type=group_type, field=field, label=group["field"]))
+    metrics = []
+    for i, metric in enumerate(args.get("metrics") or []):
+        if isinstance(metric, str):
+            # "avg:price" shorthand
+            metric_type, _, field = metric.partition(":")
+            metric = {"type": metric_type, "field": field}
+        if not isinstance(metric, dict) or metric.get("type") not in METRIC_TYPES or not isinstance(metric.get("field"), str) or not metric["field"]:
+            raise ValueError(f"metrics[{i}] must look like {{\"type\": \"avg\", \"field\": \"price\"}} with type one of {', '.join(METRIC_TYPES)}")
+        field = _aggregatable(metric["field"], fields, notes) if metric["type"] in ("cardinality", "value_count") else metric["field"]
+        metrics.append(dict(metric, field=field, label=metric["field"]))
+    return groups, metrics, notes
+
+
+def _group_agg(group):
+    if group["type"] == "terms":
+        size = max(1, min(int(group.get("size", DEFAULT_GROUP_SIZE)), MAX_GROUP_SIZE))
+        agg = {"field": group["field"], "size": size}
+        if group.get("missing") is not None:
+            agg["missing"] = group["missing"]
+        return {"terms": agg}
+    if group["type"] == "date_histogram":
+        interval = str(group["interval"])
+        key = "calendar_interval" if interval in CALENDAR_INTERVALS else "fixed_interval"
+        agg = {"field": group["field"], key: interval, "min_doc_count": 1}
+        if group.get("format"):
+            agg["format"] = group["format"]
+        return {"date_histogram": agg}
+    return {"histogram": {"field": group["field"], "interval": group["interval"], "min_doc_count": 1}}
+
+
+def _metric_aggs(metrics):
+    return {f"m{i}": {metric["type"]: {"field": metric["field"]}} for i, metric in enumerate(metrics)}
+
+
+def build_body(groups, metrics, query=None):
+    aggs = _metric_aggs(metrics)
+    for depth in range(len(groups) - 1, -1, -1):
+        agg = _group_agg(groups[depth])
+        if aggs:
+            agg["aggs"] = aggs
+        aggs = {f"g{depth}": agg}
+    body = {"size": 0, "track_total_hits": True}
+    if query:
+        body["query"] = query
+    if aggs:
+        body["aggs"] = aggs
+    return body
+
+
+def columns(groups, metrics):
+    cols = [group["label"] for group in groups] + ["doc_count"]
+    for metric in metrics:
+        if metric["type"] == "stats":
+            cols.extend(f"stats({metric['label']}).{stat}" for stat in STATS_COLUMNS)
+        else:
+            cols.append(f"{metric['type']}({metric['label']})")
+    return cols
+
+
+def _metric_values(bucket, metrics):
+    values = []
+    for i, metric in enumerate(metrics):
+        result = bucket.get(f"m{i}", {})
+        if metric["type"] == "stats":
+            values.extend(result.get(stat) for stat in STATS_COLUMNS)
+        elif metric["type"] == "percentiles":
+            values.append(result.get("values"))
+        else:
+            values.append(result.get("value"))
+    return values
+
+
+def flatten(data, groups, metrics):
+    """Turn an aggregation response into {"columns", "rows", ...}."""
+    aggregations = data.get("aggregations", {})
+    total = data.get("hits", {}).get("total", {})
+    total = total.get("value") if isinstance(total, dict) else total
+    rows = []
+
+    def walk(bucket, depth, keys):
+        if depth == len(groups):
+            rows.append(keys + [bucket.get("doc_count", total)] + _metric_values(bucket, metrics))
+            return
+        for child in bucket.get(f"g{depth}", {}).get("buckets", []):
+            walk(child, depth + 1, keys + [child.get("key_as_string", child.get("key"))])
+
+    walk(dict(aggregations, doc_count=total), 0, [])
+    table = {"columns": columns(groups, metrics), "rows": rows, "total_hits": total}
+    other = aggregations.get("g0", {}).get("sum_other_doc_count")
+    if other:
+        table["other_doc_count"] = other
+    return table
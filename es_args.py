@@ -0,0 +1,77 @@
+import json
+
+# Tool arguments sometimes arrive as a string instead of an object, most often
+# several calls run together ('{"index":"a"}{"index":"b"}') or an object whose
+# opening brace was dropped ('"index":"a"}'). decode() walks the string once
+# with raw_decode and recovers every argument object it contains, so the
+# server can run them instead of answering with an error and a retry.
+
+_decoder = json.JSONDecoder()
+# Characters models put between concatenated objects
+_SEPARATORS = " \t\r\n,;"
+# Keys of MCP result content that sometimes gets echoed back into arguments
+_CONTENT_KEYS = {"content", "type", "text", "isError"}
+
+
+def _is_echoed_content(obj):
+    return bool(obj) and set(obj) <= _CONTENT_KEYS
+
+
+def _raw_decode(text, pos):
+    value, end = _decoder.raw_decode(text, pos)
+    if isinstance(value, str) and text[end:].lstrip()[:1] == ":":
+        # '"index": "a"}' - the opening brace is missing
+        value, end = _decoder.raw_decode("{" + text[pos:])
+        end += pos - 1
+    return value, end
+
+
+def decode(text):
+    """Return the argument objects contained in text, in order.
+
+    Raises ValueError when the string holds no recoverable object.
+    """
+    calls = []
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos] in _SEPARATORS:
+            pos += 1
+        if pos >= len(text):
+            break
+        try:
+            value, pos = _raw_decode(text, pos)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Could not parse tool arguments near {text[pos:pos + 40]!r}: {e.msg}. "
+                             "Pass a JSON object such as {\"index\": \"vehicles\"}.") from None
+        if isinstance(value, str) and value.lstrip()[:1] in ("{", "["):
+            # Arguments that were JSON-encoded twice
+            calls.extend(decode(value))
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            if not isinstance(item, dict):
+                raise ValueError(f"Tool arguments must be JSON objects, got {json.dumps(item)[:100]}")
+            if not _is_echoed_content(item):
+                calls.append(item)
+    return calls or [{}]
+
+
+def merge_index_calls(calls):
+    """Fold calls that differ only in their index into one {"indices": [...]} call.
+
+    Returns None when the calls carry different options and must run separately.
+    """
+    options = None
+    indices = []
+    for call in calls:
+        rest = {k: v for k, v in call.items() if k not in ("index", "indices")}
+        if options is None:
+            options = rest
+        elif rest != options:
+            return None
+        names = call.get("indices", call.get("index"))
+        if isinstance(names, str):
+            names = names.split(",")
+        if not isinstance(names, list) or not names:
+            return None
+        indices.extend(names)
+    return dict(options, indices=indices)
@@ -0,0 +1,411 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import es_json
+from es_validate import flatten_mapping
+
+# In-process caches for Elasticsearch metadata used by mcp_server.py.
+#   MCP_CATALOG_TTL       seconds an index listing (_cat/indices) is reused
+#   MCP_SCHEMA_TTL        seconds a mapping is reused
+#   MCP_SCHEMA_CACHE_SIZE maximum cached mappings (least recently used evicted first)
+#   MCP_QUERY_CACHE_MB    memory budget for cached search responses (0 disables the cache)
+#   MCP_QUERY_CACHE_CHECK seconds an index's refresh/indexing state is trusted before rechecking
+
+DEFAULT_CATALOG_TTL = 30.0
+DEFAULT_SCHEMA_TTL = 300.0
+DEFAULT_SCHEMA_CACHE_SIZE = 256
+DEFAULT_QUERY_CACHE_MB = 64
+DEFAULT_QUERY_CACHE_CHECK = 1.0
+
+
+class TTLCache:
+    """LRU mapping with a per-entry time to live."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        # Read without touching LRU order, expiry or hit counters
+        entry = self._data.get(key)
+        return None if entry is None else entry[1]
+
+    def pop(self, key, default=None):
+        # An expired entry is removed but reported as missing
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one awaited coroutine."""
+
+    def __init__(self):
+        self._pending = {}
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(factory())
+        self._pending[key] = future
+        future.add_done_callback(lambda f: self._pending.pop(key, None) if self._pending.get(key) is f else None)
+        # Shield so one cancelled caller does not abort the fetch other callers share
+        return await asyncio.shield(future)
+
+
+class SchemaCache:
+    """Caches the index catalog and per-index mappings.
+
+    Each mapping remembers the UUIDs of the indices it was built from; when a
+    fresher catalog shows a different UUID (the index was deleted and
+    recreated) the mapping is dropped and fetched again.
+    """
+
+    def __init__(self, transport, catalog_ttl=None, schema_ttl=None, maxsize=None):
+        self.es = transport
+        if catalog_ttl is None:
+            catalog_ttl = float(os.environ.get("MCP_CATALOG_TTL", DEFAULT_CATALOG_TTL))
+        if schema_ttl is None:
+            schema_ttl = float(os.environ.get("MCP_SCHEMA_TTL", DEFAULT_SCHEMA_TTL))
+        if maxsize is None:
+            maxsize = int(os.environ.get("MCP_SCHEMA_CACHE_SIZE", DEFAULT_SCHEMA_CACHE_SIZE))
+        self.catalog_ttl = catalog_ttl
+        self.mappings = TTLCache(maxsize, schema_ttl)
+        self._catalog = None
+        self._catalog_expires = 0.0
+        self.catalog_hits = 0
+        self.catalog_misses = 0
+        self._flight = SingleFlight()
+
+    async def catalog(self, force=False):
+        """Return {index_name: {"uuid": ..., ...}} for every index."""
+        if not force and self._catalog is not None and self._catalog_expires > time.monotonic():
+            self.catalog_hits += 1
+            return self._catalog
+        self.catalog_misses += 1
+        return await self._flight.do(("catalog",), self._fetch_catalog)
+
+    async def _fetch_catalog(self):
+        r = await self.es.get("/_cat/indices", params={"format": "json", "h": "index,uuid,health,status,docs.count"})
+        r.raise_for_status()
+        catalog = {row["index"]: row for row in r.json()}
+        self._catalog = catalog
+        self._catalog_expires = time.monotonic() + self.catalog_ttl
+        # Drop mappings whose index was recreated or deleted since they were cached
+        for key in self.mappings.keys():
+            entry = self.mappings.peek(key)
+            if entry is None:
+                continue
+            if any(catalog.get(name, {}).get("uuid") != uuid for name, uuid in entry["uuids"].items()):
+                self.mappings.pop(key)
+        return catalog
+
+    async def index_names(self, force=False):
+        return list((await self.catalog(force=force)).keys())
+
+    async def get_mapping(self, index, force=False):
+        """Return the _mapping response for index, or None if Elasticsearch says 404."""
+        if not force:
+            entry = self.mappings.get(index)
+            if entry is not None:
+                return entry["mapping"]
+        return await self._flight.do(("mapping", index), lambda: self._fetch_mapping(index))
+
+    async def _fetch_mapping(self, index):
+        r = await self.es.get(f"/{index}/_mapping")
+        if r.status_code == 404:
+            self.mappings.pop(index)
+            return None
+        r.raise_for_status()
+        mapping = r.json()
+        catalog = await self.catalog()
+        uuids = {name: catalog.get(name, {}).get("uuid") for name in mapping}
+        self.mappings.set(index, {"mapping": mapping, "uuids": uuids})
+        return mapping
+
+    async def get_fields(self, index):
+        """Return the flattened field index for index (see es_validate), or None if unknown."""
+        mapping = await self.get_mapping(index)
+        if not mapping:
+            return None
+        entry = self.mappings.peek(index)
+        if entry is None or entry["mapping"] is not mapping:
+            return flatten_mapping(mapping)
+        if "fields" not in entry:
+            entry["fields"] = flatten_mapping(mapping)
+        return entry["fields"]
+
+    async def get_mappings(self, indices):
+        """Return {index: mapping or None} using one _mapping request for every cache miss."""
+        result = {}
+        missing = []
+        for index in indices:
+            entry = self.mappings.get(index)
+            if entry is not None:
+                result[index] = entry["mapping"]
+            else:
+                missing.append(index)
+        if not missing:
+            return result
+        r = await self.es.get(f"/{','.join(missing)}/_mapping", params={"ignore_unavailable": "true", "allow_no_indices": "true"})
+        r.raise_for_status()
+        combined = r.json()
+        catalog = await self.catalog()
+        unresolved = []
+        for index in missing:
+            if index in combined:
+                mapping = {index: combined[index]}
+                self.mappings.set(index, {"mapping": mapping, "uuids": {index: catalog.get(index, {}).get("uuid")}})
+                result[index] = mapping
+            else:
+                # Patterns and aliases come back under concrete index names, and a
+                # missing index is simply absent, so resolve these one at a time
+                unresolved.append(index)
+        if unresolved:
+            fetched = await asyncio.gather(*(self.get_mapping(index) for index in unresolved))
+            result.update(zip(unresolved, fetched))
+        return result
+
+    def prime(self, index, mapping, uuid, age=0.0):
+        """Seed the mapping for index, read age seconds ago elsewhere (an index profile), unless one is cached.
+
+        The entry expires when a mapping fetched at that time would have, so
+        primed mappings are never older than MCP_SCHEMA_TTL.
+        """
+        ttl = self.mappings.ttl - age
+        if ttl > 0 and self.mappings.peek(index) is None:
+            self.mappings.set(index, {"mapping": mapping, "uuids": {name: uuid for name in mapping}}, ttl=ttl)
+
+    def invalidate(self, index=None):
+        if index is None:
+            self.mappings.clear()
+            self._catalog = None
+            self._catalog_expires = 0.0
+            return
+        for key in self.mappings.keys():
+            entry = self.mappings.peek(key)
+            if key == index or (entry is not None and index in entry["uuids"]):
+                self.mappings.pop(key)
+        self._catalog_expires = 0.0
+
+    def stats(self):
+        total = self.catalog_hits + self.catalog_misses
+        return {
+            "catalog": {
+                "hits": self.catalog_hits,
+                "misses": self.catalog_misses,
+                "hit_rate": round(self.catalog_hits / total, 4) if total else None,
+                "indices": len(self._catalog or {}),
+            },
+            "mappings": self.mappings.stats(),
+            "coalesced": self._flight.coalesced,
+        }
+
+
+class QueryCache:
+    """Caches successful _search responses keyed on index plus canonical query.
+
+    Every entry is tagged with the index state it was computed against
+    (UUIDs, refresh and indexing counters from _stats). A lookup first checks
+    that state, re-reading it at most every check_interval seconds, so new
+    documents become visible to cached queries once a refresh makes them
+    searchable. When there is no entry to check, the state is read alongside
+    the search rather than before it, and the response is only stored if the
+    state did not change since it was last read. Identical queries that are
+    already running share one request.
+    """
+
+    def __init__(self, transport, max_bytes=None, check_interval=None):
+        self.es = transport
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("MCP_QUERY_CACHE_MB", DEFAULT_QUERY_CACHE_MB)) * 1024 * 1024)
+        if check_interval is None:
+            check_interval = float(os.environ.get("MCP_QUERY_CACHE_CHECK", DEFAULT_QUERY_CACHE_CHECK))
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.uncacheable = 0
+        self._entries = OrderedDict()
+        self._states = TTLCache(1024, check_interval)
+        # Last state read per index, kept after the check interval has passed
+        self._known = {}
+        self._state_flight = SingleFlight()
+        self._flight = SingleFlight()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def canonical(body):
+        # Key order and whitespace do not change a query's meaning
+        return es_json.dumps(body, sort_keys=True)
+
+    async def index_state(self, index):
+        state = self._states.get(index)
+        if state is None:
+            state = await self._state_flight.do(index, lambda: self._fetch_state(index))
+        return state
+
+    async def _fetch_state(self, index):
+        r = await self.es.get(f"/{index}/_stats/refresh,indexing,docs")
+        if r.status_code != 200:
+            return None
+        data = r.json()
+        primaries = data.get("_all", {}).get("primaries", {})
+        refresh = primaries.get("refresh", {})
+        indexing = primaries.get("indexing", {})
+        state = (
+            tuple(sorted((name, info.get("uuid")) for name, info in data.get("indices", {}).items())),
+            refresh.get("external_total", refresh.get("total")),
+            indexing.get("index_total"),
+            indexing.get("delete_total"),
+            primaries.get("docs", {}).get("count"),
+        )
+        self._states.set(index, state)
+        self._known[index] = state
+        return state
+
+    async def search(self, index, body, fetch, endpoint="_search"):
+        """Return fetch()'s response for (index, endpoint, body), from cache when still valid."""
+        if not self.enabled:
+            return await fetch()
+        canonical = self.canonical(body)
+        if "pit" in body or '"now' in canonical:
+            # Point-in-time reads and relative date math cannot be reused safely
+            self.uncacheable += 1
+            return await fetch()
+        key = (index, endpoint, canonical)
+        state = self._states.get(index)
+        if state is None:
+            if key not in self._entries:
+                return await self._search_uncached(index, key, fetch)
+            state = await self.index_state(index)
+        if state is None:
+            self.uncacheable += 1
+            return await fetch()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] == state:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self._remove(key)
+            self.invalidations += 1
+        self.misses += 1
+        response = await self._flight.do((key, state), fetch)
+        if response.status_code == 200:
+            self._store(key, state, response)
+        return response
+
+    async def _search_uncached(self, index, key, fetch):
+        # One round trip instead of two: _stats and the search run together
+        previous = self._known.get(index)
+        self.misses += 1
+        state, response = await asyncio.gather(self.index_state(index), self._flight.do((key, previous), fetch),
+                                               return_exceptions=True)
+        if isinstance(response, BaseException):
+            raise response
+        if isinstance(state, BaseException) or state is None:
+            self.uncacheable += 1
+        elif state == previous and response.status_code == 200:
+            # The index did not change around the search, so the response belongs to this state
+            self._store(key, state, response)
+        return response
+
+    def _store(self, key, state, response):
+        size = len(response.content) + sum(len(part) for part in key)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (state, size, response)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, index=None):
+        for key in list(self._entries):
+            if index is None or key[0] == index:
+                self._remove(key)
+        if index is None:
+            self._states.clear()
+            self._known.clear()
+        else:
+            self._states.pop(index)
+            self._known.pop(index, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "coalesced": self._flight.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "uncacheable": self.uncacheable,
+        }
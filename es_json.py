@@ -0,0 +1,37 @@
+import json
+
+# JSON encoding for tool results and Elasticsearch bodies. orjson is used when
+# it is installed (several times faster on large hit lists); the standard
+# library is the fallback and produces the same compact output.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_bytes(obj, indent=False, sort_keys=False):
+    if orjson is not None:
+        option = 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass  # e.g. integers wider than 64 bits; let json handle them
+    if indent:
+        text = json.dumps(obj, indent=2, sort_keys=sort_keys, ensure_ascii=False)
+    else:
+        text = json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys, ensure_ascii=False)
+    return text.encode("utf-8")
+
+
+def dumps(obj, indent=False, sort_keys=False):
+    return dumps_bytes(obj, indent=indent, sort_keys=sort_keys).decode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
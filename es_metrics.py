@@ -0,0 +1,286 @@
+import bisect
+import contextvars
+import os
+import sys
+import time
+
+import es_json
+
+# In-process instrumentation for mcp_server.py. Tool calls record wall time
+# split into argument decoding, Elasticsearch round trips (with the server-side
+# "took" for searches) and result encoding. Every Elasticsearch request is
+# recorded per endpoint through the transport hook. MCP_SLOW_CALL_MS logs
+# calls slower than that to stderr (0, the default, disables it).
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+SLOW_CALL_ARGS_CHARS = 300
+# Label for tools/call requests naming a tool the server does not have
+UNKNOWN_TOOL = "unknown"
+
+# Per-call accumulator that the transport hook adds Elasticsearch time to
+_current_call = contextvars.ContextVar("es_metrics_call", default=None)
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (capped at the observed max)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def snapshot(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count, 3),
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 3),
+        }
+
+
+class _ToolStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.decode_ms = 0.0
+        self.encode_ms = 0.0
+        self.es_ms = 0.0
+        self.es_took_ms = 0.0
+        self.es_requests = 0
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = {}
+        self.errors = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.took_ms = 0.0
+        self.took_count = 0
+        self.took_wall_ms = 0.0
+
+
+def _label(value):
+    """Escape a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def endpoint(path):
+    """Collapse a request path to its API name: "/vehicles/_search" -> "_search"."""
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    for i, part in enumerate(parts):
+        if part.startswith("_"):
+            return "/".join(parts[i:i + 2]) if part == "_cat" else part
+    return "/" + parts[0] if parts[0] else "/"
+
+
+class Metrics:
+    def __init__(self, slow_call_ms=None, log=None):
+        if slow_call_ms is None:
+            slow_call_ms = float(os.environ.get("MCP_SLOW_CALL_MS", "0"))
+        self.slow_call_ms = slow_call_ms
+        self.log = log or sys.stderr
+        self.started = time.time()
+        self.tools = {}
+        self.endpoints = {}
+        self.queue_wait = Histogram()
+
+    def begin_call(self):
+        """Start attributing Elasticsearch time in the current task to a new call."""
+        call = {"es_ms": 0.0, "took_ms": 0.0, "es_requests": 0}
+        _current_call.set(call)
+        return call
+
+    def end_call(self, tool, call, wall_ms, decode_ms=0.0, encode_ms=0.0, bytes_in=0, bytes_out=0, error=None, args=None):
+        stats = self.tools.setdefault(tool, _ToolStats())
+        stats.latency.observe(wall_ms)
+        stats.bytes_in += bytes_in
+        stats.bytes_out += bytes_out
+        stats.decode_ms += decode_ms
+        stats.encode_ms += encode_ms
+        stats.es_ms += call["es_ms"]
+        stats.es_took_ms += call["took_ms"]
+        stats.es_requests += call["es_requests"]
+        if error is not None:
+            name = type(error).__name__
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+        if self.slow_call_ms and wall_ms >= self.slow_call_ms:
+            self._log_slow(tool, call, wall_ms, decode_ms, encode_ms, bytes_out, error, args)
+
+    def _log_slow(self, tool, call, wall_ms, decode_ms, encode_ms, bytes_out, error, args):
+        text = args if isinstance(args, str) else es_json.dumps(args)
+        if len(text) > SLOW_CALL_ARGS_CHARS:
+            text = text[:SLOW_CALL_ARGS_CHARS] + "..."
+        outcome = f" error={type(error).__name__}" if error is not None else ""
+        print(f"slow call: {tool} {wall_ms:.1f} ms (es {call['es_ms']:.1f} ms over {call['es_requests']} request(s), "
+              f"took {call['took_ms']:.0f} ms, decode {decode_ms:.1f} ms, encode {encode_ms:.1f} ms, "
+              f"{bytes_out} bytes out){outcome} args={text}", file=self.log, flush=True)
+
+    def observe_queue_wait(self, wait_ms):
+        self.queue_wait.observe(wait_ms)
+
+    def es_request(self, method, path, response, bytes_sent, elapsed, error=None):
+        """Transport hook: record one Elasticsearch request (including its retries)."""
+        name = endpoint(path)
+        stats = self.endpoints.setdefault(name, _EndpointStats())
+        wall_ms = elapsed * 1000.0
+        stats.latency.observe(wall_ms)
+        stats.bytes_sent += bytes_sent
+        took = None
+        if response is not None:
+            stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+            stats.bytes_received += len(response.content)
+            if response.status_code == 200 and name in ("_search", "_msearch"):
+                try:
+                    took = response.json().get("took")
+                except ValueError:
+                    pass
+            if took is not None:
+                stats.took_ms += took
+                stats.took_count += 1
+                stats.took_wall_ms += wall_ms
+        if error is not None:
+            error_name = type(error).__name__
+            stats.errors[error_name] = stats.errors.get(error_name, 0) + 1
+        call = _current_call.get()
+        if call is not None:
+            call["es_ms"] += wall_ms
+            call["es_requests"] += 1
+            call["took_ms"] += took or 0
+
+    def snapshot(self, caches=None):
+        tools = {}
+        for name, s in sorted(self.tools.items()):
+            calls = s.latency.count
+            tools[name] = {
+                "latency": s.latency.snapshot(),
+                "errors": dict(s.errors),
+                "bytes_in": s.bytes_in,
+                "bytes_out": s.bytes_out,
+                "avg_bytes_out": s.bytes_out // calls if calls else 0,
+                # Average time per call by phase; concurrent Elasticsearch requests can add up to more than wall
+                "avg_ms": {
+                    "wall": round(s.latency.sum / calls, 3) if calls else 0,
+                    "elasticsearch": round(s.es_ms / calls, 3) if calls else 0,
+                    "es_took": round(s.es_took_ms / calls, 3) if calls else 0,
+                    "decode_args": round(s.decode_ms / calls, 3) if calls else 0,
+                    "encode_result": round(s.encode_ms / calls, 3) if calls else 0,
+                },
+                "es_requests": s.es_requests,
+            }
+        endpoints = {}
+        for name, s in sorted(self.endpoints.items()):
+            entry = {
+                "latency": s.latency.snapshot(),
+                "statuses": {str(k): v for k, v in sorted(s.statuses.items())},
+                "errors": dict(s.errors),
+                "bytes_sent": s.bytes_sent,
+                "bytes_received": s.bytes_received,
+            }
+            if s.took_count:
+                # took is time inside Elasticsearch; the rest is network, queuing and (de)serialization
+                entry["avg_took_ms"] = round(s.took_ms / s.took_count, 3)
+                entry["avg_overhead_ms"] = round((s.took_wall_ms - s.took_ms) / s.took_count, 3)
+            endpoints[name] = entry
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "tools": tools,
+            "elasticsearch": endpoints,
+            "queue_wait": self.queue_wait.snapshot(),
+            "caches": caches or {},
+        }
+
+    def prometheus(self, caches=None):
+        """Render the counters in Prometheus text exposition format (times in seconds)."""
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, labels, h):
+            prefix = labels + "," if labels else ""
+            suffix = "{" + labels + "}" if labels else ""
+            cumulative = 0
+            for bound, count in zip(h.bounds, h.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound / 1000.0:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {h.count}')
+            lines.append(f"{name}_sum{suffix} {h.sum / 1000.0:.6f}")
+            lines.append(f"{name}_count{suffix} {h.count}")
+
+        header("mcp_tool_duration_seconds", "histogram", "Wall time of tools/call requests.")
+        for name, s in sorted(self.tools.items()):
+            histogram("mcp_tool_duration_seconds", f'tool="{_label(name)}"', s.latency)
+        header("mcp_tool_errors_total", "counter", "Failed tools/call requests by exception class.")
+        for name, s in sorted(self.tools.items()):
+            for error, count in sorted(s.errors.items()):
+                lines.append(f'mcp_tool_errors_total{{tool="{_label(name)}",error="{_label(error)}"}} {count}')
+        for metric, attr, text in (("mcp_tool_request_bytes_total", "bytes_in", "Argument bytes received."),
+                                   ("mcp_tool_response_bytes_total", "bytes_out", "Result bytes returned.")):
+            header(metric, "counter", text)
+            for name, s in sorted(self.tools.items()):
+                lines.append(f'{metric}{{tool="{_label(name)}"}} {getattr(s, attr)}')
+        for metric, attr, text in (("mcp_tool_es_seconds_total", "es_ms", "Elasticsearch round-trip time spent by tool calls."),
+                                   ("mcp_tool_es_took_seconds_total", "es_took_ms", "Server-side took reported to tool calls."),
+                                   ("mcp_tool_decode_seconds_total", "decode_ms", "Time spent decoding string arguments."),
+                                   ("mcp_tool_encode_seconds_total", "encode_ms", "Time spent encoding results.")):
+            header(metric, "counter", text)
+            for name, s in sorted(self.tools.items()):
+                lines.append(f'{metric}{{tool="{_label(name)}"}} {getattr(s, attr) / 1000.0:.6f}')
+
+        header("mcp_es_request_duration_seconds", "histogram", "Elasticsearch request wall time, retries included.")
+        for name, s in sorted(self.endpoints.items()):
+            histogram("mcp_es_request_duration_seconds", f'endpoint="{_label(name)}"', s.latency)
+        header("mcp_es_responses_total", "counter", "Elasticsearch responses by status.")
+        for name, s in sorted(self.endpoints.items()):
+            for status, count in sorted(s.statuses.items()):
+                lines.append(f'mcp_es_responses_total{{endpoint="{_label(name)}",status="{_label(status)}"}} {count}')
+        header("mcp_es_errors_total", "counter", "Elasticsearch requests that failed without a response.")
+        for name, s in sorted(self.endpoints.items()):
+            for error, count in sorted(s.errors.items()):
+                lines.append(f'mcp_es_errors_total{{endpoint="{_label(name)}",error="{_label(error)}"}} {count}')
+        for metric, attr, text in (("mcp_es_sent_bytes_total", "bytes_sent", "Request body bytes sent (after gzip)."),
+                                   ("mcp_es_received_bytes_total", "bytes_received", "Response body bytes received.")):
+            header(metric, "counter", text)
+            for name, s in sorted(self.endpoints.items()):
+                lines.append(f'{metric}{{endpoint="{_label(name)}"}} {getattr(s, attr)}')
+        header("mcp_es_took_seconds_total", "counter", "Sum of took reported by Elasticsearch.")
+        for name, s in sorted(self.endpoints.items()):
+            if s.took_count:
+                lines.append(f'mcp_es_took_seconds_total{{endpoint="{_label(name)}"}} {s.took_ms / 1000.0:.6f}')
+
+        header("mcp_queue_wait_seconds", "histogram", "Time requests waited for a concurrency slot.")
+        histogram("mcp_queue_wait_seconds", "", self.queue_wait)
+        for metric, key, text in (("mcp_cache_hits_total", "hits", "Cache hits."),
+                                  ("mcp_cache_misses_total", "misses", "Cache misses.")):
+            header(metric, "counter", text)
+            for name, stats in sorted((caches or {}).items()):
+                lines.append(f'{metric}{{cache="{_label(name)}"}} {stats.get(key, 0)}')
+        return "\n".join(lines) + "\n"
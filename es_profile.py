@@ -0,0 +1,362 @@
+import asyncio
+import contextvars
+import os
+import random
+import sys
+import tempfile
+import time
+
+import es_json
+from es_validate import flatten_mapping, NUMERIC_TYPES
+
+# Per-index profiles for mcp_server.py: every field with its type, value
+# cardinality and top terms, numeric/date ranges, and a random sample of
+# documents. A profile is built in the background with one _msearch
+# (aggregations plus a random_score sample), kept in memory and written to a
+# snapshot file, so a restarted server can answer sample_docs without asking
+# Elasticsearch. A profile is used only while the index catalog still shows
+# the same index UUID and a document count within MCP_PROFILE_DRIFT of the
+# profiled one. Profiles younger than the schema cache TTL also seed the
+# SchemaCache, which get_mappings answers from.
+#
+#   MCP_PROFILES          0 disables profiles
+#   MCP_PROFILE_PATH      snapshot file (default .mcp_profiles.json next to this file; empty keeps profiles in memory)
+#   MCP_PROFILE_SAMPLE    random documents kept per index
+#   MCP_PROFILE_TOP_TERMS most frequent values kept per field
+#   MCP_PROFILE_MAX_AGE   seconds after which a profile that still matches the catalog is rebuilt anyway
+#   MCP_PROFILE_DRIFT     share of the document count that may change before a profile is no longer used
+#   MCP_PROFILE_MIN_INTERVAL  minimum seconds between background rebuilds of one index
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mcp_profiles.json")
+DEFAULT_SAMPLE = 20
+DEFAULT_TOP_TERMS = 5
+DEFAULT_MAX_AGE = 3600
+DEFAULT_DRIFT = 0.1
+DEFAULT_MIN_INTERVAL = 300
+# Aggregated fields per index, and indices profiled when the server starts
+MAX_FIELDS = 200
+WARM_MAX_INDICES = 20
+SNAPSHOT_VERSION = 1
+DATE_TYPES = {"date", "date_nanos"}
+TERMS_TYPES = NUMERIC_TYPES | {"keyword", "constant_keyword", "boolean", "ip"}
+RANGE_TYPES = NUMERIC_TYPES | DATE_TYPES
+CARDINALITY_TYPES = TERMS_TYPES | DATE_TYPES
+
+
+def profile_aggs(fields, top_terms):
+    """Return (aggs, names): cardinality, terms and stats aggregations for every
+    aggregatable field, wrapped in nested aggregations where the mapping needs
+    it, and {agg name prefix: field path}."""
+    aggs = {}
+    names = {}
+    scopes = {}
+    for path, info in sorted(fields.items()):
+        types = info["types"]
+        if not types <= CARDINALITY_TYPES:
+            continue
+        if len(names) >= MAX_FIELDS:
+            break
+        name = f"f{len(names)}"
+        names[name] = path
+        target = aggs
+        if info["nested"]:
+            if info["nested"] not in scopes:
+                scopes[info["nested"]] = f"nested{len(scopes)}"
+                aggs[scopes[info["nested"]]] = {"nested": {"path": info["nested"]}, "aggs": {}}
+            target = aggs[scopes[info["nested"]]]["aggs"]
+        target[name + "_card"] = {"cardinality": {"field": path}}
+        if types <= TERMS_TYPES:
+            target[name + "_terms"] = {"terms": {"field": path, "size": top_terms}}
+        if types <= RANGE_TYPES:
+            target[name + "_stats"] = {"stats": {"field": path}}
+    return aggs, names
+
+
+def _collect(aggregations, out=None):
+    # Lift the results inside nested aggregations up to one flat dict
+    out = {} if out is None else out
+    for name, value in (aggregations or {}).items():
+        if name.startswith("nested") and isinstance(value, dict):
+            _collect({k: v for k, v in value.items() if isinstance(v, dict)}, out)
+        elif isinstance(value, dict):
+            out[name] = value
+    return out
+
+
+def summarize_fields(fields, names, aggregations):
+    """{path: {"type", "cardinality", "top_terms", "min", "max", ...}} for every leaf field."""
+    values = _collect(aggregations)
+    prefixes = {path: name for name, path in names.items()}
+    summary = {}
+    for path, info in sorted(fields.items()):
+        if info["types"] == {"object"}:
+            continue
+        entry = {"type": "/".join(sorted(info["types"]))}
+        if info["nested"]:
+            entry["nested"] = info["nested"]
+        if info["keyword"]:
+            entry["keyword"] = info["keyword"]
+        name = prefixes.get(path)
+        if name is not None:
+            if name + "_card" in values:
+                entry["cardinality"] = values[name + "_card"].get("value")
+            if name + "_terms" in values:
+                entry["top_terms"] = [{"value": b.get("key_as_string", b["key"]), "count": b["doc_count"]}
+                                      for b in values[name + "_terms"].get("buckets", [])]
+            stats = values.get(name + "_stats")
+            if stats and stats.get("count"):
+                entry["min"] = stats.get("min_as_string", stats.get("min"))
+                entry["max"] = stats.get("max_as_string", stats.get("max"))
+        summary[path] = entry
+    return summary
+
+
+def _count(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _matches(profile, row):
+    # Recreating an index changes its UUID; indexing or deleting documents changes the count
+    return (profile is not None and row is not None and row.get("uuid") == profile["catalog"]["uuid"]
+            and row.get("docs.count") == profile["catalog"]["docs.count"])
+
+
+def _usable(profile, row, drift):
+    # Same index, and the document count moved by no more than drift of its profiled size
+    if profile is None or row is None or row.get("uuid") != profile["catalog"]["uuid"]:
+        return False
+    now, then = _count(row.get("docs.count")), _count(profile["catalog"]["docs.count"])
+    if now is None or then is None:
+        return row.get("docs.count") == profile["catalog"]["docs.count"]
+    return abs(now - then) <= drift * max(now, then)
+
+
+def _reason(item):
+    error = item.get("error", {})
+    if isinstance(error, dict):
+        return error.get("root_cause", [{}])[0].get("reason", error.get("reason", str(error)))
+    return str(error)
+
+
+class ProfileStore:
+    """Index profiles, checked against the SchemaCache catalog and persisted to a snapshot file."""
+
+    def __init__(self, transport, schema, path=None, log=None):
+        self.es = transport
+        self.schema = schema
+        self.enabled = os.environ.get("MCP_PROFILES", "1") not in ("0", "false", "no", "")
+        self.path = os.environ.get("MCP_PROFILE_PATH", DEFAULT_PATH) if path is None else path
+        self.sample_size = int(os.environ.get("MCP_PROFILE_SAMPLE", DEFAULT_SAMPLE))
+        self.top_terms = int(os.environ.get("MCP_PROFILE_TOP_TERMS", DEFAULT_TOP_TERMS))
+        self.max_age = float(os.environ.get("MCP_PROFILE_MAX_AGE", DEFAULT_MAX_AGE))
+        self.drift = float(os.environ.get("MCP_PROFILE_DRIFT", DEFAULT_DRIFT))
+        self.min_interval = float(os.environ.get("MCP_PROFILE_MIN_INTERVAL", DEFAULT_MIN_INTERVAL))
+        self.log = log or sys.stderr
+        self.profiles = {}
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.build_errors = 0
+        self._building = {}
+        # When each index was last (re)built or attempted, to space out rebuilds
+        self._attempts = {}
+        self._save_lock = asyncio.Lock()
+        if self.enabled:
+            self.load()
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = es_json.loads(f.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"elastic-mcp: ignoring unreadable profile snapshot {self.path}: {e}", file=self.log, flush=True)
+            return
+        if isinstance(data, dict) and data.get("version") == SNAPSHOT_VERSION:
+            self.profiles = data.get("profiles") or {}
+            for index, profile in self.profiles.items():
+                self._prime(index, profile)
+
+    def _prime(self, index, profile):
+        self.schema.prime(index, profile["mapping"], profile["catalog"]["uuid"], age=time.time() - profile["built_at"])
+
+    async def save(self):
+        if not self.path:
+            return
+        async with self._save_lock:
+            data = es_json.dumps_bytes({"version": SNAPSHOT_VERSION, "profiles": self.profiles})
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+            except OSError as e:
+                print(f"elastic-mcp: could not write profile snapshot {self.path}: {e}", file=self.log, flush=True)
+
+    def _write(self, data):
+        # Write a temporary file and rename it, so a crash never leaves half a snapshot
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".mcp_profiles.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    async def fresh(self, index):
+        """Return the profile of index if it still matches the catalog, else None.
+
+        A missing or outdated profile of a concrete index is rebuilt in the
+        background, at most once every min_interval seconds.
+        """
+        if not self.enabled:
+            return None
+        profile = self.profiles.get(index)
+        row = (await self.schema.catalog()).get(index)
+        if _usable(profile, row, self.drift):
+            self.hits += 1
+            self._prime(index, profile)
+            if not _matches(profile, row) or time.time() - profile["built_at"] > self.max_age:
+                self.schedule(index)
+            return profile
+        self.misses += 1
+        if row is not None:
+            self.schedule(index)
+        return None
+
+    async def get(self, index):
+        """Return a fresh profile of index, building it now if needed; None if index is not a concrete index."""
+        if not self.enabled:
+            raise ValueError("Index profiles are disabled (MCP_PROFILES=0)")
+        profile = await self.fresh(index)
+        if profile is not None:
+            return profile
+        self.schedule(index, force=True)
+        task = self._building.get(index)
+        if task is None:
+            return None
+        # Shielded: a cancelled tool call should not throw away a build others may be waiting on
+        return await asyncio.shield(task)
+
+    def schedule(self, index, force=False):
+        if index in self._building:
+            return
+        if not force:
+            # An index being written to drifts constantly; profiling it again on
+            # every catalog refresh would cost a full aggregation each time
+            profile = self.profiles.get(index)
+            last = max(self._attempts.get(index, 0.0), profile["built_at"] if profile else 0.0)
+            if time.time() - last < self.min_interval:
+                return
+        self._attempts[index] = time.time()
+        # A fresh context, so the build's Elasticsearch time is not billed to the tool call that triggered it
+        task = contextvars.Context().run(asyncio.ensure_future, self.build(index))
+        self._building[index] = task
+        task.add_done_callback(lambda t: self._built(index, t))
+
+    def _built(self, index, task):
+        if self._building.get(index) is task:
+            del self._building[index]
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.build_errors += 1
+            print(f"elastic-mcp: profiling '{index}' failed: {error}", file=self.log, flush=True)
+
+    async def build(self, index):
+        row = (await self.schema.catalog()).get(index)
+        if row is None:
+            return None
+        mapping = await self.schema.get_mapping(index)
+        if not mapping:
+            return None
+        fields = flatten_mapping(mapping)
+        aggs, names = profile_aggs(fields, self.top_terms)
+        stats_body = {"size": 0, "track_total_hits": True}
+        if aggs:
+            stats_body["aggs"] = aggs
+        sample_body = {"size": self.sample_size, "query": {"function_score": {
+            "random_score": {"seed": random.randrange(2 ** 31), "field": "_seq_no"}, "boost_mode": "replace"}}}
+        lines = [{"index": index}, stats_body, {"index": index}, sample_body]
+        r = await self.es.post("/_msearch", body=lines, ndjson=True)
+        r.raise_for_status()
+        responses = r.json().get("responses", [])
+        if len(responses) != 2:
+            raise RuntimeError(f"unexpected _msearch response for '{index}'")
+        for item in responses:
+            if "error" in item:
+                raise RuntimeError(_reason(item))
+        stats, sample = responses
+        hits = []
+        for hit in sample["hits"]["hits"]:
+            # Random scores carry no meaning for the reader
+            hit = dict(hit)
+            hit.pop("_score", None)
+            hits.append(hit)
+        total = stats["hits"].get("total")
+        profile = {
+            "index": index,
+            "catalog": {"uuid": row.get("uuid"), "docs.count": row.get("docs.count")},
+            "built_at": time.time(),
+            "doc_count": total.get("value") if isinstance(total, dict) else total,
+            "mapping": mapping,
+            "fields": summarize_fields(fields, names, stats.get("aggregations")),
+            "sample": hits,
+        }
+        self.profiles[index] = profile
+        self.builds += 1
+        await self.save()
+        return profile
+
+    async def warm(self):
+        """Profile open, non-hidden indices that lack a fresh profile, one at a time."""
+        if not self.enabled:
+            return
+        try:
+            catalog = await self.schema.catalog()
+        except Exception as e:
+            print(f"elastic-mcp: skipping profile warm-up: {e}", file=self.log, flush=True)
+            return
+        for index in [name for name in self.profiles if name not in catalog]:
+            del self.profiles[index]
+        names = [name for name, row in catalog.items() if not name.startswith(".") and row.get("status", "open") == "open"]
+        for index in names[:WARM_MAX_INDICES]:
+            profile = self.profiles.get(index)
+            if _usable(profile, catalog[index], self.drift) and time.time() - profile["built_at"] <= self.max_age:
+                continue
+            self.schedule(index)
+            task = self._building.get(index)
+            if task is not None:
+                # Failures are logged by _built; carry on with the next index
+                await asyncio.wait([task])
+
+    def invalidate(self, index=None):
+        if index is None:
+            self.profiles.clear()
+            self._attempts.clear()
+        else:
+            self.profiles.pop(index, None)
+            self._attempts.pop(index, None)
+
+    def close(self):
+        for task in list(self._building.values()):
+            task.cancel()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "profiles": len(self.profiles),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "builds": self.builds,
+            "build_errors": self.build_errors,
+            "building": len(self._building),
+            "path": self.path or None,
+        }
@@ -0,0 +1,161 @@
+import math
+
+import es_json
+
+# Response shaping shared by the data-returning tools: _source/fields
+# projection passed to Elasticsearch, a "rows" mode that flattens hits to
+# plain documents, and a byte/token budget that trims result lists cleanly.
+
+# Rough bytes per model token, used to turn max_tokens into a byte budget
+BYTES_PER_TOKEN = 4
+
+SHAPING_PROPERTIES = {
+    "source_includes": {"type": "array", "items": {"type": "string"}, "description": "Only return these _source fields (wildcards allowed), e.g. [\"make\", \"price\"]."},
+    "source_excludes": {"type": "array", "items": {"type": "string"}, "description": "Drop these _source fields from every hit."},
+    "fields": {"type": "array", "items": {"type": "string"}, "description": "Retrieve these fields via the Elasticsearch fields API (includes runtime and multi-fields)."},
+    "rows": {"type": "boolean", "description": "Return plain documents instead of raw hits (no _index, _id, _score wrappers).", "default": False},
+}
+
+BUDGET_PROPERTIES = {
+    "max_bytes": {"type": "integer", "description": "Trim the result to about this many bytes of JSON and report what was dropped."},
+    "max_tokens": {"type": "integer", "description": f"Same as max_bytes, counted in approximate tokens ({BYTES_PER_TOKEN} bytes each)."},
+}
+
+
+def apply_source_options(body, args):
+    """Return a copy of a search body with the requested projection applied."""
+    includes = args.get("source_includes")
+    excludes = args.get("source_excludes")
+    fields = args.get("fields")
+    if not (includes or excludes or fields):
+        return body
+    body = dict(body)
+    if includes or excludes:
+        source = {}
+        if includes:
+            source["includes"] = includes if isinstance(includes, list) else [includes]
+        if excludes:
+            source["excludes"] = excludes if isinstance(excludes, list) else [excludes]
+        body["_source"] = source
+    if fields:
+        body["fields"] = fields if isinstance(fields, list) else [fields]
+        if not includes and "_source" not in body:
+            # The fields API already carries the values
+            body["_source"] = False
+    return body
+
+
+def hit_to_row(hit):
+    row = dict(hit.get("_source") or {})
+    for name, values in (hit.get("fields") or {}).items():
+        if name not in row:
+            row[name] = values[0] if isinstance(values, list) and len(values) == 1 else values
+    return row
+
+
+def shape_hits(hits, args):
+    if args.get("rows"):
+        return [hit_to_row(hit) for hit in hits]
+    return hits
+
+
+def shape_search_response(data, args):
+    if not args.get("rows"):
+        return data
+    hits = data.get("hits", {})
+    shaped = {"rows": [hit_to_row(hit) for hit in hits.get("hits", [])]}
+    total = hits.get("total")
+    if total is not None:
+        shaped["total"] = total.get("value") if isinstance(total, dict) else total
+    if "aggregations" in data:
+        shaped["aggregations"] = data["aggregations"]
+    return shaped
+
+
+def budget_bytes(args):
+    if not isinstance(args, dict):
+        return None
+    if args.get("max_bytes"):
+        return int(args["max_bytes"])
+    if args.get("max_tokens"):
+        return int(args["max_tokens"]) * BYTES_PER_TOKEN
+    return None
+
+
+def _trimmable_lists(obj, path=()):
+    # Lists of hits/rows/documents that can lose items from the end without
+    # breaking the response shape. Documents themselves are never descended into.
+    if isinstance(obj, list):
+        yield path
+        return
+    if not isinstance(obj, dict):
+        return
+    for key, value in obj.items():
+        if key in ("hits", "rows", "response") and isinstance(value, list):
+            yield path + (key,)
+        elif key in ("hits", "response") and isinstance(value, dict):
+            yield from _trimmable_lists(value, path + (key,))
+        elif key == "results" and isinstance(value, dict):
+            for name, item in value.items():
+                yield from _trimmable_lists(item, path + (key, name))
+        elif key == "results" and isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, dict):
+                    yield from _trimmable_lists(item, path + (key, i))
+
+
+def _get(obj, path):
+    for key in path:
+        obj = obj[key]
+    return obj
+
+
+def _replace(obj, path, value):
+    # Copy only the containers along path so cached responses are never mutated
+    if not path:
+        return value
+    copy = list(obj) if isinstance(obj, list) else dict(obj)
+    copy[path[0]] = _replace(obj[path[0]], path[1:], value)
+    return copy
+
+
+def _trim(result, paths, fraction):
+    trimmed = result
+    kept = dropped = 0
+    for path in paths:
+        items = _get(result, path)
+        keep = int(math.floor(len(items) * fraction))
+        kept += keep
+        dropped += len(items) - keep
+        trimmed = _replace(trimmed, path, items[:keep])
+    return trimmed, kept, dropped
+
+
+def fit_budget(result, max_bytes, indent=False):
+    """Return (result, text) with list results trimmed so text fits in max_bytes."""
+    text = es_json.dumps(result, indent=indent)
+    if not max_bytes or len(text.encode("utf-8")) <= max_bytes:
+        return result, text
+    wrapped = isinstance(result, list)
+    if wrapped:
+        result = {"hits": result}
+    paths = [p for p in _trimmable_lists(result) if _get(result, p)]
+    best = None
+    low, high = 0.0, 1.0
+    # Binary search for the largest share of every list that fits the budget
+    for _ in range(12):
+        fraction = (low + high) / 2
+        candidate, kept, dropped = _trim(result, paths, fraction)
+        candidate = dict(candidate, _truncated={"kept": kept, "dropped": dropped, "max_bytes": max_bytes})
+        candidate_text = es_json.dumps(candidate, indent=indent)
+        if len(candidate_text.encode("utf-8")) <= max_bytes:
+            best = (candidate, candidate_text)
+            low = fraction
+        else:
+            high = fraction
+    if best is None:
+        candidate, kept, dropped = _trim(result, paths, 0.0)
+        candidate = dict(candidate, _truncated={"kept": kept, "dropped": dropped, "max_bytes": max_bytes,
+                                                "note": "Result is still larger than max_bytes; narrow the query or use source_includes."})
+        best = (candidate, es_json.dumps(candidate, indent=indent))
+    return best
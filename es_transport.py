@@ -0,0 +1,217 @@
+import asyncio
+import gzip
+import itertools
+import os
+import random
+import time
+
+import aiohttp
+
+import es_json
+
+# Shared Elasticsearch transport used by mcp_server.py, mcp_elastic.py and seed_data.py.
+# Configuration comes from the environment so every entry point behaves the same:
+#   ES_URL             comma-separated node URLs (round-robin with failover)
+#   ES_TIMEOUT         total seconds per attempt
+#   ES_CONNECT_TIMEOUT seconds to establish a connection
+#   ES_MAX_RETRIES     retries after the first attempt when a node cannot be reached or answers 502-504
+#   ES_RETRY_BACKOFF   base seconds for exponential backoff between retries
+#   ES_POOL_SIZE       total pooled connections
+#   ES_POOL_PER_HOST   pooled connections per node
+#   ES_GZIP            "1" to gzip request bodies larger than ES_GZIP_MIN_BYTES
+
+DEFAULT_ES_URL = "http://localhost:9200"
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.2
+DEFAULT_POOL_SIZE = 100
+DEFAULT_POOL_PER_HOST = 32
+DEFAULT_GZIP_MIN_BYTES = 1024
+# How long a node that failed to connect is skipped before it is tried again
+DEAD_NODE_COOLDOWN = 30.0
+RETRY_STATUSES = (502, 503, 504)
+# Failures before the request was sent, so trying another node cannot run it twice.
+# (aiohttp before 3.10 reports connect timeouts as a plain ServerTimeoutError, which is not retried.)
+CONNECT_ERRORS = (aiohttp.ClientConnectorError,) + ((aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, "ConnectionTimeoutError") else ())
+
+
+class ESTransportError(Exception):
+    pass
+
+
+class ESHTTPError(ESTransportError):
+    def __init__(self, response):
+        self.response = response
+        super().__init__(f"{response.status_code} Error for url: {response.url}")
+
+
+class ESResponse:
+    def __init__(self, status_code, content, headers, url):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.url = url
+        self._json = None
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        if self._json is None:
+            self._json = es_json.loads(self.content)
+        return self._json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ESHTTPError(self)
+
+
+def _describe(error):
+    # Timeouts stringify to "", so always name the exception type
+    text = str(error)
+    return f"{type(error).__name__}: {text}" if text else type(error).__name__
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+class ESTransport:
+    def __init__(self, urls=None, timeout=None, connect_timeout=None, max_retries=None,
+                 retry_backoff=None, pool_size=None, pool_per_host=None, gzip_requests=None):
+        if urls is None:
+            urls = os.environ.get("ES_URL", DEFAULT_ES_URL)
+        if isinstance(urls, str):
+            urls = [u.strip() for u in urls.split(",") if u.strip()]
+        if not urls:
+            raise ValueError("At least one Elasticsearch URL is required")
+        self.nodes = [u.rstrip("/") for u in urls]
+        self.timeout = timeout if timeout is not None else _env_float("ES_TIMEOUT", DEFAULT_TIMEOUT)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else _env_float("ES_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        self.max_retries = max_retries if max_retries is not None else _env_int("ES_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        self.retry_backoff = retry_backoff if retry_backoff is not None else _env_float("ES_RETRY_BACKOFF", DEFAULT_RETRY_BACKOFF)
+        self.pool_size = pool_size if pool_size is not None else _env_int("ES_POOL_SIZE", DEFAULT_POOL_SIZE)
+        self.pool_per_host = pool_per_host if pool_per_host is not None else _env_int("ES_POOL_PER_HOST", DEFAULT_POOL_PER_HOST)
+        if gzip_requests is None:
+            gzip_requests = os.environ.get("ES_GZIP", "1") not in ("0", "false", "no")
+        self.gzip_requests = gzip_requests
+        self.gzip_min_bytes = _env_int("ES_GZIP_MIN_BYTES", DEFAULT_GZIP_MIN_BYTES)
+        self._dead_until = {}
+        self._round_robin = itertools.count()
+        self._session = None
+        # Called as hook(method, path, response, bytes_sent, elapsed_seconds, error) after
+        # every request, once its retries are over; response is None when it failed
+        self.hooks = []
+
+    @property
+    def url(self):
+        return self.nodes[0]
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_per_host,
+                                             keepalive_timeout=60, enable_cleanup_closed=True)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout),
+                headers={"Accept-Encoding": "gzip"},
+                auto_decompress=True,
+            )
+        return self._session
+
+    def _next_node(self):
+        now = time.monotonic()
+        start = next(self._round_robin)
+        for i in range(len(self.nodes)):
+            node = self.nodes[(start + i) % len(self.nodes)]
+            if self._dead_until.get(node, 0) <= now:
+                return node
+        # Every node is marked dead: try the one that will recover first
+        return min(self.nodes, key=lambda n: self._dead_until.get(n, 0))
+
+    def _encode_body(self, body, ndjson):
+        if body is None:
+            return None, {}
+        if ndjson:
+            if isinstance(body, (bytes, bytearray)):
+                # Already newline-delimited (e.g. a _bulk payload built incrementally)
+                data = bytes(body)
+            else:
+                lines = body if isinstance(body, (list, tuple)) else [body]
+                data = b"".join((line.encode("utf-8") if isinstance(line, str) else es_json.dumps_bytes(line)) + b"\n" for line in lines)
+            headers = {"Content-Type": "application/x-ndjson"}
+        elif isinstance(body, (bytes, bytearray)):
+            data = bytes(body)
+            headers = {"Content-Type": "application/json"}
+        else:
+            data = es_json.dumps_bytes(body)
+            headers = {"Content-Type": "application/json"}
+        if self.gzip_requests and len(data) >= self.gzip_min_bytes:
+            data = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        return data, headers
+
+    def _observe(self, method, path, response, data, started, error=None):
+        elapsed = time.perf_counter() - started
+        for hook in self.hooks:
+            hook(method, path, response, len(data) if data else 0, elapsed, error)
+
+    async def request(self, method, path, params=None, body=None, ndjson=False, retry=True):
+        started = time.perf_counter()
+        data, headers = self._encode_body(body, ndjson)
+        if not path.startswith("/"):
+            path = "/" + path
+        attempts = 1 + (self.max_retries if retry else 0)
+        last_error = None
+        for attempt in range(attempts):
+            node = self._next_node()
+            url = node + path
+            try:
+                session = self._get_session()
+                async with session.request(method, url, params=params, data=data, headers=headers) as resp:
+                    content = await resp.read()
+                    response = ESResponse(resp.status, content, resp.headers, str(resp.url))
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    self._dead_until.pop(node, None)
+                    self._observe(method, path, response, data, started)
+                    return response
+                last_error = ESHTTPError(response)
+            except CONNECT_ERRORS as e:
+                self._dead_until[node] = time.monotonic() + DEAD_NODE_COOLDOWN
+                last_error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # The node may already be running the request (a slow search, a PIT being opened):
+                # resending it would only add load, and a slow node is not a dead one
+                self._observe(method, path, None, data, started, e)
+                raise ESTransportError(f"{method} {path} failed on attempt {attempt + 1}: {_describe(e)}") from e
+            if attempt < attempts - 1:
+                # Exponential backoff with jitter before trying the next node
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt) * (0.5 + random.random()))
+        self._observe(method, path, None, data, started, last_error)
+        raise ESTransportError(f"{method} {path} failed after {attempts} attempt(s): {_describe(last_error)}")
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request("PUT", path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request("DELETE", path, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
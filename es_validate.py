@@ -0,0 +1,293 @@
+import difflib
+import re
+
+# Local query checks run against a flattened view of the index mapping, so
+# queries that Elasticsearch would reject (or that can never match) fail fast
+# without a round trip.
+
+NUMERIC_TYPES = {"long", "integer", "short", "byte", "double", "float", "half_float", "scaled_float", "unsigned_long"}
+STRING_TYPES = {"text", "match_only_text", "keyword", "constant_keyword", "wildcard"}
+ANALYZED_TYPES = {"text", "match_only_text"}
+# Fields every index has even though they are absent from the mapping
+METADATA_FIELDS = {"_id", "_index", "_score", "_doc", "_shard_doc", "_seq_no", "_primary_term", "_routing", "_source", "_tier", "_ignored"}
+# Leaf queries written as {"query_type": {"field": value-or-options}}
+FIELD_QUERIES = {"term", "terms", "match", "match_phrase", "match_phrase_prefix", "match_bool_prefix", "prefix",
+                 "wildcard", "regexp", "fuzzy", "range", "term_set", "intervals", "span_term"}
+# Option keys that can sit next to the field name in a leaf query
+QUERY_OPTIONS = {"boost", "_name", "format", "time_zone", "relation", "case_insensitive"}
+
+
+def flatten_mapping(mapping):
+    """Flatten a _mapping response into {dotted_path: {"types", "nested", "keyword"}}.
+
+    Multi-fields ("make.keyword") get their own entries, nested paths record
+    the nested object that must wrap queries on them, runtime fields from the
+    mapping's runtime section are included, and fields from several indices
+    are merged (types become the union).
+    """
+    fields = {}
+    aliases = {}
+
+    def add(path, field_type, nested, keyword=None):
+        info = fields.setdefault(path, {"types": set(), "nested": nested, "keyword": None})
+        info["types"].add(field_type)
+        if keyword and not info["keyword"]:
+            info["keyword"] = keyword
+
+    def walk(properties, prefix, nested):
+        for name, spec in (properties or {}).items():
+            path = prefix + name
+            field_type = spec.get("type", "object")
+            if field_type == "alias":
+                aliases[path] = spec.get("path")
+                continue
+            keyword = None
+            for sub, sub_spec in (spec.get("fields") or {}).items():
+                sub_type = sub_spec.get("type", "object")
+                add(f"{path}.{sub}", sub_type, nested)
+                if sub_type == "keyword" and keyword is None:
+                    keyword = f"{path}.{sub}"
+            add(path, field_type, nested, keyword)
+            if "properties" in spec:
+                walk(spec["properties"], path + ".", path if field_type == "nested" else nested)
+
+    for body in (mapping or {}).values():
+        mappings = body.get("mappings", {})
+        walk(mappings.get("properties"), "", None)
+        for name, spec in (mappings.get("runtime") or {}).items():
+            field_type = spec.get("type", "keyword")
+            if field_type == "composite":
+                # A composite runtime field only exposes its subfields
+                for sub, sub_spec in (spec.get("fields") or {}).items():
+                    add(f"{name}.{sub}", sub_spec.get("type", "keyword"), None)
+            else:
+                add(name, field_type, None)
+    for path, target in aliases.items():
+        if target in fields:
+            fields[path] = dict(fields[target], types=set(fields[target]["types"]))
+    return fields
+
+
+class QueryValidator:
+    def __init__(self, fields, index):
+        self.fields = dict(fields)
+        self.index = index
+        self.errors = []
+        # Fields missing from the mapping. Elasticsearch accepts most of these (the
+        # clause just matches nothing), so they are hints for a 400, not errors
+        self.unknown = []
+
+    def suggest(self, field):
+        candidates = difflib.get_close_matches(field, self.fields.keys(), n=3, cutoff=0.6)
+        # Also match on the last path segment ("make" -> "vehicle.make")
+        leaf = field.rsplit(".", 1)[-1]
+        for path in self.fields:
+            if path.rsplit(".", 1)[-1] == leaf and path not in candidates:
+                candidates.append(path)
+        return candidates[:3]
+
+    def error(self, message):
+        if message not in self.errors:
+            self.errors.append(message)
+
+    def flattened_key(self, field):
+        # Any key below a flattened field is valid and behaves like a keyword
+        parts = field.split(".")
+        for i in range(len(parts) - 1, 0, -1):
+            info = self.fields.get(".".join(parts[:i]))
+            if info is not None and "flattened" in info["types"]:
+                return {"types": {"keyword"}, "nested": info["nested"], "keyword": None}
+        return None
+
+    def field(self, field, context, nested_scope=None):
+        """Check a field reference; return its info dict or None."""
+        if not isinstance(field, str) or field in METADATA_FIELDS or "*" in field or "?" in field:
+            return None
+        field = field.split("^", 1)[0]
+        info = self.fields.get(field) or self.flattened_key(field)
+        if info is None:
+            suggestions = self.suggest(field)
+            if suggestions:
+                hint = f" Did you mean: {', '.join(repr(s) for s in suggestions)}?"
+            else:
+                known = [path for path, i in self.fields.items() if i["types"] != {"object"}]
+                hint = f" Available fields in '{self.index}': {', '.join(known[:30])}."
+            message = f"Unknown field '{field}' in {context}.{hint}"
+            if message not in self.unknown:
+                self.unknown.append(message)
+            return None
+        nested = info["nested"]
+        if nested and nested != nested_scope:
+            self.error(f"Field '{field}' in {context} is inside nested object '{nested}'; wrap the clause in {{\"nested\": {{\"path\": \"{nested}\", \"query\": {{...}}}}}} or it will never match.")
+        return info
+
+    def check_value(self, field, info, value, query_type):
+        types = info["types"]
+        values = value if isinstance(value, list) else [value]
+        if types <= NUMERIC_TYPES:
+            for v in values:
+                if isinstance(v, str) and not _is_number(v):
+                    self.error(f"{query_type} on numeric field '{field}' ({'/'.join(sorted(types))}) with non-numeric value {v!r}.")
+                    return
+        if query_type in ("term", "terms") and types <= ANALYZED_TYPES:
+            # Analyzed text is indexed as lowercase tokens, so these can never match
+            if any(isinstance(v, str) and (v != v.lower() or re.search(r"\s", v)) for v in values):
+                keyword = info.get("keyword")
+                fix = f"use '{keyword}' for exact values" if keyword else "use a match query instead"
+                self.error(f"{query_type} on text field '{field}' with value {values[0]!r} will not match analyzed tokens; {fix}.")
+
+    def check_range(self, field, info, options):
+        types = info["types"]
+        if not isinstance(options, dict):
+            return
+        bounds = [options[k] for k in ("gt", "gte", "lt", "lte", "from", "to") if options.get(k) is not None]
+        if types & ANALYZED_TYPES and types <= STRING_TYPES:
+            self.error(f"range on text field '{field}' compares analyzed tokens; use a numeric or date field, or '{info['keyword']}' for lexicographic ranges." if info.get("keyword") else f"range on text field '{field}' compares analyzed tokens; use a numeric or date field.")
+        elif types <= STRING_TYPES and any(isinstance(b, (int, float)) and not isinstance(b, bool) for b in bounds):
+            numeric = [p for p, i in self.fields.items() if i["types"] <= NUMERIC_TYPES]
+            hint = f" Numeric fields: {', '.join(numeric[:10])}." if numeric else ""
+            self.error(f"range with numeric bounds on keyword field '{field}' compares strings lexicographically (\"100\" < \"20\").{hint}")
+        else:
+            self.check_value(field, info, bounds, "range")
+
+    def query(self, query, nested_scope=None):
+        if isinstance(query, list):
+            for q in query:
+                self.query(q, nested_scope)
+            return
+        if not isinstance(query, dict):
+            return
+        for query_type, body in query.items():
+            if query_type == "bool" and isinstance(body, dict):
+                for clause in ("must", "should", "filter", "must_not"):
+                    if clause in body:
+                        self.query(body[clause], nested_scope)
+            elif query_type == "nested" and isinstance(body, dict):
+                path = body.get("path")
+                info = self.fields.get(path)
+                if info is None:
+                    self.field(path, "nested.path", nested_scope)
+                elif "nested" not in info["types"]:
+                    self.error(f"nested.path '{path}' is mapped as {'/'.join(sorted(info['types']))}, not nested; query its fields directly.")
+                self.query(body.get("query"), path)
+            elif query_type == "constant_score" and isinstance(body, dict):
+                self.query(body.get("filter"), nested_scope)
+            elif query_type == "dis_max" and isinstance(body, dict):
+                self.query(body.get("queries"), nested_scope)
+            elif query_type == "function_score" and isinstance(body, dict):
+                self.query(body.get("query"), nested_scope)
+            elif query_type == "boosting" and isinstance(body, dict):
+                self.query(body.get("positive"), nested_scope)
+                self.query(body.get("negative"), nested_scope)
+            elif query_type == "exists" and isinstance(body, dict):
+                self.field(body.get("field"), "exists", nested_scope)
+            elif query_type in ("multi_match", "query_string", "simple_query_string") and isinstance(body, dict):
+                for field in body.get("fields") or []:
+                    self.field(field, query_type, nested_scope)
+                if body.get("default_field"):
+                    self.field(body["default_field"], query_type, nested_scope)
+            elif query_type in FIELD_QUERIES and isinstance(body, dict):
+                for field, value in body.items():
+                    if field in QUERY_OPTIONS:
+                        continue
+                    info = self.field(field, f"{query_type} query", nested_scope)
+                    if info is None:
+                        continue
+                    if query_type == "range":
+                        self.check_range(field, info, value)
+                    elif query_type in ("term", "terms", "match", "match_phrase"):
+                        if isinstance(value, dict):
+                            value = value.get("value", value.get("query"))
+                        if value is not None:
+                            self.check_value(field, info, value, query_type)
+
+    def sort(self, sort):
+        for item in sort if isinstance(sort, list) else [sort]:
+            if isinstance(item, str):
+                field, options = item, {}
+            elif isinstance(item, dict) and item:
+                field, options = next(iter(item.items()))
+            else:
+                continue
+            if field in ("_score", "_doc", "_shard_doc", "_geo_distance", "_script"):
+                continue
+            nested = options.get("nested") if isinstance(options, dict) else None
+            info = self.field(field, "sort", nested.get("path") if isinstance(nested, dict) else None)
+            if info and info["types"] <= ANALYZED_TYPES:
+                fix = f"sort on '{info['keyword']}' instead" if info.get("keyword") else "sort on a keyword or numeric field"
+                self.error(f"Cannot sort on text field '{field}' (fielddata is disabled); {fix}.")
+
+    def aggs(self, aggs, nested_scope=None):
+        if not isinstance(aggs, dict):
+            return
+        for name, agg in aggs.items():
+            if not isinstance(agg, dict):
+                continue
+            scope = nested_scope
+            for agg_type, body in agg.items():
+                if agg_type in ("aggs", "aggregations") or not isinstance(body, dict):
+                    continue
+                if agg_type == "nested":
+                    scope = body.get("path")
+                    info = self.fields.get(scope)
+                    if info is None:
+                        self.field(scope, f"nested aggregation '{name}'")
+                    elif "nested" not in info["types"]:
+                        self.error(f"nested aggregation '{name}' path '{scope}' is not a nested field.")
+                elif agg_type == "reverse_nested":
+                    scope = body.get("path")
+                elif agg_type == "filter":
+                    self.query(body, nested_scope)
+                elif isinstance(body.get("field"), str):
+                    info = self.field(body["field"], f"aggregation '{name}'", nested_scope)
+                    if info and info["types"] <= ANALYZED_TYPES and agg_type != "significant_text":
+                        fix = f"use '{info['keyword']}'" if info.get("keyword") else "use a keyword or numeric field"
+                        self.error(f"{agg_type} aggregation '{name}' on text field '{body['field']}' is not allowed (fielddata is disabled); {fix}.")
+            self.aggs(agg.get("aggs") or agg.get("aggregations"), scope)
+
+    def body(self, body):
+        for name, spec in (body.get("runtime_mappings") or {}).items():
+            self.fields[name] = {"types": {spec.get("type", "keyword")}, "nested": None, "keyword": None}
+        if "query" in body:
+            self.query(body["query"])
+        if "post_filter" in body:
+            self.query(body["post_filter"])
+        if "sort" in body:
+            self.sort(body["sort"])
+        for key in ("aggs", "aggregations"):
+            if key in body:
+                self.aggs(body[key])
+        return self.errors
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def validate_body(fields, index, body):
+    """Return a list of problems with a search body; empty when it looks valid."""
+    return QueryValidator(fields, index).body(body)
+
+
+def unknown_fields(fields, index, body):
+    """Return hints (with suggestions) for fields in a search body that are not in the mapping."""
+    validator = QueryValidator(fields, index)
+    validator.body(body)
+    return validator.unknown
+
+
+def validate_query(fields, index, query):
+    validator = QueryValidator(fields, index)
+    validator.query(query)
+    return validator.errors
+
+
+def validate_fields(fields, index, names, context):
+    validator = QueryValidator(fields, index)
+    for name in names:
+        validator.field(name, context)
+    return validator.errors
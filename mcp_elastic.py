@@ -1,31 +1,305 @@
-from flask import Flask, request, jsonify
-import requests
-
-app = Flask(__name__)
-ES_URL = "http://localhost:9200"
-
-@app.route("/list_indices", methods=["GET"])
-def list_indices():
-    r = requests.get(f"{ES_URL}/_cat/indices?format=json")
-    indices = [i["index"] for i in r.json()]
-    return jsonify(indices)
-
-@app.route("/get_mapping/<index>", methods=["GET"])
-def get_mapping(index):
-    r = requests.get(f"{ES_URL}/{index}/_mapping")
-    return jsonify(r.json())
-
-@app.route("/sample_docs/<index>", methods=["GET"])
-def sample_docs(index):
-    size = int(request.args.get("size", 5))
-    r = requests.get(f"{ES_URL}/{index}/_search", json={"size": size})
-    return jsonify(r.json()["hits"]["hits"])
-
-@app.route("/search/<index>", methods=["POST"])
-def search(index):
-    query = request.json
-    r = requests.post(f"{ES_URL}/{index}/_search", json=query)
-    return jsonify(r.json())
+import asyncio
+import os
+import secrets
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+import es_json
+from mcp_server import MCPServer, Dispatcher
+
+# MCP Streamable HTTP front end for the same tool core as mcp_server.py. One
+# process serves many agent sessions: they share the Elasticsearch connection
+# pool, the schema/query caches and one limit on concurrently running tool
+# calls. Each session gets its own Dispatcher, so cancellation and progress
+# notifications work as they do over stdio.
+#
+#   POST   /mcp   JSON-RPC request(s); the reply is JSON, or an SSE stream when
+#                 the client accepts text/event-stream and asked for progress
+#   DELETE /mcp   end the session named by the Mcp-Session-Id header
+#
+# The legacy REST routes from elastic-mcp-tools.json are served as well.
+#
+# Configuration (environment):
+#   MCP_HTTP_HOST / MCP_HTTP_PORT   listen address (default 127.0.0.1:5000)
+#   MCP_HTTP_MAX_CONCURRENCY        tool calls running at once across all sessions
+#   MCP_HTTP_MAX_PENDING            queued + running calls before new ones get 503
+#   MCP_HTTP_SESSION_MAX_PENDING    queued + running calls per session before 429
+#   MCP_HTTP_SESSION_TTL            seconds an idle session is kept
+#   MCP_HTTP_ALLOWED_ORIGINS        extra comma-separated browser Origins to accept
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_MAX_PENDING = 256
+DEFAULT_SESSION_MAX_PENDING = 32
+DEFAULT_SESSION_TTL = 1800
+SESSION_SWEEP_INTERVAL = 60
+RETRY_AFTER_SECONDS = "1"
+SESSION_HEADER = "Mcp-Session-Id"
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _rpc_error(message_id, code, text):
+    return {"jsonrpc": "2.0", "id": message_id, "error": {"code": code, "message": text}}
+
+
+def _sse_event(message):
+    return b"event: message\ndata: " + es_json.dumps_bytes(message) + b"\n\n"
+
+
+class Session:
+    """One MCP client: its Dispatcher and the open HTTP replies waiting on it."""
+
+    def __init__(self, session_id, core, semaphore):
+        self.id = session_id
+        self.last_seen = time.monotonic()
+        # Reply queues of open POSTs, keyed by request id and by progress token
+        self.replies = {}
+        self.progress = {}
+        self.dispatcher = Dispatcher(core, self.deliver, semaphore=semaphore)
+
+    def deliver(self, message):
+        if message.get("method") == "notifications/progress":
+            queue = self.progress.get(Dispatcher._key(message.get("params", {}).get("progressToken")))
+        else:
+            queue = self.replies.get(Dispatcher._key(message.get("id")))
+        # Replies for a POST whose client went away are dropped
+        if queue is not None:
+            queue.put_nowait(message)
+
+    @property
+    def pending(self):
+        return len(self.dispatcher.in_flight)
+
+    def close(self):
+        for task in list(self.dispatcher.in_flight.values()):
+            task.cancel()
+
+
+class HTTPTransport:
+    def __init__(self, core=None):
+        self.core = core or MCPServer()
+        self.sessions = {}
+        self.semaphore = asyncio.Semaphore(max(1, _env_int("MCP_HTTP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
+        self.max_pending = _env_int("MCP_HTTP_MAX_PENDING", DEFAULT_MAX_PENDING)
+        self.session_max_pending = _env_int("MCP_HTTP_SESSION_MAX_PENDING", DEFAULT_SESSION_MAX_PENDING)
+        self.session_ttl = _env_int("MCP_HTTP_SESSION_TTL", DEFAULT_SESSION_TTL)
+        self.allowed_origins = {o.strip() for o in os.environ.get("MCP_HTTP_ALLOWED_ORIGINS", "").split(",") if o.strip()}
+        self.pending = 0
+        self._sweeper = None
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/mcp", self.post)
+        app.router.add_delete("/mcp", self.delete)
+        app.router.add_get("/mcp", self.get)
+        app.router.add_get("/list_indices", self.legacy_list_indices)
+        app.router.add_get("/get_mapping/{index}", self.legacy_get_mapping)
+        app.router.add_get("/sample_docs/{index}", self.legacy_sample_docs)
+        app.router.add_post("/search/{index}", self.legacy_search)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+    async def start(self, app):
+        self._sweeper = asyncio.ensure_future(self.sweep())
+        self.core.start()
+
+    async def stop(self, app):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        await self.core.close()
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            cutoff = time.monotonic() - self.session_ttl
+            for session_id, session in list(self.sessions.items()):
+                if session.last_seen < cutoff and not session.pending:
+                    del self.sessions[session_id]
+
+    def origin_allowed(self, request):
+        # Browsers send Origin; refusing foreign ones blocks DNS rebinding against a local server
+        origin = request.headers.get("Origin")
+        if not origin or origin in self.allowed_origins:
+            return True
+        return urlsplit(origin).hostname in LOCAL_HOSTS
+
+    def session_for(self, request, messages):
+        """Return (session, error_response) for a POST."""
+        if any(m.get("method") == "initialize" for m in messages):
+            session = Session(secrets.token_urlsafe(24), self.core, self.semaphore)
+            self.sessions[session.id] = session
+            return session, None
+        session_id = request.headers.get(SESSION_HEADER)
+        if not session_id:
+            return None, web.json_response(_rpc_error(None, -32600, f"Missing {SESSION_HEADER} header; send initialize first"), status=400)
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None, web.json_response(_rpc_error(None, -32600, "Unknown or expired session; initialize again"), status=404)
+        return session, None
+
+    async def post(self, request):
+        if not self.origin_allowed(request):
+            return web.json_response(_rpc_error(None, -32600, "Origin not allowed"), status=403)
+        try:
+            payload = es_json.loads(await request.read())
+        except ValueError as e:
+            return web.json_response(_rpc_error(None, -32700, f"Parse error: {e}"), status=400)
+        batch = isinstance(payload, list)
+        messages = payload if batch else [payload]
+        if not messages or not all(isinstance(m, dict) for m in messages):
+            return web.json_response(_rpc_error(None, -32600, "Invalid request"), status=400)
+        session, error = self.session_for(request, messages)
+        if error is not None:
+            return error
+        session.last_seen = time.monotonic()
+        headers = {SESSION_HEADER: session.id}
+
+        requests = [m for m in messages if "method" in m and "id" in m]
+        if not requests:
+            # Notifications (including cancellations) and client responses only
+            for message in messages:
+                if "method" in message:
+                    session.dispatcher.submit(message)
+            return web.Response(status=202, headers=headers)
+
+        # Backpressure: refuse work up front instead of queueing without bound
+        if session.pending + len(requests) > self.session_max_pending:
+            return web.json_response(_rpc_error(None, -32000, "Too many requests in flight for this session"),
+                                     status=429, headers=dict(headers, **{"Retry-After": RETRY_AFTER_SECONDS}))
+        if self.pending + len(requests) > self.max_pending:
+            return web.json_response(_rpc_error(None, -32000, "Server busy"),
+                                     status=503, headers=dict(headers, **{"Retry-After": RETRY_AFTER_SECONDS}))
+
+        queue = asyncio.Queue()
+        keys, tokens = [], []
+        expected = 0
+        for message in messages:
+            if "method" not in message:
+                continue
+            if "id" in message:
+                key = Dispatcher._key(message["id"])
+                if key in session.dispatcher.in_flight or key in session.replies:
+                    queue.put_nowait(_rpc_error(message["id"], -32600, "Duplicate request id"))
+                    queue.put_nowait(None)
+                    expected += 1
+                    continue
+                session.replies[key] = queue
+                keys.append(key)
+                token = ((message.get("params") or {}).get("_meta") or {}).get("progressToken")
+                if token is not None:
+                    session.progress[Dispatcher._key(token)] = queue
+                    tokens.append(Dispatcher._key(token))
+            task = session.dispatcher.submit(message)
+            if task is not None:
+                expected += 1
+                self.pending += 1
+                # Runs after the reply (if any) was delivered; a cancelled call has none
+                task.add_done_callback(lambda t: (self._finished(), queue.put_nowait(None)))
+
+        accept = request.headers.get("Accept", "")
+        stream = "text/event-stream" in accept and (bool(tokens) or "application/json" not in accept)
+        try:
+            if stream:
+                return await self.stream_replies(request, headers, queue, expected)
+            replies = []
+            while expected:
+                message = await queue.get()
+                if message is None:
+                    expected -= 1
+                elif "id" in message:
+                    replies.append(message)
+            if not replies:
+                return web.Response(status=202, headers=headers)
+            body = replies if batch else replies[0]
+            return web.Response(body=es_json.dumps_bytes(body), content_type="application/json", headers=headers)
+        finally:
+            for key in keys:
+                if session.replies.get(key) is queue:
+                    del session.replies[key]
+            for token in tokens:
+                if session.progress.get(token) is queue:
+                    del session.progress[token]
+
+    async def stream_replies(self, request, headers, queue, expected):
+        response = web.StreamResponse(headers=dict(headers, **{"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}))
+        await response.prepare(request)
+        try:
+            while expected:
+                message = await queue.get()
+                if message is None:
+                    expected -= 1
+                else:
+                    await response.write(_sse_event(message))
+        except ConnectionResetError:
+            # The client went away; its calls keep running unless it cancels them
+            return response
+        await response.write_eof()
+        return response
+
+    def _finished(self):
+        self.pending -= 1
+
+    async def delete(self, request):
+        session = self.sessions.pop(request.headers.get(SESSION_HEADER, ""), None)
+        if session is None:
+            return web.Response(status=404)
+        session.close()
+        return web.Response(status=204)
+
+    async def get(self, request):
+        # No server-initiated messages, so there is no standalone SSE stream
+        return web.Response(status=405, headers={"Allow": "POST, DELETE"})
+
+    # Legacy REST routes (elastic-mcp-tools.json), answered by the same tool core
+
+    async def legacy_call(self, name, args, shape=None):
+        try:
+            result = await self.core.call_tool(name, args)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=404 if "not found" in str(e) else 400)
+        except Exception as e:
+            return web.json_response({"error": str(e)}, status=502)
+        return web.json_response(shape(result) if shape else result, dumps=es_json.dumps)
+
+    async def legacy_list_indices(self, request):
+        # The old route returned a bare list of names
+        return await self.legacy_call("list_indices", {}, shape=lambda result: result["indices"])
+
+    async def legacy_get_mapping(self, request):
+        return await self.legacy_call("get_mappings", {"index": request.match_info["index"]})
+
+    async def legacy_sample_docs(self, request):
+        try:
+            size = int(request.query.get("size", 5))
+        except ValueError:
+            return web.json_response({"error": "size must be an integer"}, status=400)
+        return await self.legacy_call("sample_docs", {"index": request.match_info["index"], "size": size})
+
+    async def legacy_search(self, request):
+        try:
+            query_body = es_json.loads(await request.read())
+        except ValueError as e:
+            return web.json_response({"error": f"Invalid JSON body: {e}"}, status=400)
+        return await self.legacy_call("search", {"index": request.match_info["index"], "query_body": query_body})
+
+
+def main():
+    host = os.environ.get("MCP_HTTP_HOST", DEFAULT_HOST)
+    port = _env_int("MCP_HTTP_PORT", DEFAULT_PORT)
+    web.run_app(HTTPTransport().app(), host=host, port=port)
+
 
 if __name__ == "__main__":
-    app.run(port=5000)
+    main()
@@ -1,19 +1,69 @@
 import asyncio
 import json
 import sys
-import requests
 import os
 import fnmatch
 import re
+import secrets
+import time
+
+import es_aggs
+import es_args
+import es_json
+import es_metrics
+import es_profile
+import es_shaping
+import es_validate
+from es_transport import ESTransport
+from es_cache import SchemaCache, QueryCache, TTLCache
 
 # Ensure unbuffered output for MCP communication
 sys.stdout.reconfigure(line_buffering=True) if hasattr(sys.stdout, 'reconfigure') else None
 os.environ['PYTHONUNBUFFERED'] = '1'
 
-ES_URL = "http://localhost:9200"
+# Maximum number of tools/call requests processed at once
+DEFAULT_MAX_CONCURRENCY = 8
+# Check queries against the cached mapping before sending them (MCP_VALIDATE_QUERIES=0 disables)
+VALIDATE_QUERIES = os.environ.get("MCP_VALIDATE_QUERIES", "1") not in ("0", "false", "no", "")
+# Tool results are compact JSON unless MCP_JSON_INDENT=1 asks for the old indented output
+RESULT_INDENT = os.environ.get("MCP_JSON_INDENT", "0") not in ("0", "false", "no", "")
+# Hits fetched per request when walking a result set with search_after
+DEFAULT_PAGE_SIZE = 1000
+PIT_KEEP_ALIVE = "1m"
+# Paginated search: hits per page, pages per call, and how many open cursors are remembered
+MAX_PAGE_SIZE = 10000
+MAX_PAGES_PER_CALL = 10
+MAX_OPEN_CURSORS = 1024
+# join tool limits: keys per terms query, rows returned, distinct keys and docs per hop
+DEFAULT_TERMS_CHUNK = 1000
+MAX_TERMS_CHUNK = 65536
+DEFAULT_JOIN_ROWS = 100
+DEFAULT_JOIN_KEYS = 100000
+MAX_JOIN_DOCS = 200000
+# Key chunks of one join hop searched at the same time
+JOIN_CHUNK_CONCURRENCY = 4
+# Read-only tools whose concatenated argument objects are run together instead of rejected
+BATCHABLE_TOOLS = ("list_indices", "get_mappings", "sample_docs", "get_profile", "search", "multi_search", "count", "aggregate", "join")
+# Sample documents included in a get_profile response unless sample_size says otherwise
+DEFAULT_PROFILE_SAMPLE = 5
 
 class MCPServer:
-    def __init__(self):
+    def __init__(self, transport=None):
+        # Pooled keep-alive connections shared by every tool call
+        self.es = transport or ESTransport()
+        # Index catalog and mappings are reused across calls (see es_cache.py)
+        self.schema = SchemaCache(self.es)
+        # Optional search result cache, sized by MCP_QUERY_CACHE_MB
+        self.query_cache = QueryCache(self.es)
+        # Precomputed field statistics and random samples, loaded from the last snapshot (see es_profile.py).
+        # Recent profiles also prime the schema cache, so mappings need no round trip after a restart
+        self.profiles = es_profile.ProfileStore(self.es, self.schema)
+        self._warm = None
+        # Open paginated searches, keyed by the cursor token handed to the client
+        self.cursors = TTLCache(MAX_OPEN_CURSORS, _keep_alive_seconds(PIT_KEEP_ALIVE))
+        # Per-tool and per-endpoint timings, fed by the transport hook (see es_metrics.py)
+        self.metrics = es_metrics.Metrics()
+        self.es.hooks.append(self.metrics.es_request)
         self.tools = {
             "list_indices": {
                 "name": "list_indices",
@@ -32,53 +82,225 @@ class MCPServer:
             },
             "get_mappings": {
                 "name": "get_mappings",
-                "description": "Get mapping for ONE index only. CRITICAL: Make ONE call at a time. Pass arguments as a SINGLE JSON object like {\"index\": \"vehicles\"}. Call this tool ONCE per index, WAIT for response, then make the NEXT call. NEVER pass multiple indices like {\"index\": \"vehicles\"}{\"index\": \"people\"} - that is INVALID JSON and will fail. SEQUENTIAL CALLS REQUIRED: Call 1 → wait → Call 2 → wait → Call 3.",
+                "description": "Get mappings for one or more indices. Pass a SINGLE JSON object: {\"index\": \"vehicles\"} for one index, or {\"indices\": [\"vehicles\", \"people\", \"registrations\"]} to fetch several in ONE call. Prefer the indices list over repeated calls. NEVER concatenate JSON objects like {\"index\": \"vehicles\"}{\"index\": \"people\"}.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
-                        "index": {"type": "string", "description": "ONE index name only (e.g., 'vehicles'). Pass as SINGLE JSON object: {\"index\": \"vehicles\"}. To query multiple indices, make SEPARATE SEQUENTIAL tool calls - one call per index, wait for response, then next call. NEVER concatenate like {\"index\": \"vehicles\"}{\"index\": \"people\"} or \"index\":\"vehicles\"}{\"index\":\"people\"."}
+                        "index": {"type": "string", "description": "One index name (e.g., 'vehicles')."},
+                        "indices": {"type": "array", "items": {"type": "string"}, "description": "Several index names fetched in one request, e.g. [\"vehicles\", \"people\"]. Missing indices are reported per index under errors."}
                     },
-                    "required": ["index"],
                     "examples": [
                         {"index": "vehicles"},
-                        {"index": "people"},
-                        {"index": "registrations"}
+                        {"indices": ["vehicles", "people", "registrations"]}
                     ],
                     "additionalProperties": False
                 }
             },
             "sample_docs": {
                 "name": "sample_docs",
-                "description": "Get sample documents from ONE index only. CRITICAL: Make ONE call at a time. Pass arguments as a SINGLE JSON object like {\"index\": \"vehicles\", \"size\": 5}. Call this tool ONCE per index, WAIT for response, then make the NEXT call. NEVER pass multiple indices like {\"index\": \"vehicles\"}{\"index\": \"people\"} - that is INVALID JSON and will fail. SEQUENTIAL CALLS REQUIRED.",
+                "description": "Get sample documents from one or more indices. Pass a SINGLE JSON object: {\"index\": \"vehicles\", \"size\": 5} for one index, or {\"indices\": [\"vehicles\", \"people\"], \"size\": 5} to sample several in ONE call. NEVER concatenate JSON objects.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
-                        "index": {"type": "string", "description": "ONE index name only. Pass as SINGLE JSON object: {\"index\": \"vehicles\"} or {\"index\": \"vehicles\", \"size\": 5}. To query multiple indices, make SEPARATE SEQUENTIAL tool calls - one call per index, wait for response, then next call. NEVER concatenate multiple JSON objects."},
-                        "size": {"type": "integer", "description": "Number of sample documents to return", "default": 5}
+                        "index": {"type": "string", "description": "One index name (e.g., 'vehicles')."},
+                        "indices": {"type": "array", "items": {"type": "string"}, "description": "Several index names sampled in one request. Missing indices are reported per index under errors."},
+                        "size": {"type": "integer", "description": "Number of sample documents to return per index", "default": 5}
                     },
-                    "required": ["index"],
                     "examples": [
                         {"index": "vehicles", "size": 5},
-                        {"index": "people", "size": 5}
+                        {"indices": ["vehicles", "people", "registrations"], "size": 3}
                     ],
                     "additionalProperties": False
                 }
             },
             "search": {
                 "name": "search",
-                "description": "Search an index with query. CRITICAL: Pass arguments as a SINGLE JSON object like {\"index\": \"vehicles\", \"query_body\": {...}}. NEVER concatenate multiple JSON objects.",
+                "description": "Search an index with query. CRITICAL: Pass arguments as a SINGLE JSON object like {\"index\": \"vehicles\", \"query_body\": {...}}. NEVER concatenate multiple JSON objects. For large result sets add page_size to page through a point-in-time snapshot: the response carries a cursor, and {\"cursor\": \"...\"} fetches the next page until done is true.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                         "index": {"type": "string", "description": "Index name. Pass as part of a SINGLE JSON object."},
-                        "query_body": {"type": "object", "description": "Query DSL JSON object. Pass as part of a SINGLE JSON object with index."}
+                        "query_body": {"type": "object", "description": "Query DSL JSON object. Pass as part of a SINGLE JSON object with index."},
+                        "page_size": {"type": "integer", "description": f"Enable paginated mode with this many hits per page (max {MAX_PAGE_SIZE})."},
+                        "cursor": {"type": "string", "description": "Cursor from a previous paginated response; continues that search. index and query_body are not needed."},
+                        "max_pages": {"type": "integer", "description": f"Pages to fetch in this call (max {MAX_PAGES_PER_CALL}); progress is reported after each page.", "default": 1},
+                        "keep_alive": {"type": "string", "description": "How long the snapshot stays open between calls, e.g. '1m' or '5m'.", "default": PIT_KEEP_ALIVE}
+                    },
+                    "anyOf": [
+                        {"required": ["index", "query_body"]},
+                        {"required": ["cursor"]}
+                    ]
+                }
+            },
+            "multi_search": {
+                "name": "multi_search",
+                "description": "Run several searches in ONE request. Pass a SINGLE JSON object like {\"searches\": [{\"index\": \"vehicles\", \"query_body\": {...}}, {\"index\": \"people\", \"query_body\": {...}}]}. Results come back in the same order; a failing search reports its own error without affecting the others.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "searches": {
+                            "type": "array",
+                            "description": "List of {index, query_body} pairs.",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "index": {"type": "string"},
+                                    "query_body": {"type": "object"}
+                                },
+                                "required": ["index", "query_body"]
+                            }
+                        }
+                    },
+                    "required": ["searches"],
+                    "additionalProperties": False
+                }
+            },
+            "count": {
+                "name": "count",
+                "description": "Count documents matching a query without fetching them. Use this instead of search/sample_docs for any 'how many' question. Example: {\"index\": \"registrations\", \"query\": {\"term\": {\"status\": \"active\"}}}",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "string", "description": "Index name (comma-separated names or patterns also work)."},
+                        "query": {"type": "object", "description": "Optional query DSL; omit to count every document."}
+                    },
+                    "required": ["index"],
+                    "additionalProperties": False
+                }
+            },
+            "aggregate": {
+                "name": "aggregate",
+                "description": "Compute grouped counts and statistics inside Elasticsearch and return a small table (columns + rows) instead of documents. Example (active registrations per year): {\"index\": \"registrations\", \"query\": {\"term\": {\"status\": \"active\"}}, \"group_by\": [{\"field\": \"reg_date\", \"type\": \"date_histogram\", \"interval\": \"year\"}]}. Example (average price per make): {\"index\": \"vehicles\", \"group_by\": [\"make\"], \"metrics\": [{\"type\": \"avg\", \"field\": \"price\"}]}",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "string", "description": "Index name."},
+                        "query": {"type": "object", "description": "Optional query DSL restricting the documents aggregated."},
+                        "group_by": {
+                            "type": "array",
+                            "description": "Grouping levels, outermost first. A plain field name means a terms grouping.",
+                            "items": {
+                                "type": ["object", "string"],
+                                "properties": {
+                                    "field": {"type": "string"},
+                                    "type": {"type": "string", "enum": list(es_aggs.GROUP_TYPES), "default": "terms"},
+                                    "size": {"type": "integer", "description": "Buckets kept for terms groupings", "default": es_aggs.DEFAULT_GROUP_SIZE},
+                                    "interval": {"type": ["string", "number"], "description": "date_histogram: 'day', 'month', 'year' or fixed like '30d'; histogram: a number"}
+                                }
+                            }
+                        },
+                        "metrics": {
+                            "type": "array",
+                            "description": "Values computed per group (doc_count is always included).",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "type": {"type": "string", "enum": list(es_aggs.METRIC_TYPES)},
+                                    "field": {"type": "string"}
+                                },
+                                "required": ["type", "field"]
+                            }
+                        }
                     },
-                    "required": ["index", "query_body"]
+                    "required": ["index"],
+                    "additionalProperties": False
+                }
+            },
+            "join": {
+                "name": "join",
+                "description": "Follow foreign keys across indices in ONE call instead of copying ids between searches. Each hop searches an index; the values of its join_field become a terms filter on target_field in the next hop's index. Returns joined rows keyed by index name. Example (people owning cars worth 40k+): {\"hops\": [{\"index\": \"vehicles\", \"query\": {\"range\": {\"price\": {\"gte\": 40000}}}, \"join_field\": \"id\", \"target_field\": \"vehicle_id\"}, {\"index\": \"registrations\", \"join_field\": \"person_id\", \"target_field\": \"id\"}, {\"index\": \"people\"}]}",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "hops": {
+                            "type": "array",
+                            "description": "Ordered hops. Every hop except the last needs join_field and target_field.",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "index": {"type": "string", "description": "Index searched by this hop."},
+                                    "query": {"type": "object", "description": "Optional query DSL filter for this hop, e.g. {\"term\": {\"status\": \"active\"}}."},
+                                    "join_field": {"type": "string", "description": "Field in this hop's documents whose values link to the next hop."},
+                                    "target_field": {"type": "string", "description": "Field in the next hop's index matched against join_field values."},
+                                    "source": {"type": "array", "items": {"type": "string"}, "description": "Optional list of _source fields to keep for this hop."},
+                                    "as": {"type": "string", "description": "Optional name for this hop in the joined rows (defaults to the index name)."}
+                                },
+                                "required": ["index"]
+                            }
+                        },
+                        "max_rows": {"type": "integer", "description": "Maximum joined rows returned", "default": DEFAULT_JOIN_ROWS},
+                        "chunk_size": {"type": "integer", "description": "Keys per terms query", "default": DEFAULT_TERMS_CHUNK},
+                        "max_keys": {"type": "integer", "description": "Fail instead of joining on more distinct keys than this", "default": DEFAULT_JOIN_KEYS}
+                    },
+                    "required": ["hops"],
+                    "additionalProperties": False
+                }
+            },
+            "get_profile": {
+                "name": "get_profile",
+                "description": "Summarize an index in one call: every field with its type, number of distinct values, most frequent values and min/max, plus randomly drawn sample documents. Pass a SINGLE JSON object like {\"index\": \"vehicles\"}. Use it before writing queries to learn real field names and values.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "string", "description": "One concrete index name (not a pattern or alias)."},
+                        "sample_size": {"type": "integer", "description": "Random sample documents to include (0 for none)", "default": DEFAULT_PROFILE_SAMPLE}
+                    },
+                    "required": ["index"],
+                    "additionalProperties": False
+                }
+            },
+            "cache_stats": {
+                "name": "cache_stats",
+                "description": "Report hit/miss counters and sizes of the schema and search result caches.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {},
+                    "additionalProperties": False
+                }
+            },
+            "server_stats": {
+                "name": "server_stats",
+                "description": "Report per-tool latency percentiles, bytes in/out, time spent in Elasticsearch (wall vs took), error counts by class and cache hit rates.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "format": {"type": "string", "enum": ["json", "prometheus"], "description": "json (default) or Prometheus text exposition format", "default": "json"}
+                    },
+                    "additionalProperties": False
+                }
+            },
+            "refresh_schema_cache": {
+                "name": "refresh_schema_cache",
+                "description": "Drop cached index listings, mappings, index profiles and search results so the next call reads them from Elasticsearch. Use after creating, deleting or remapping an index.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "string", "description": "Only forget this index. Omit to clear the whole cache."}
+                    },
+                    "additionalProperties": False
                 }
             }
         }
+        # Projection, rows mode and byte budgets shared by the data tools (see es_shaping.py)
+        for name in ("sample_docs", "search", "multi_search"):
+            self.tools[name]["inputSchema"]["properties"].update(es_shaping.SHAPING_PROPERTIES)
+        for name in ("sample_docs", "search", "multi_search", "join", "aggregate"):
+            self.tools[name]["inputSchema"]["properties"].update(es_shaping.BUDGET_PROPERTIES)
+
+    def start(self):
+        # Profile indices in the background; calls are served meanwhile
+        self._warm = asyncio.ensure_future(self.profiles.warm())
+
+    async def close(self):
+        if self._warm is not None:
+            self._warm.cancel()
+        self.profiles.close()
+        await self.es.close()
 
-    async def handle_message(self, message):
+    async def handle_message(self, message, notify=None):
+        if "id" not in message:
+            # Notifications never get a response
+            return None
         if message.get("method") == "initialize":
             return {
                 "jsonrpc": "2.0",
@@ -98,87 +320,54 @@ class MCPServer:
         elif message.get("method") == "tools/call":
             params = message["params"]
             tool_name = params["name"]
-            args = params.get("arguments", {})
+            args = raw_args = params.get("arguments", {})
+            started = time.perf_counter()
+            call = self.metrics.begin_call()
+            decode_ms = encode_ms = 0.0
+            result_text = ""
+            error = None
             try:
-                # Validate and normalize arguments
+                calls = None
                 if isinstance(args, str):
-                    # Check for missing opening brace OR concatenated JSON (common error where model generates "index":"value"}{...)
-                    if not args.strip().startswith('{') and ('}' in args or '"index"' in args):
-                        # Try to find where JSON should start
-                        if '"index"' in args:
-                            index_matches = re.findall(r'"index"\s*:\s*"([^"]+)"', args)
-                            if index_matches:
-                                if len(index_matches) > 1:
-                                    # Multiple indices detected - very clear error
-                                    error_msg = ("CRITICAL ERROR: You are trying to pass " + str(len(index_matches)) + 
-                                               " indices in ONE tool call: " + ", ".join(index_matches) + 
-                                               ". This is FORBIDDEN. You MUST make SEPARATE tool calls - ONE call per index. " +
-                                               "Example: Call 1 with {\"index\": \"" + index_matches[0] + "\"}, " +
-                                               "then wait for response, then Call 2 with {\"index\": \"" + index_matches[1] + "\"}. " +
-                                               "NEVER combine them like \"index\":\"" + index_matches[0] + "\"}{\"index\":\"" + index_matches[1] + "\"}.")
-                                else:
-                                    correct_format = '{"index": "' + index_matches[0] + '"}'
-                                    error_msg = ("ERROR: Invalid JSON - missing opening brace. You generated: \"index\":\"" + 
-                                               index_matches[0] + "\"}{...}. This is INVALID. Each tool call must start with { and end with }. " +
-                                               "CORRECT: " + correct_format + ". Make SEPARATE calls for each index.")
-                                raise ValueError(error_msg)
-                    
-                    # Check for multiple JSON objects concatenated (common error)
-                    if args.count('{') > 1 and args.count('}') > 1:
-                        # Try to extract the first valid JSON object
-                        brace_count = 0
-                        first_end = -1
-                        for i, char in enumerate(args):
-                            if char == '{':
-                                brace_count += 1
-                            elif char == '}':
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    first_end = i + 1
-                                    break
-                        
-                        if first_end > 0 and first_end < len(args):
-                            # Extract just the first JSON object
-                            first_json = args[:first_end].strip()
-                            remaining = args[first_end:].strip()
-                            
-                            # Check if it looks like MCP response format was included
-                            if '"content"' in remaining or '"text"' in remaining:
-                                raise ValueError(f"ERROR: Invalid JSON format. You're including MCP response content in tool arguments. Tool arguments must be ONLY the parameters. CORRECT format: {{\"index\": \"vehicles\"}}. WRONG format: {{\"index\": \"vehicles\"}}{{\"content\": [...]}}. Call {tool_name} with ONLY the parameter, nothing else.")
-                            
-                            # Check if remaining looks like more index parameters
-                            if '"index"' in remaining and tool_name in ["get_mappings", "sample_docs"]:
-                                # Try to extract indices from the full string
-                                index_matches = re.findall(r'"index"\s*:\s*"([^"]+)"', args)
-                                if index_matches and len(index_matches) > 1:
-                                    raise ValueError(f"ERROR: Invalid JSON - multiple indices in one call. You passed {len(index_matches)} indices: {', '.join(index_matches)}. You MUST make SEPARATE tool calls - one call per index. CORRECT: Call 1 with {{\"index\": \"{index_matches[0]}\"}}, then Call 2 with {{\"index\": \"{index_matches[1]}\"}}, etc. WRONG: {{\"index\": \"{index_matches[0]}\"}}{{\"index\": \"{index_matches[1]}\"}} - this is invalid JSON.")
-                                else:
-                                    raise ValueError(f"ERROR: Invalid JSON - multiple JSON objects detected. You're concatenating JSON objects like {{\"index\": \"vehicles\"}}{{\"index\": \"people\"}}. This is INVALID. Make SEPARATE tool calls. CORRECT: First call {{\"index\": \"vehicles\"}}, then second call {{\"index\": \"people\"}}.")
-                            else:
-                                raise ValueError(f"ERROR: Invalid JSON - multiple JSON objects detected. You're concatenating JSON objects. Make SEPARATE tool calls. CORRECT: First call {{\"index\": \"vehicles\"}}, then second call {{\"index\": \"people\"}}. WRONG: {{\"index\": \"vehicles\"}}{{\"index\": \"people\"}}.")
-                    
-                    # Check for MCP response format in arguments (common mistake)
-                    if '"content"' in args or '"text"' in args or '"type":"text"' in args:
-                        raise ValueError(f"ERROR: Invalid JSON - MCP response format detected in tool arguments. Tool arguments must be ONLY the parameters. CORRECT: {{\"index\": \"vehicles\"}}. WRONG: {{\"index\": \"vehicles\"}}{{\"content\": [...]}} or {{\"text\": \"...\"}}. Use ONLY parameter values, not response objects.")
-                    
-                    # Try to parse if it's a string
-                    try:
-                        args = json.loads(args)
-                    except json.JSONDecodeError as e:
-                        error_msg = str(e)
-                        if "after top-level value" in error_msg or args.count('{') > 1:
-                            # Try to extract indices from the malformed JSON
-                            index_matches = re.findall(r'"index"\s*:\s*"([^"]+)"', args)
-                            if index_matches and len(index_matches) > 1:
-                                raise ValueError(f"ERROR: Invalid JSON - 'after top-level value' error. You're concatenating {len(index_matches)} JSON objects: {', '.join(index_matches)}. This is INVALID JSON. You MUST make SEPARATE tool calls. CORRECT: Call 1 with {{\"index\": \"{index_matches[0]}\"}}, Call 2 with {{\"index\": \"{index_matches[1]}\"}}, etc. WRONG: {{\"index\": \"{index_matches[0]}\"}}{{\"index\": \"{index_matches[1]}\"}} - this causes the 'after top-level value' error.")
-                            raise ValueError(f"ERROR: Invalid JSON - 'after top-level value' error. You're concatenating multiple JSON objects. This is INVALID. Make SEPARATE tool calls. CORRECT: First call {{\"index\": \"vehicles\"}}, then second call {{\"index\": \"people\"}}. WRONG: {{\"index\": \"vehicles\"}}{{\"index\": \"people\"}} - this causes the error.")
-                        raise ValueError(f"ERROR: Invalid JSON arguments: {error_msg}. You must pass a SINGLE JSON object per tool call. CORRECT: {{\"index\": \"vehicles\"}}. WRONG: Multiple objects concatenated together. Make separate tool calls for each index/parameter.")
+                    # One pass over the string recovers concatenated or brace-less argument objects
+                    calls = es_args.decode(args)
+                    decode_ms = (time.perf_counter() - started) * 1000.0
+                    args = calls[0]
+                    if len(calls) == 1:
+                        calls = None
+                    elif tool_name.replace("elasticsearch__", "") in ("get_mappings", "sample_docs"):
+                        merged = es_args.merge_index_calls(calls)
+                        if merged is not None:
+                            args, calls = merged, None
                 elif not isinstance(args, dict):
                     raise ValueError(f"Arguments must be a dictionary, got {type(args)}")
                 
-                result = await self.call_tool(tool_name, args)
+                progress_token = (params.get("_meta") or {}).get("progressToken")
+                progress = None
+                if progress_token is not None and notify is not None:
+                    async def progress(done, total=None, text=None):
+                        update = {"progressToken": progress_token, "progress": done}
+                        if total is not None:
+                            update["total"] = total
+                        if text:
+                            update["message"] = text
+                        notify({"jsonrpc": "2.0", "method": "notifications/progress", "params": update})
+                if calls is None:
+                    result = await self.call_tool(tool_name, args, progress=progress)
+                    budget = es_shaping.budget_bytes(args)
+                    if tool_name.replace("elasticsearch__", "") == "search" and (args.get("cursor") or args.get("page_size")):
+                        # Paged searches fit the budget themselves, keeping the cursor in step
+                        budget = None
+                else:
+                    result = await self._call_batch(tool_name, calls)
+                    budget = max((es_shaping.budget_bytes(call) or 0 for call in calls), default=0) or None
                 # MCP protocol requires result.content array
-                result_text = json.dumps(result, indent=2)
+                encode_started = time.perf_counter()
+                if isinstance(result, str):
+                    result_text = result
+                else:
+                    result, result_text = es_shaping.fit_budget(result, budget, indent=RESULT_INDENT)
+                encode_ms = (time.perf_counter() - encode_started) * 1000.0
                 return {
                     "jsonrpc": "2.0",
                     "id": message["id"],
@@ -191,16 +380,11 @@ class MCPServer:
                         ]
                     }
                 }
-            except json.JSONDecodeError as e:
-                return {
-                    "jsonrpc": "2.0",
-                    "id": message["id"],
-                    "error": {
-                        "code": -32602,
-                        "message": f"ERROR: Invalid JSON arguments: {str(e)}. You must provide a SINGLE JSON object per tool call. CORRECT: {{\"index\": \"vehicles\"}}. WRONG: Multiple objects like {{\"index\": \"vehicles\"}}{{\"index\": \"people\"}}. Make separate tool calls for each index."
-                    }
-                }
+            except asyncio.CancelledError as e:
+                error = e
+                raise
             except Exception as e:
+                error = e
                 return {
                     "jsonrpc": "2.0",
                     "id": message["id"],
@@ -209,16 +393,465 @@ class MCPServer:
                         "message": f"Tool execution error: {str(e)}"
                     }
                 }
+            finally:
+                bytes_in = len(raw_args.encode("utf-8")) if isinstance(raw_args, str) else len(es_json.dumps_bytes(raw_args))
+                # Client-supplied names that are not tools share one label, so they cannot grow the metrics
+                label = tool_name.replace("elasticsearch__", "") if isinstance(tool_name, str) else None
+                self.metrics.end_call(label if label in self.tools else es_metrics.UNKNOWN_TOOL, call, (time.perf_counter() - started) * 1000.0,
+                                      decode_ms, encode_ms, bytes_in, len(result_text.encode("utf-8")), error, raw_args)
         return {"jsonrpc": "2.0", "id": message["id"], "error": {"code": -32601, "message": "Method not found"}}
 
-    async def call_tool(self, name, args):
+    async def _index_not_found(self, index, detail=""):
+        index_names = await self.schema.index_names()
+        if index in index_names:
+            # Elasticsearch disagrees with the cached catalog, so it is stale
+            self.schema.invalidate(index)
+            index_names = await self.schema.index_names(force=True)
+        return ValueError(f"Index '{index}' not found{detail}. Available indices: {', '.join(index_names)}")
+
+    @staticmethod
+    def _error_reason(error_json, default):
+        root_cause = error_json.get("error", {})
+        if isinstance(root_cause, dict):
+            return root_cause.get("root_cause", [{}])[0].get("reason", root_cause.get("reason", default))
+        return str(root_cause)
+
+    @staticmethod
+    def _index_list(args):
+        # Accept {"indices": [...]}, {"index": [...]} or a comma-separated {"index": "a,b"}
+        indices = args.get("indices")
+        if indices is None and isinstance(args.get("index"), list):
+            indices = args["index"]
+        if indices is None:
+            return None
+        if isinstance(indices, str):
+            indices = indices.split(",")
+        if not isinstance(indices, list) or not all(isinstance(i, str) for i in indices):
+            raise ValueError("indices must be a list of index names, e.g. [\"vehicles\", \"people\"]")
+        indices = list(dict.fromkeys(i.strip() for i in indices if i.strip()))
+        if not indices:
+            raise ValueError("indices must contain at least one index name")
+        return indices
+
+    async def _msearch(self, searches):
+        """Run [(index, body), ...] as one _msearch; return [(response, error), ...] in order."""
+        lines = []
+        for index, body in searches:
+            lines.append({"index": index})
+            lines.append(body)
+        r = await self.es.post("/_msearch", body=lines, ndjson=True)
+        r.raise_for_status()
+        results = []
+        for (index, _), item in zip(searches, r.json().get("responses", [])):
+            if "error" not in item:
+                results.append((item, None))
+            elif item.get("status") == 404:
+                results.append((None, str(await self._index_not_found(index, " (404)"))))
+            else:
+                reason = self._error_reason(item, json.dumps(item["error"]))
+                results.append((None, f"Error ({item.get('status')}) for index '{index}': {reason}"))
+        return results
+
+    async def _get_mappings_batch(self, indices):
+        mappings = await self.schema.get_mappings(indices)
+        results, errors = {}, {}
+        for index in indices:
+            mapping = mappings.get(index)
+            if mapping:
+                results[index] = mapping
+            else:
+                errors[index] = str(await self._index_not_found(index))
+        return {"results": results, "errors": errors}
+
+    async def _sample_docs_batch(self, indices, size, args):
+        body = es_shaping.apply_source_options({"size": size}, args)
+        results, errors = {}, {}
+        for index in indices:
+            hits = await self._profile_sample(index, size, args)
+            if hits is not None:
+                results[index] = es_shaping.shape_hits(hits, args)
+        remaining = [index for index in indices if index not in results]
+        if remaining:
+            for index, (response, error) in zip(remaining, await self._msearch([(index, body) for index in remaining])):
+                if error is None:
+                    results[index] = es_shaping.shape_hits(response["hits"]["hits"], args)
+                else:
+                    errors[index] = error
+        return {"results": {index: results[index] for index in indices if index in results}, "errors": errors}
+
+    async def _profile_sample(self, index, size, args):
+        """Sample hits for index from its profile, or None when Elasticsearch has to be asked."""
+        if args.get("source_includes") or args.get("source_excludes") or args.get("fields"):
+            return None
+        profile = await self.profiles.fresh(index)
+        if profile is None:
+            return None
+        sample = profile["sample"]
+        # The sample holds every document of a small index
+        if size > len(sample) and len(sample) < (profile["doc_count"] or 0):
+            return None
+        return sample[:size]
+
+    async def _check_search_response(self, index, r, body=None):
+        if r.status_code == 404:
+            raise await self._index_not_found(index, " (404)")
+        elif r.status_code == 400:
+            error_detail = r.text
+            try:
+                error_detail = self._error_reason(r.json(), error_detail)
+            except:
+                pass
+            
+            # Name fields the mapping does not know (with suggestions), or else list the
+            # available fields (full dotted paths, including multi-fields) to help debug
+            try:
+                fields = await self.schema.get_fields(index)
+                if fields:
+                    unknown = es_validate.unknown_fields(fields, index, body) if isinstance(body, dict) else []
+                    if unknown:
+                        error_detail += " " + " ".join(unknown)
+                    else:
+                        available_fields = [f"{path} ({'/'.join(sorted(info['types']))})" for path, info in fields.items() if info["types"] != {"object"}]
+                        error_detail += f" Available fields in '{index}': {', '.join(available_fields)}"
+            except:
+                pass
+            
+            raise ValueError(f"Bad Request (400) for index '{index}': {error_detail}. Use ONLY fields that exist in the index mapping.")
+        r.raise_for_status()
+
+    async def _query_problems(self, index, body=None, query=None, field_names=None, context=None):
+        """Problems found by checking a search body, query or field names against the mapping."""
+        if not VALIDATE_QUERIES:
+            return []
+        try:
+            fields = await self.schema.get_fields(index)
+        except Exception:
+            return []  # Validation is best effort; Elasticsearch still has the final word
+        if not fields:
+            return []
+        if body is not None:
+            return es_validate.validate_body(fields, index, body)
+        if query is not None:
+            return es_validate.validate_query(fields, index, query)
+        return es_validate.validate_fields(fields, index, field_names, context)
+
+    @staticmethod
+    def _validation_error(index, problems):
+        return ValueError(f"Query for index '{index}' was not sent to Elasticsearch: {' '.join(problems)}")
+
+    async def _open_pit(self, index, keep_alive):
+        # Not retried: a retry after the first attempt reached the cluster could open a second, leaked PIT
+        r = await self.es.post(f"/{index}/_pit", params={"keep_alive": keep_alive}, retry=False)
+        await self._check_search_response(index, r)
+        return r.json()["id"]
+
+    async def _close_pit(self, pit_id):
+        try:
+            await self.es.delete("/_pit", body={"id": pit_id})
+        except Exception:
+            pass  # The PIT expires on its own after keep_alive
+
+    async def _scan(self, index, body, page_size=DEFAULT_PAGE_SIZE, limit=None):
+        """Return every hit for body (up to limit), paging with PIT + search_after when needed."""
+        first_size = min(page_size, limit) if limit else page_size
+        r = await self.es.post(f"/{index}/_search", body=dict(body, size=first_size))
+        await self._check_search_response(index, r)
+        hits = r.json()["hits"]["hits"]
+        if len(hits) < first_size or (limit and len(hits) >= limit):
+            return hits
+        # More than one page: restart under a point in time so pages are consistent
+        hits = []
+        pit_id = await self._open_pit(index, PIT_KEEP_ALIVE)
+        try:
+            search_after = None
+            while True:
+                size = min(page_size, limit - len(hits)) if limit else page_size
+                page = dict(body, size=size, pit={"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                            sort=list(body.get("sort", [])) + [{"_shard_doc": "asc"}])
+                if search_after is not None:
+                    page["search_after"] = search_after
+                r = await self.es.post("/_search", body=page)
+                if r.status_code == 404:
+                    raise ValueError(f"The point in time used to page through '{index}' expired before all pages were read; retry the call.")
+                await self._check_search_response(index, r)
+                data = r.json()
+                pit_id = data.get("pit_id", pit_id)
+                batch = data["hits"]["hits"]
+                hits.extend(batch)
+                if len(batch) < size or (limit and len(hits) >= limit):
+                    return hits
+                search_after = batch[-1]["sort"]
+        finally:
+            await self._close_pit(pit_id)
+
+    @staticmethod
+    def _field_values(source, path):
+        # Values at a dotted path, flattening arrays and objects along the way
+        values = [source]
+        for part in path.split("."):
+            next_values = []
+            for value in values:
+                if isinstance(value, dict) and part in value:
+                    item = value[part]
+                    next_values.extend(item if isinstance(item, list) else [item])
+                elif isinstance(value, list):
+                    for element in value:
+                        if isinstance(element, dict) and part in element:
+                            item = element[part]
+                            next_values.extend(item if isinstance(item, list) else [item])
+            values = next_values
+        return [v for v in values if v is not None and not isinstance(v, (dict, list))]
+
+    @staticmethod
+    def _join_key(value):
+        # 1, 1.0 and "1" should link the same documents
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+
+    async def _join(self, hops, max_rows, chunk_size, max_keys):
+        names = []
+        for i, hop in enumerate(hops):
+            if not isinstance(hop, dict) or not hop.get("index"):
+                raise ValueError(f"hops[{i}] must be an object with an index")
+            if i < len(hops) - 1 and (not hop.get("join_field") or not hop.get("target_field")):
+                raise ValueError(f"hops[{i}] needs join_field (field in '{hop['index']}') and target_field (field in '{hops[i + 1]['index']}') to link to the next hop")
+            if hop.get("query") is not None and not isinstance(hop["query"], dict):
+                raise ValueError(f"hops[{i}].query must be a query DSL object")
+            name = hop.get("as") or hop["index"]
+            names.append(name if name not in names else f"{name}#{i}")
+
+        checks = []
+        for i, hop in enumerate(hops):
+            if hop.get("query"):
+                checks.append((hop["index"], self._query_problems(hop["index"], query=hop["query"])))
+            linked = [hop["join_field"]] if i < len(hops) - 1 else []
+            if i:
+                linked.append(hops[i - 1]["target_field"])
+            checks.append((hop["index"], self._query_problems(hop["index"], field_names=linked, context=f"hops[{i}]")))
+        for (index, _), problems in zip(checks, await asyncio.gather(*(c for _, c in checks))):
+            if problems:
+                raise self._validation_error(index, problems)
+
+        stages = []
+        keys = None
+        truncated = False
+        for i, hop in enumerate(hops):
+            last = i == len(hops) - 1
+            filters = [hop["query"]] if hop.get("query") else []
+            source = hop.get("source", True)
+            if isinstance(source, list):
+                needed = [hop.get("join_field"), hops[i - 1]["target_field"] if i else None]
+                source = list(dict.fromkeys(source + [f for f in needed if f]))
+            limit = max_rows if last else MAX_JOIN_DOCS
+            if i == 0:
+                bodies = [{"query": {"bool": {"filter": filters}} if filters else {"match_all": {}}, "_source": source}]
+            else:
+                target_field = hops[i - 1]["target_field"]
+                key_list = list(keys.values())
+                bodies = [{"query": {"bool": {"filter": filters + [{"terms": {target_field: key_list[c:c + chunk_size]}}]}}, "_source": source}
+                          for c in range(0, len(key_list), chunk_size)]
+            # Key chunks run a few at a time, each asking only for what the hop still has room for.
+            # One document past the limit is fetched so a hop that fits exactly is not reported truncated.
+            docs = []
+            for c in range(0, len(bodies), JOIN_CHUNK_CONCURRENCY):
+                remaining = limit + 1 - len(docs)
+                if remaining <= 0:
+                    break
+                chunk_hits = await asyncio.gather(*(self._scan(hop["index"], body, limit=remaining)
+                                                    for body in bodies[c:c + JOIN_CHUNK_CONCURRENCY]))
+                docs.extend(hit.get("_source", {}) for hits in chunk_hits for hit in hits)
+            if len(docs) > limit:
+                truncated = True
+                docs = docs[:limit]
+            stages.append(docs)
+            if last:
+                break
+            keys = {}
+            for doc in docs:
+                for value in self._field_values(doc, hop["join_field"]):
+                    keys.setdefault(self._join_key(value), value)
+            if len(keys) > max_keys:
+                raise ValueError(f"hops[{i}] produced {len(keys)} distinct {hop['join_field']} values, above max_keys={max_keys}. Narrow hops[{i}].query or raise max_keys.")
+            if not keys:
+                break
+
+        # Index each earlier hop by its join_field so rows can be assembled backwards
+        by_key = []
+        for i, docs in enumerate(stages[:-1]):
+            index = {}
+            for doc in docs:
+                for value in self._field_values(doc, hops[i]["join_field"]):
+                    index.setdefault(self._join_key(value), []).append(doc)
+            by_key.append(index)
+
+        rows = []
+        if len(stages) == len(hops):
+            partial = [{names[-1]: doc} for doc in stages[-1]]
+            for i in range(len(hops) - 2, -1, -1):
+                expanded = []
+                for row in partial:
+                    child = row[names[i + 1]]
+                    parents = []
+                    for value in self._field_values(child, hops[i]["target_field"]):
+                        parents.extend(by_key[i].get(self._join_key(value), []))
+                    if len(expanded) + len(parents) > max_rows:
+                        # Only flagged when a row is actually dropped, not when max_rows is met exactly
+                        expanded.extend(dict(row, **{names[i]: parent}) for parent in parents[:max_rows - len(expanded)])
+                        truncated = True
+                        break
+                    expanded.extend(dict(row, **{names[i]: parent}) for parent in parents)
+                partial = expanded
+            # Present each row in hop order
+            rows = [{name: row[name] for name in names} for row in partial]
+        return {
+            "rows": rows,
+            "row_count": len(rows),
+            "truncated": truncated,
+            "hops": [{"index": hop["index"], "as": names[i], "matched": len(stages[i]) if i < len(stages) else 0}
+                     for i, hop in enumerate(hops)],
+        }
+
+    async def _search_pages(self, args, progress=None):
+        page_size = args.get("page_size")
+        max_pages = max(1, min(int(args.get("max_pages", 1)), MAX_PAGES_PER_CALL))
+        cursor = args.get("cursor")
+        if cursor:
+            state = self.cursors.pop(cursor)
+            if state is None:
+                raise ValueError("Cursor expired or unknown. Start the search again with index, query_body and page_size.")
+            if page_size:
+                state["page_size"] = max(1, min(int(page_size), MAX_PAGE_SIZE))
+            if "rows" in args:
+                state["rows"] = bool(args["rows"])
+        else:
+            index = args.get("index")
+            query_body = args.get("query_body")
+            if not index:
+                raise ValueError("index parameter is required")
+            if not isinstance(query_body, dict):
+                raise ValueError(f"query_body must be a JSON object/dict, got {type(query_body)}")
+            keep_alive = args.get("keep_alive", PIT_KEEP_ALIVE)
+            _keep_alive_seconds(keep_alive)
+            problems = await self._query_problems(index, body=query_body)
+            if problems:
+                raise self._validation_error(index, problems)
+            body = es_shaping.apply_source_options(query_body, args)
+            body = {k: v for k, v in body.items() if k not in ("size", "from", "search_after", "pit", "scroll")}
+            # _shard_doc is a cheap, unique tiebreaker within a point in time
+            sort = body.get("sort", [])
+            body["sort"] = (sort if isinstance(sort, list) else [sort]) + [{"_shard_doc": "asc"}]
+            state = {
+                "index": index,
+                "body": body,
+                "page_size": max(1, min(int(page_size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)),
+                "keep_alive": keep_alive,
+                "pit_id": await self._open_pit(index, keep_alive),
+                "search_after": None,
+                "returned": 0,
+                "total": None,
+                "total_exact": False,
+                "rows": bool(args.get("rows")),
+            }
+        budget = es_shaping.budget_bytes(args)
+        token = secrets.token_urlsafe(16)
+        hits = []
+        done = False
+        try:
+            for page_no in range(max_pages):
+                page = dict(state["body"], size=state["page_size"], pit={"id": state["pit_id"], "keep_alive": state["keep_alive"]})
+                if state["search_after"] is not None:
+                    page["search_after"] = state["search_after"]
+                    page["track_total_hits"] = False
+                r = await self.es.post("/_search", body=page)
+                # Pages go to /_search with a PIT id, so a 404 means the point in time is gone, not the index
+                if r.status_code == 404:
+                    raise ValueError("Cursor expired: its point in time no longer exists on Elasticsearch. "
+                                     "Start the search again with index, query_body and page_size.")
+                await self._check_search_response(state["index"], r, state["body"])
+                data = r.json()
+                state["pit_id"] = data.get("pit_id", state["pit_id"])
+                if state["total"] is None:
+                    total = data["hits"].get("total") or {}
+                    state["total"] = total.get("value")
+                    state["total_exact"] = total.get("relation") == "eq"
+                batch = data["hits"]["hits"]
+                sorts = [hit.pop("sort", None) for hit in batch]
+                shaped = es_shaping.shape_hits(batch, {"rows": state["rows"]})
+                kept = len(shaped)
+                if budget:
+                    # Trim here rather than after the call, so the cursor resumes right after the last hit returned
+                    kept = self._hits_within_budget(state, hits, shaped, token, budget)
+                    if not hits and not kept:
+                        # A single hit larger than the budget is still returned, or the cursor could never move
+                        kept = 1
+                hits.extend(shaped[:kept])
+                state["returned"] += kept
+                if kept:
+                    state["search_after"] = sorts[kept - 1]
+                if progress is not None:
+                    await progress(state["returned"], state["total"], f"page {page_no + 1}: {kept} hits from '{state['index']}'")
+                if kept < len(batch):
+                    break
+                if len(batch) < state["page_size"] or (state["total_exact"] and state["returned"] >= state["total"]):
+                    done = True
+                    break
+        except BaseException:
+            await self._close_pit(state["pit_id"])
+            raise
+        if done:
+            token = None
+            await self._close_pit(state["pit_id"])
+        else:
+            self.cursors.set(token, state, ttl=_keep_alive_seconds(state["keep_alive"]))
+        return self._page_result(state, hits, token, done)
+
+    @staticmethod
+    def _page_result(state, hits, token, done):
+        return {
+            ("rows" if state["rows"] else "hits"): hits,
+            "total": state["total"],
+            "returned": state["returned"],
+            "cursor": token,
+            "done": done,
+        }
+
+    def _hits_within_budget(self, state, hits, batch, token, budget):
+        """How many of batch can follow hits while the paged result stays within budget bytes."""
+        low, high = 0, len(batch)
+        while low < high:
+            mid = (low + high + 1) // 2
+            result = self._page_result(dict(state, returned=state["returned"] + mid), hits + batch[:mid], token, False)
+            if len(es_json.dumps_bytes(result, indent=RESULT_INDENT)) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+    async def _call_batch(self, name, calls):
+        """Run argument objects recovered from one concatenated call concurrently."""
+        tool_name = name.replace("elasticsearch__", "")
+        if tool_name not in BATCHABLE_TOOLS or any(call.get("cursor") or call.get("page_size") for call in calls):
+            raise ValueError(f"Received {len(calls)} argument objects in one {tool_name} call; "
+                             f"{tool_name} runs one call at a time, so send them as separate calls.")
+        outcomes = await asyncio.gather(*(self.call_tool(name, call) for call in calls), return_exceptions=True)
+        results = []
+        for call, outcome in zip(calls, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, Exception):
+                results.append({"arguments": call, "error": str(outcome)})
+            else:
+                results.append({"arguments": call, "response": outcome})
+        return {"results": results}
+
+    async def call_tool(self, name, args, progress=None):
         # Handle tool name with or without prefix (elasticsearch__list_indices or list_indices)
         tool_name = name.replace("elasticsearch__", "") if name.startswith("elasticsearch__") else name
         
         if tool_name == "list_indices":
             index_pattern = args.get("index_pattern", "*")
-            r = requests.get(f"{ES_URL}/_cat/indices?format=json&h=index")
-            all_indices = [i["index"] for i in r.json()]
+            all_indices = await self.schema.index_names()
             # Filter by pattern if needed (simple wildcard matching)
             if index_pattern == "*":
                 indices = all_indices
@@ -226,43 +859,50 @@ class MCPServer:
                 indices = [idx for idx in all_indices if fnmatch.fnmatch(idx, index_pattern)]
             return {"indices": indices}
         elif tool_name == "get_mappings":
+            indices = self._index_list(args)
+            if indices is not None:
+                return await self._get_mappings_batch(indices)
             index = args.get("index")
             if not index:
-                raise ValueError("index parameter is required")
+                raise ValueError("index or indices parameter is required")
             # Check if index looks like it contains multiple indices (malformed input)
             if isinstance(index, str) and "}{" in index:
-                raise ValueError(f"Invalid index parameter: '{index}'. This looks like multiple JSON objects concatenated together. Please call get_mappings separately for each index (e.g., call once with index='vehicles', then again with index='people', etc.).")
-            
-            # First check if index exists
-            try:
-                r = requests.get(f"{ES_URL}/_cat/indices/{index}?format=json")
-                if r.status_code == 404 or not r.json():
-                    available_indices = requests.get(f"{ES_URL}/_cat/indices?format=json&h=index").json()
-                    index_names = [idx["index"] for idx in available_indices]
-                    raise ValueError(f"Index '{index}' not found. Available indices: {', '.join(index_names)}")
-            except requests.exceptions.RequestException:
-                pass  # Continue to try the mapping request
+                raise ValueError(f"Invalid index parameter: '{index}'. This looks like multiple JSON objects concatenated together. To fetch several mappings at once pass a list: {{\"indices\": [\"vehicles\", \"people\"]}}.")
             
-            r = requests.get(f"{ES_URL}/{index}/_mapping")
-            if r.status_code == 404:
-                available_indices = requests.get(f"{ES_URL}/_cat/indices?format=json&h=index").json()
-                index_names = [idx["index"] for idx in available_indices]
-                raise ValueError(f"Index '{index}' not found (404). Available indices: {', '.join(index_names)}")
-            r.raise_for_status()
-            return r.json()
+            # A missing index is a 404, and a pattern matching nothing is an empty mapping,
+            # so no separate existence check is needed
+            mapping = await self.schema.get_mapping(index)
+            if mapping is None:
+                raise await self._index_not_found(index, " (404)")
+            if not mapping:
+                raise await self._index_not_found(index)
+            return mapping
         elif tool_name == "sample_docs":
+            # Converted once here, so the profile sample and the search both get an integer
+            try:
+                size = int(args.get("size", 5))
+            except (TypeError, ValueError):
+                raise ValueError(f"size must be an integer, got {args.get('size')!r}")
+            if size < 0:
+                raise ValueError("size must not be negative")
+            indices = self._index_list(args)
+            if indices is not None:
+                return await self._sample_docs_batch(indices, size, args)
             index = args.get("index")
             if not index:
-                raise ValueError("index parameter is required")
-            size = args.get("size", 5)
-            r = requests.get(f"{ES_URL}/{index}/_search", json={"size": size})
+                raise ValueError("index or indices parameter is required")
+            hits = await self._profile_sample(index, size, args)
+            if hits is not None:
+                return es_shaping.shape_hits(hits, args)
+            body = es_shaping.apply_source_options({"size": size}, args)
+            r = await self.query_cache.search(index, body, lambda: self.es.post(f"/{index}/_search", body=body))
             if r.status_code == 404:
-                available_indices = requests.get(f"{ES_URL}/_cat/indices?format=json&h=index").json()
-                index_names = [idx["index"] for idx in available_indices]
-                raise ValueError(f"Index '{index}' not found (404). Available indices: {', '.join(index_names)}")
+                raise await self._index_not_found(index, " (404)")
             r.raise_for_status()
-            return r.json()["hits"]["hits"]
+            return es_shaping.shape_hits(r.json()["hits"]["hits"], args)
         elif tool_name == "search":
+            if args.get("cursor") or args.get("page_size"):
+                return await self._search_pages(args, progress)
             index = args.get("index")
             query_body = args.get("query_body")
             if not index:
@@ -274,42 +914,192 @@ class MCPServer:
             if not isinstance(query_body, dict):
                 raise ValueError(f"query_body must be a JSON object/dict, got {type(query_body)}")
             
-            r = requests.post(f"{ES_URL}/{index}/_search", json=query_body)
-            if r.status_code == 404:
-                available_indices = requests.get(f"{ES_URL}/_cat/indices?format=json&h=index").json()
-                index_names = [idx["index"] for idx in available_indices]
-                raise ValueError(f"Index '{index}' not found (404). Available indices: {', '.join(index_names)}")
-            elif r.status_code == 400:
-                error_detail = r.text
-                try:
-                    error_json = r.json()
-                    root_cause = error_json.get("error", {})
-                    if isinstance(root_cause, dict):
-                        error_detail = root_cause.get("root_cause", [{}])[0].get("reason", root_cause.get("reason", error_detail))
-                    else:
-                        error_detail = str(root_cause)
-                except:
-                    pass
-                
-                # Get available fields from mapping to help debug
-                try:
-                    mapping_r = requests.get(f"{ES_URL}/{index}/_mapping")
-                    if mapping_r.status_code == 200:
-                        mapping_data = mapping_r.json()
-                        index_mapping = mapping_data.get(list(mapping_data.keys())[0], {}).get("mappings", {}).get("properties", {})
-                        available_fields = list(index_mapping.keys())
-                        error_detail += f" Available fields in '{index}': {', '.join(available_fields)}"
-                except:
-                    pass
-                
-                raise ValueError(f"Bad Request (400) for index '{index}': {error_detail}. Use ONLY fields that exist in the index mapping.")
-            r.raise_for_status()
-            return r.json()
+            problems = await self._query_problems(index, body=query_body)
+            if problems:
+                raise self._validation_error(index, problems)
+            query_body = es_shaping.apply_source_options(query_body, args)
+            r = await self.query_cache.search(index, query_body, lambda: self.es.post(f"/{index}/_search", body=query_body))
+            await self._check_search_response(index, r, query_body)
+            return es_shaping.shape_search_response(r.json(), args)
+        elif tool_name == "refresh_schema_cache":
+            index = args.get("index")
+            self.schema.invalidate(index)
+            self.query_cache.invalidate(index)
+            self.profiles.invalidate(index)
+            return {"invalidated": index or "*"}
+        elif tool_name == "multi_search":
+            searches = args.get("searches")
+            if not isinstance(searches, list) or not searches:
+                raise ValueError("searches must be a non-empty list of {\"index\": ..., \"query_body\": {...}} objects")
+            pairs = []
+            for i, item in enumerate(searches):
+                if not isinstance(item, dict) or not item.get("index") or not isinstance(item.get("query_body"), dict):
+                    raise ValueError(f"searches[{i}] must be an object with an index name and a query_body object")
+                pairs.append((item["index"], es_shaping.apply_source_options(item["query_body"], args)))
+            # Searches that fail local validation report their own error and are not sent
+            problems = await asyncio.gather(*(self._query_problems(index, body=searches[i]["query_body"]) for i, (index, _) in enumerate(pairs)))
+            valid = [pair for pair, p in zip(pairs, problems) if not p]
+            outcomes = iter(await self._msearch(valid) if valid else [])
+            results = []
+            for (index, _), p in zip(pairs, problems):
+                response, error = (None, str(self._validation_error(index, p))) if p else next(outcomes)
+                if error is None:
+                    results.append({"index": index, "response": es_shaping.shape_search_response(response, args)})
+                else:
+                    results.append({"index": index, "error": error})
+            return {"results": results}
+        elif tool_name == "count":
+            index = args.get("index")
+            query = args.get("query")
+            if not index:
+                raise ValueError("index parameter is required")
+            if query is not None and not isinstance(query, dict):
+                raise ValueError("query must be a query DSL object")
+            problems = await self._query_problems(index, query=query) if query else []
+            if problems:
+                raise self._validation_error(index, problems)
+            body = {"query": query} if query else {}
+            r = await self.query_cache.search(index, body, lambda: self.es.post(f"/{index}/_count", body=body), endpoint="_count")
+            await self._check_search_response(index, r, body)
+            return {"index": index, "count": r.json()["count"]}
+        elif tool_name == "aggregate":
+            index = args.get("index")
+            query = args.get("query")
+            if not index:
+                raise ValueError("index parameter is required")
+            if query is not None and not isinstance(query, dict):
+                raise ValueError("query must be a query DSL object")
+            try:
+                fields = await self.schema.get_fields(index)
+            except Exception:
+                fields = None
+            groups, metrics, notes = es_aggs.parse_spec(args, fields)
+            body = es_aggs.build_body(groups, metrics, query)
+            problems = await self._query_problems(index, body=body)
+            if problems:
+                raise self._validation_error(index, problems)
+            r = await self.query_cache.search(index, body, lambda: self.es.post(f"/{index}/_search", body=body))
+            await self._check_search_response(index, r, body)
+            table = es_aggs.flatten(r.json(), groups, metrics)
+            if notes:
+                table["notes"] = notes
+            return table
+        elif tool_name == "join":
+            hops = args.get("hops")
+            if not isinstance(hops, list) or len(hops) < 2:
+                raise ValueError("hops must be a list of at least two {\"index\", \"query\", \"join_field\", \"target_field\"} objects")
+            max_rows = int(args.get("max_rows", DEFAULT_JOIN_ROWS))
+            chunk_size = int(args.get("chunk_size", DEFAULT_TERMS_CHUNK))
+            max_keys = int(args.get("max_keys", DEFAULT_JOIN_KEYS))
+            if max_rows < 1 or chunk_size < 1:
+                raise ValueError("max_rows and chunk_size must be positive")
+            return await self._join(hops, max_rows, min(chunk_size, MAX_TERMS_CHUNK), max_keys)
+        elif tool_name == "get_profile":
+            index = args.get("index")
+            if not index or not isinstance(index, str):
+                raise ValueError("index parameter is required")
+            sample_size = int(args.get("sample_size", DEFAULT_PROFILE_SAMPLE))
+            profile = await self.profiles.get(index)
+            if profile is None:
+                raise await self._index_not_found(index, " (profiles need a concrete index name, not a pattern or alias)")
+            return {
+                "index": index,
+                "doc_count": profile["doc_count"],
+                "age_seconds": round(time.time() - profile["built_at"], 1),
+                "fields": profile["fields"],
+                "sample": [hit.get("_source", {}) for hit in profile["sample"][:max(0, sample_size)]],
+            }
+        elif tool_name == "cache_stats":
+            return {"schema": self.schema.stats(), "query": self.query_cache.stats(), "profiles": self.profiles.stats()}
+        elif tool_name == "server_stats":
+            schema = self.schema.stats()
+            caches = {"catalog": schema["catalog"], "mappings": schema["mappings"], "query": self.query_cache.stats(),
+                      "profiles": self.profiles.stats()}
+            if args.get("format") == "prometheus":
+                return self.metrics.prometheus(caches)
+            return self.metrics.snapshot(caches)
         else:
             raise ValueError(f"Tool not found: {tool_name}")
 
+def _keep_alive_seconds(keep_alive):
+    # Elasticsearch time units as used for PIT keep_alive ("30s", "1m", "2h")
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+    match = re.fullmatch(r"\s*(\d+)\s*(ms|s|m|h|d)\s*", str(keep_alive))
+    if not match:
+        raise ValueError(f"Invalid keep_alive '{keep_alive}'. Use a duration like '30s', '1m' or '5m'.")
+    return int(match.group(1)) * units[match.group(2)]
+
+class Dispatcher:
+    """Schedules JSON-RPC requests concurrently and writes each reply as soon as it is ready."""
+
+    def __init__(self, server, write, max_concurrency=None, semaphore=None):
+        self.server = server
+        self.write = write
+        if semaphore is None:
+            if max_concurrency is None:
+                max_concurrency = int(os.environ.get("MCP_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+            # Dispatchers that pass a shared semaphore (one per HTTP session) share one limit
+            semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.semaphore = semaphore
+        self.in_flight = {}
+
+    def submit(self, message):
+        if message.get("method") == "notifications/cancelled":
+            self.cancel(message.get("params", {}).get("requestId"))
+            return
+        if "id" not in message:
+            # Other notifications (e.g. notifications/initialized) need no reply
+            return
+        task = asyncio.ensure_future(self._run(message))
+        key = self._key(message["id"])
+        self.in_flight[key] = task
+        task.add_done_callback(lambda t, key=key: self._finished(key, t))
+        return task
+
+    def cancel(self, request_id):
+        task = self.in_flight.get(self._key(request_id))
+        if task is not None:
+            task.cancel()
+
+    async def drain(self):
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight.values(), return_exceptions=True)
+
+    async def _run(self, message):
+        queued = time.perf_counter()
+        async with self.semaphore:
+            self.server.metrics.observe_queue_wait((time.perf_counter() - queued) * 1000.0)
+            try:
+                response = await self.server.handle_message(message, notify=self.write)
+            except asyncio.CancelledError:
+                # Per MCP, a cancelled request gets no response
+                raise
+            except Exception as e:
+                response = {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+                }
+        if response is not None:
+            self.write(response)
+
+    def _finished(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+
+    @staticmethod
+    def _key(request_id):
+        # JSON-RPC ids may be numbers or strings; cancellation may echo either form
+        return str(request_id)
+
+def write_message(message):
+    print(es_json.dumps(message), flush=True)
+    sys.stdout.flush()
+
 async def main():
     server = MCPServer()
+    server.start()
+    dispatcher = Dispatcher(server, write_message)
     loop = asyncio.get_event_loop()
     while True:
         try:
@@ -319,28 +1109,25 @@ async def main():
             if not line.strip():
                 continue
             try:
-                message = json.loads(line.strip())
-                response = await server.handle_message(message)
-                print(json.dumps(response), flush=True)
-                sys.stdout.flush()
+                message = es_json.loads(line.strip())
+                dispatcher.submit(message)
             except json.JSONDecodeError as e:
                 # Send error response for invalid JSON
-                error_response = {
+                write_message({
                     "jsonrpc": "2.0",
                     "id": None,
                     "error": {"code": -32700, "message": f"Parse error: {str(e)}"}
-                }
-                print(json.dumps(error_response), flush=True)
-                sys.stdout.flush()
+                })
         except Exception as e:
             # Log error but continue
-            error_response = {
+            write_message({
                 "jsonrpc": "2.0",
                 "id": None,
                 "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
-            }
-            print(json.dumps(error_response), flush=True)
-            sys.stdout.flush()
+            })
+    # Let in-flight calls finish before exiting on EOF
+    await dispatcher.drain()
+    await server.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,6 +1,28 @@
-import requests
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+
+import es_json
+from es_transport import ESTransport
+
+# Seeds the vehicles / people / registrations indices through the _bulk API.
+# Documents are streamed from generators into a bounded queue of bulk
+# batches, so memory stays flat at any scale. Refresh and replicas are turned
+# off while loading and restored afterwards.
+#
+#   python3 seed_data.py                     # the small example dataset below
+#   python3 seed_data.py --synthetic --vehicles 1000000 --people 2000000 --registrations 10000000
 
 ES_URL = "http://localhost:9200"
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_BATCH_MB = 10
+DEFAULT_WORKERS = 4
+BULK_TIMEOUT = 120.0
+MAX_BULK_RETRIES = 5
+PROGRESS_INTERVAL = 5.0
 
 # Create indices with more complex data and relations
 indices = {
@@ -28,11 +50,269 @@ indices = {
     ]
 }
 
-for index, docs in indices.items():
-    # Create index
-    requests.put(f"{ES_URL}/{index}", json={"settings": {"number_of_shards": 1}})
-    # Insert documents
-    for i, doc in enumerate(docs, start=1):
-        requests.post(f"{ES_URL}/{index}/_doc/{i}", json=doc)
+# Vocabulary for the synthetic dataset
+MODELS = {
+    "Tesla": [("Model 3", "electric car"), ("Model Y", "electric car"), ("Model S", "electric car")],
+    "Toyota": [("Corolla", "sedan"), ("Camry", "sedan"), ("RAV4", "SUV"), ("Prius", "hybrid")],
+    "Ford": [("Mustang", "sports car"), ("F-150", "truck"), ("Explorer", "SUV"), ("Focus", "hatchback")],
+    "BMW": [("X5", "SUV"), ("3 Series", "sedan"), ("i4", "electric car"), ("M4", "sports car")],
+    "Honda": [("Civic", "sedan"), ("Accord", "sedan"), ("CR-V", "SUV"), ("Fit", "hatchback")],
+    "Volkswagen": [("Golf", "hatchback"), ("Passat", "sedan"), ("ID.4", "electric car")],
+    "Chevrolet": [("Silverado", "truck"), ("Malibu", "sedan"), ("Bolt", "electric car")],
+    "Kia": [("Sportage", "SUV"), ("Rio", "hatchback"), ("EV6", "electric car")],
+}
+BASE_PRICE = {"sedan": 24000, "hatchback": 19000, "SUV": 38000, "truck": 42000,
+              "sports car": 55000, "electric car": 48000, "hybrid": 28000}
+FIRST_NAMES = ["Alice", "Bob", "Charlie", "Diana", "Eve", "Frank", "Grace", "Henry", "Ivy", "Jack",
+               "Karen", "Liam", "Mia", "Noah", "Olivia", "Paul", "Quinn", "Rosa", "Sam", "Tara"]
+LAST_NAMES = ["Johnson", "Smith", "Brown", "Prince", "Adams", "Garcia", "Miller", "Davis", "Lopez", "Wilson",
+              "Moore", "Taylor", "Anderson", "Thomas", "Lee", "Martin", "Clark", "Lewis", "Young", "King"]
+# City populations are skewed too: earlier entries are picked more often
+CITIES = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix", "Philadelphia", "San Antonio",
+          "San Diego", "Dallas", "Austin", "Seattle", "Denver", "Boston", "Miami", "Portland"]
+CITY_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(CITIES))]
+
+
+class SkewedKeys:
+    """Draws ids in 1..n with a Zipf-like (power law) distribution.
+
+    Rank r is picked with probability ~ r**-skew via the inverse CDF of a
+    bounded power law, then mapped through a fixed multiplicative permutation
+    so the hot keys are spread over the id range instead of being 1, 2, 3.
+    skew=0 gives uniform keys.
+    """
+
+    def __init__(self, n, skew, rng):
+        self.n = n
+        self.skew = skew
+        self.rng = rng
+        # A multiplier coprime with n makes rank -> id a bijection
+        self.step = next(p for p in (2654435761, 40503, 7919, 1) if math.gcd(p, n) == 1)
+
+    def rank(self):
+        u = self.rng.random()
+        if self.skew == 0:
+            return int(u * self.n)
+        if self.skew == 1:
+            return min(self.n - 1, int(self.n ** u) - 1)
+        a = 1.0 - self.skew
+        return min(self.n - 1, int(((self.n ** a - 1.0) * u + 1.0) ** (1.0 / a)) - 1)
+
+    def __call__(self):
+        return (self.rank() * self.step) % self.n + 1
+
+
+def example_docs(index):
+    for i, doc in enumerate(indices[index], start=1):
+        yield i, doc
+
+
+def synthetic_vehicles(count, rng):
+    makes = list(MODELS)
+    make_weights = [1.0 / (rank + 1) ** 0.5 for rank in range(len(makes))]
+    for i in range(1, count + 1):
+        make = rng.choices(makes, make_weights)[0]
+        model, vehicle_type = rng.choice(MODELS[make])
+        year = rng.randint(2005, 2024)
+        price = int(BASE_PRICE[vehicle_type] * (0.6 + 0.02 * (year - 2005)) * rng.uniform(0.85, 1.25)) // 100 * 100
+        yield i, {"id": i, "make": make, "model": model, "year": year, "type": vehicle_type, "price": price}
+
+
+def synthetic_people(count, rng):
+    for i in range(1, count + 1):
+        yield i, {"id": i, "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                  "age": rng.randint(18, 85), "city": rng.choices(CITIES, CITY_WEIGHTS)[0]}
+
+
+def synthetic_registrations(count, vehicles, people, skew, rng):
+    # A few vehicles change hands many times and a few people own many cars
+    vehicle_ids = SkewedKeys(vehicles, skew, rng)
+    person_ids = SkewedKeys(people, skew, rng)
+    for i in range(1, count + 1):
+        yield i, {"vehicle_id": vehicle_ids(), "person_id": person_ids(),
+                  "reg_date": f"{rng.randint(2005, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                  "status": "active" if rng.random() < 0.7 else "expired"}
+
+
+def bulk_batches(index, docs, batch_size, batch_bytes):
+    """Yield (payload, count) _bulk bodies of at most batch_size docs / about batch_bytes."""
+    lines = []
+    size = 0
+    count = 0
+    for doc_id, doc in docs:
+        action = es_json.dumps_bytes({"index": {"_index": index, "_id": str(doc_id)}})
+        source = es_json.dumps_bytes(doc)
+        lines.append(action + b"\n" + source + b"\n")
+        size += len(action) + len(source) + 2
+        count += 1
+        if count >= batch_size or size >= batch_bytes:
+            yield b"".join(lines), count
+            lines, size, count = [], 0, 0
+    if lines:
+        yield b"".join(lines), count
+
+
+def split_payload(payload):
+    # Pairs of action/source lines, in the order of the bulk response items
+    lines = payload.split(b"\n")
+    return [lines[i] + b"\n" + lines[i + 1] + b"\n" for i in range(0, len(lines) - 1, 2)]
+
+
+class Loader:
+    def __init__(self, es, workers, shards):
+        self.es = es
+        self.workers = workers
+        self.shards = shards
+        self.indexed = 0
+        self.failed = 0
+        self.errors_shown = 0
+
+    async def prepare(self, index, recreate):
+        if recreate:
+            await self.es.delete(f"/{index}", params={"ignore_unavailable": "true"})
+        r = await self.es.put(f"/{index}", body={"settings": {"number_of_shards": self.shards}})
+        if r.status_code >= 400 and "resource_already_exists" not in r.text:
+            r.raise_for_status()
+        r = await self.es.get(f"/{index}/_settings", params={"flat_settings": "true"})
+        r.raise_for_status()
+        settings = r.json()[index]["settings"]
+        saved = {"index.refresh_interval": settings.get("index.refresh_interval"),
+                 "index.number_of_replicas": settings.get("index.number_of_replicas", "1")}
+        # No refreshes and no replica copies while loading; both are restored in finish()
+        r = await self.es.put(f"/{index}/_settings", body={"index.refresh_interval": "-1", "index.number_of_replicas": 0})
+        r.raise_for_status()
+        return saved
+
+    async def finish(self, index, saved):
+        r = await self.es.put(f"/{index}/_settings", body=saved)
+        r.raise_for_status()
+        r = await self.es.post(f"/{index}/_refresh")
+        r.raise_for_status()
+
+    async def send(self, payload):
+        for attempt in range(MAX_BULK_RETRIES + 1):
+            r = await self.es.post("/_bulk", body=payload, ndjson=True,
+                                   params={"filter_path": "errors,items.*.status,items.*.error.type,items.*.error.reason"})
+            if r.status_code == 429:
+                await asyncio.sleep(min(30, 0.5 * 2 ** attempt))
+                continue
+            r.raise_for_status()
+            result = r.json()
+            items = [next(iter(item.values())) for item in result.get("items", [])]
+            if not result.get("errors"):
+                self.indexed += len(items) if items else payload.count(b"\n") // 2
+                return
+            # Resend only the documents rejected because the cluster was busy
+            docs = split_payload(payload)
+            retry = [doc for doc, item in zip(docs, items) if item.get("status") == 429]
+            for item in items:
+                status = item.get("status", 0)
+                if status < 300:
+                    self.indexed += 1
+                elif status != 429:
+                    self.failed += 1
+                    if self.errors_shown < 5:
+                        self.errors_shown += 1
+                        error = item.get("error", {})
+                        print(f"  bulk item failed ({status}): {error.get('type')}: {error.get('reason')}", file=sys.stderr)
+            if not retry:
+                return
+            payload = b"".join(retry)
+            await asyncio.sleep(min(30, 0.5 * 2 ** attempt))
+        remaining = payload.count(b"\n") // 2
+        self.failed += remaining
+        print(f"  gave up on {remaining} documents after {MAX_BULK_RETRIES} retries", file=sys.stderr)
+
+    async def load(self, index, docs, batch_size, batch_bytes):
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        errors = []
+
+        async def worker():
+            # Keeps draining the queue after a failure so the producer never blocks
+            while True:
+                payload = await queue.get()
+                if payload is None:
+                    return
+                if not errors:
+                    try:
+                        await self.send(payload)
+                    except Exception as e:
+                        errors.append(e)
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(self.workers)]
+        started = last_report = time.monotonic()
+        start_count = self.indexed
+        try:
+            for payload, _ in bulk_batches(index, docs, batch_size, batch_bytes):
+                if errors:
+                    break
+                # Blocks while every worker is busy, so the generator never runs far ahead
+                await queue.put(payload)
+                now = time.monotonic()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    done = self.indexed - start_count
+                    print(f"  {index}: {done} docs, {done / (now - started):.0f} docs/s", file=sys.stderr)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if errors:
+            raise errors[0]
+        return self.indexed - start_count, time.monotonic() - started
+
+
+async def seed(args):
+    es = ESTransport(args.es_url or None, timeout=args.timeout, pool_per_host=max(args.workers, 1) + 2)
+    rng = random.Random(args.seed)
+    if args.synthetic:
+        datasets = [
+            ("vehicles", synthetic_vehicles(args.vehicles, rng)),
+            ("people", synthetic_people(args.people, rng)),
+            ("registrations", synthetic_registrations(args.registrations, args.vehicles, args.people, args.skew, rng)),
+        ]
+    else:
+        datasets = [(index, example_docs(index)) for index in indices]
+    loader = Loader(es, args.workers, args.shards)
+    try:
+        for index, docs in datasets:
+            saved = await loader.prepare(index, args.recreate)
+            try:
+                count, elapsed = await loader.load(index, docs, args.batch_size, int(args.batch_mb * 1024 * 1024))
+            finally:
+                await loader.finish(index, saved)
+            print(f"{index}: {count} docs in {elapsed:.1f}s ({count / elapsed if elapsed else count:.0f} docs/s)")
+    finally:
+        await es.close()
+    if loader.failed:
+        print(f"{loader.failed} documents failed to index", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed Elasticsearch with the vehicles/people/registrations dataset")
+    parser.add_argument("--es-url", help=f"Elasticsearch URL(s), comma-separated (default: $ES_URL or {ES_URL})")
+    parser.add_argument("--synthetic", action="store_true", help="generate data at the scale below instead of the small example set")
+    parser.add_argument("--vehicles", type=int, default=100000)
+    parser.add_argument("--people", type=int, default=200000)
+    parser.add_argument("--registrations", type=int, default=1000000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for registration keys (0 = uniform)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed; the same seed gives the same data")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="documents per _bulk request")
+    parser.add_argument("--batch-mb", type=float, default=DEFAULT_BATCH_MB, help="cap on a _bulk request body in MB")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="concurrent _bulk requests")
+    parser.add_argument("--shards", type=int, default=1, help="primary shards for newly created indices")
+    parser.add_argument("--recreate", action="store_true", help="delete the indices first")
+    parser.add_argument("--timeout", type=float, default=BULK_TIMEOUT, help="seconds per _bulk request")
+    args = parser.parse_args()
+    status = asyncio.run(seed(args))
+    if status == 0:
+        print("Complex sample data with relations seeded successfully.")
+    sys.exit(status)
+
 
-print("Complex sample data with relations seeded successfully.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import contextlib
+import socket
+
+from aiohttp import web
+
+from fake_es import FakeES
+
+
+@contextlib.asynccontextmanager
+async def serve(app):
+    """Serve an aiohttp app on a free local port in the running loop; yields its URL."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+@contextlib.asynccontextmanager
+async def fake_cluster(**options):
+    """Serve bench/fake_es.py; yields (fake, url)."""
+    fake = FakeES(**options)
+    async with serve(fake.app()) as url:
+        yield fake, url
+
+
+def closed_port_url():
+    # A port nothing listens on, for connection failures
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+import es_json
+import mcp_server
+from es_transport import ESTransport
+from fake_cluster import fake_cluster
+
+
+def run_with_server(monkeypatch, steps, **options):
+    """Run steps(server, fake) against a fake cluster with profiles off."""
+    monkeypatch.setenv("MCP_PROFILES", "0")
+
+    async def run():
+        async with fake_cluster(**options) as (fake, url):
+            server = mcp_server.MCPServer(transport=ESTransport(url))
+            try:
+                return await steps(server, fake)
+            finally:
+                await server.close()
+    return asyncio.run(run())
+
+
+def test_cursor_walks_every_document_once(monkeypatch):
+    async def steps(server, fake):
+        ids = []
+        pages = 0
+        result = await server.call_tool("search", {"index": "people", "query_body": {"query": {"match_all": {}}}, "page_size": 7})
+        assert result["total"] == 50
+        while True:
+            pages += 1
+            ids.extend(hit["_source"]["id"] for hit in result["hits"])
+            if result["done"]:
+                break
+            assert fake.pits, "the point in time stays open between pages"
+            result = await server.call_tool("search", {"cursor": result["cursor"]})
+        return ids, pages, result, fake
+    ids, pages, last, fake = run_with_server(monkeypatch, steps, docs=50)
+    assert sorted(ids) == list(range(1, 51))
+    assert pages == 8
+    assert last["cursor"] is None and last["returned"] == 50
+    assert fake.pits == {}
+
+
+def test_several_pages_per_call(monkeypatch):
+    async def steps(server, fake):
+        result = await server.call_tool("search", {"index": "people", "query_body": {"query": {"match_all": {}}},
+                                                   "page_size": 10, "max_pages": 3, "rows": True})
+        return result
+    result = run_with_server(monkeypatch, steps, docs=50)
+    assert [row["id"] for row in result["rows"]] == list(range(1, 31))
+    assert result["returned"] == 30 and not result["done"]
+
+
+def test_used_cursor_is_unknown(monkeypatch):
+    async def steps(server, fake):
+        first = await server.call_tool("search", {"index": "people", "query_body": {}, "page_size": 10})
+        await server.call_tool("search", {"cursor": first["cursor"]})
+        with pytest.raises(ValueError, match="expired or unknown"):
+            await server.call_tool("search", {"cursor": first["cursor"]})
+    run_with_server(monkeypatch, steps, docs=50)
+
+
+def test_keep_alive_expiry_forgets_the_cursor(monkeypatch):
+    async def steps(server, fake):
+        first = await server.call_tool("search", {"index": "people", "query_body": {}, "page_size": 10, "keep_alive": "1ms"})
+        await asyncio.sleep(0.01)
+        with pytest.raises(ValueError, match="expired or unknown"):
+            await server.call_tool("search", {"cursor": first["cursor"]})
+    run_with_server(monkeypatch, steps, docs=50)
+
+
+def test_point_in_time_gone_on_elasticsearch(monkeypatch):
+    async def steps(server, fake):
+        first = await server.call_tool("search", {"index": "people", "query_body": {}, "page_size": 10})
+        fake.pits.clear()
+        with pytest.raises(ValueError, match="Cursor expired: its point in time no longer exists"):
+            await server.call_tool("search", {"cursor": first["cursor"]})
+        # The failed call does not leave a cursor behind
+        assert len(server.cursors) == 0
+    run_with_server(monkeypatch, steps, docs=50)
+
+
+def test_short_result_closes_the_point_in_time(monkeypatch):
+    async def steps(server, fake):
+        result = await server.call_tool("search", {"index": "people", "query_body": {"query": {"term": {"id": 3}}}, "page_size": 10})
+        return result, fake
+    result, fake = run_with_server(monkeypatch, steps, docs=50)
+    assert result["done"] and result["cursor"] is None and len(result["hits"]) == 1
+    assert fake.pits == {}
+
+
+def test_invalid_keep_alive_opens_nothing(monkeypatch):
+    async def steps(server, fake):
+        with pytest.raises(ValueError, match="Invalid keep_alive"):
+            await server.call_tool("search", {"index": "people", "query_body": {}, "page_size": 10, "keep_alive": "soon"})
+        return fake
+    assert run_with_server(monkeypatch, steps, docs=50).pits == {}
+
+
+def call(server, arguments):
+    message = {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": "search", "arguments": arguments}}
+    return server.handle_message(message)
+
+
+def test_cursor_under_a_budget_returns_every_document_once(monkeypatch):
+    async def steps(server, fake):
+        ids = []
+        sizes = []
+        reply = await call(server, {"index": "people", "query_body": {}, "page_size": 10, "rows": True, "max_bytes": 600})
+        while True:
+            text = reply["result"]["content"][0]["text"]
+            sizes.append(len(text.encode("utf-8")))
+            result = es_json.loads(text)
+            assert "_truncated" not in result
+            ids.extend(row["id"] for row in result["rows"])
+            if result["done"]:
+                break
+            reply = await call(server, {"cursor": result["cursor"], "max_bytes": 600})
+        return ids, sizes, fake
+    ids, sizes, fake = run_with_server(monkeypatch, steps, docs=50)
+    assert sorted(ids) == list(range(1, 51)) and len(ids) == 50
+    assert max(sizes) <= 600 and len(sizes) > 5
+    assert fake.pits == {}
+
+
+def test_hit_larger_than_the_budget_still_moves_the_cursor(monkeypatch):
+    async def steps(server, fake):
+        first = await server.call_tool("search", {"index": "people", "query_body": {}, "page_size": 5, "max_bytes": 50})
+        second = await server.call_tool("search", {"cursor": first["cursor"], "max_bytes": 50})
+        return first, second
+    first, second = run_with_server(monkeypatch, steps, docs=50, doc_bytes=200)
+    assert [hit["_source"]["id"] for hit in first["hits"]] == [1]
+    assert [hit["_source"]["id"] for hit in second["hits"]] == [2]
+
+
+def test_paged_searches_cannot_be_batched(monkeypatch):
+    async def steps(server, fake):
+        with pytest.raises(ValueError, match="separate calls"):
+            await server._call_batch("search", [{"index": "people", "query_body": {}, "page_size": 5}] * 2)
+        return fake
+    assert run_with_server(monkeypatch, steps, docs=5).pits == {}
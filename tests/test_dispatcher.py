@@ -0,0 +1,121 @@
+import asyncio
+
+from mcp_server import Dispatcher
+
+
+class Metrics:
+    def observe_queue_wait(self, ms):
+        pass
+
+
+class SlowServer:
+    """Answers {"delay": seconds} requests after sleeping that long."""
+
+    def __init__(self):
+        self.metrics = Metrics()
+        self.running = 0
+        self.peak = 0
+        self.cancelled = []
+
+    async def handle_message(self, message, notify=None):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(message["params"]["delay"])
+        except asyncio.CancelledError:
+            self.cancelled.append(message["id"])
+            raise
+        finally:
+            self.running -= 1
+        if message["params"].get("fail"):
+            raise RuntimeError("boom")
+        return {"jsonrpc": "2.0", "id": message["id"], "result": {}}
+
+
+def request(request_id, delay, **params):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call", "params": dict(params, delay=delay)}
+
+
+def test_replies_are_written_as_calls_finish():
+    async def run():
+        written = []
+        dispatcher = Dispatcher(SlowServer(), written.append, max_concurrency=4)
+        dispatcher.submit(request(1, 0.05))
+        dispatcher.submit(request(2, 0.0))
+        await dispatcher.drain()
+        return [m["id"] for m in written]
+    assert asyncio.run(run()) == [2, 1]
+
+
+def test_concurrency_limit():
+    async def run():
+        server = SlowServer()
+        dispatcher = Dispatcher(server, lambda m: None, max_concurrency=2)
+        for i in range(6):
+            dispatcher.submit(request(i, 0.01))
+        await dispatcher.drain()
+        return server.peak
+    assert asyncio.run(run()) == 2
+
+
+def test_cancelled_request_gets_no_reply():
+    async def run():
+        server = SlowServer()
+        written = []
+        dispatcher = Dispatcher(server, written.append, max_concurrency=4)
+        dispatcher.submit(request("a", 10))
+        dispatcher.submit(request(7, 0.01))
+        await asyncio.sleep(0.001)
+        # Cancellation may name the id as a number or a string
+        dispatcher.submit({"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": "a"}})
+        await dispatcher.drain()
+        return server, written, dispatcher
+    server, written, dispatcher = asyncio.run(run())
+    assert server.cancelled == ["a"]
+    assert [m["id"] for m in written] == [7]
+    assert dispatcher.in_flight == {}
+
+
+def test_cancelling_a_queued_request():
+    async def run():
+        server = SlowServer()
+        written = []
+        dispatcher = Dispatcher(server, written.append, max_concurrency=1)
+        dispatcher.submit(request(1, 0.02))
+        dispatcher.submit(request(2, 0.0))
+        dispatcher.cancel(2)
+        await dispatcher.drain()
+        return [m["id"] for m in written]
+    assert asyncio.run(run()) == [1]
+
+
+def test_failure_becomes_an_error_reply():
+    async def run():
+        written = []
+        dispatcher = Dispatcher(SlowServer(), written.append, max_concurrency=1)
+        dispatcher.submit(request(3, 0.0, fail=True))
+        await dispatcher.drain()
+        return written
+    [reply] = asyncio.run(run())
+    assert reply["id"] == 3 and reply["error"]["code"] == -32603 and "boom" in reply["error"]["message"]
+
+
+def test_notifications_are_not_scheduled():
+    async def run():
+        dispatcher = Dispatcher(SlowServer(), lambda m: None, max_concurrency=1)
+        return dispatcher.submit({"jsonrpc": "2.0", "method": "notifications/initialized"})
+    assert asyncio.run(run()) is None
+
+
+def test_shared_semaphore_limits_several_dispatchers():
+    async def run():
+        server = SlowServer()
+        semaphore = asyncio.Semaphore(1)
+        first = Dispatcher(server, lambda m: None, semaphore=semaphore)
+        second = Dispatcher(server, lambda m: None, semaphore=semaphore)
+        for i in range(3):
+            first.submit(request(i, 0.01))
+            second.submit(request(i, 0.01))
+        await asyncio.gather(first.drain(), second.drain())
+        return server.peak
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import es_args
+
+
+def test_single_object():
+    assert es_args.decode('{"index": "vehicles"}') == [{"index": "vehicles"}]
+
+
+def test_empty_string_means_no_arguments():
+    assert es_args.decode("") == [{}]
+    assert es_args.decode("  \n") == [{}]
+
+
+def test_concatenated_objects_with_separators():
+    text = '{"index": "a"}{"index": "b"} , {"index": "c"};\n{"index": "d"}'
+    assert es_args.decode(text) == [{"index": "a"}, {"index": "b"}, {"index": "c"}, {"index": "d"}]
+
+
+def test_missing_opening_brace():
+    assert es_args.decode('"index": "vehicles", "size": 3}') == [{"index": "vehicles", "size": 3}]
+
+
+def test_missing_brace_then_concatenated_object():
+    assert es_args.decode('"index": "a"}{"index": "b"}') == [{"index": "a"}, {"index": "b"}]
+
+
+def test_array_of_objects():
+    assert es_args.decode('[{"index": "a"}, {"index": "b"}]') == [{"index": "a"}, {"index": "b"}]
+
+
+def test_double_encoded_arguments():
+    inner = '{"index": "a"}{"index": "b"}'
+    assert es_args.decode(json.dumps(inner)) == [{"index": "a"}, {"index": "b"}]
+
+
+def test_echoed_content_is_dropped():
+    text = '{"index": "a"}{"content": [{"type": "text", "text": "..."}], "isError": false}'
+    assert es_args.decode(text) == [{"index": "a"}]
+
+
+def test_only_echoed_content_means_no_arguments():
+    assert es_args.decode('{"content": [], "isError": false}') == [{}]
+
+
+def test_bare_string_raises():
+    with pytest.raises(ValueError, match="must be JSON objects"):
+        es_args.decode('"vehicles"')
+
+
+def test_garbage_raises():
+    with pytest.raises(ValueError, match="Could not parse tool arguments"):
+        es_args.decode('{"index": "a"} oops')
+
+
+def test_non_object_values_raise():
+    with pytest.raises(ValueError, match="must be JSON objects"):
+        es_args.decode("[1, 2]")
+
+
+def test_merge_index_calls():
+    calls = [{"index": "a", "size": 2}, {"index": "b,c", "size": 2}, {"indices": ["d"], "size": 2}]
+    assert es_args.merge_index_calls(calls) == {"size": 2, "indices": ["a", "b", "c", "d"]}
+
+
+def test_merge_index_calls_refuses_different_options():
+    assert es_args.merge_index_calls([{"index": "a", "size": 2}, {"index": "b", "size": 3}]) is None
+    assert es_args.merge_index_calls([{"index": "a"}, {"size": 3}]) is None
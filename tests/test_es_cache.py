@@ -0,0 +1,176 @@
+import asyncio
+
+import es_json
+from es_cache import QueryCache
+from es_transport import ESResponse
+
+
+def response(body, status=200):
+    return ESResponse(status, es_json.dumps(body).encode(), {}, "http://fake")
+
+
+class StatsTransport:
+    """Answers _stats with counters the test can move, and logs what ran when."""
+
+    def __init__(self):
+        self.refreshes = 1
+        self.log = []
+        self.stats_delay = 0.0
+
+    def stats(self):
+        return {
+            "indices": {"logs": {"uuid": "u1"}},
+            "_all": {"primaries": {"refresh": {"external_total": self.refreshes},
+                                   "indexing": {"index_total": 10, "delete_total": 0},
+                                   "docs": {"count": 10}}},
+        }
+
+    async def get(self, path, **kwargs):
+        self.log.append("stats-start")
+        await asyncio.sleep(self.stats_delay)
+        self.log.append("stats-end")
+        return response(self.stats())
+
+
+def searcher(transport, hits=1, delay=0.01, during=None):
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        transport.log.append("search-start")
+        await asyncio.sleep(delay)
+        if during:
+            during()
+        transport.log.append("search-end")
+        return response({"hits": {"total": {"value": hits}}})
+    return fetch, calls
+
+
+BODY = {"query": {"match_all": {}}}
+
+
+def test_first_miss_reads_state_alongside_the_search():
+    async def run():
+        es = StatsTransport()
+        es.stats_delay = 0.01
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=60)
+        fetch, calls = searcher(es)
+        r = await cache.search("logs", BODY, fetch)
+        return es.log, cache, r, calls
+    log, cache, r, calls = asyncio.run(run())
+    assert r.json()["hits"]["total"]["value"] == 1
+    # Both requests were in flight before either finished
+    assert log.index("search-start") < log.index("stats-end")
+    assert log.index("stats-start") < log.index("search-end")
+    # No state was known before, so the response cannot be trusted yet
+    assert cache.misses == 1 and len(cache._entries) == 0
+
+
+def test_second_miss_stores_and_third_hits():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=60)
+        fetch, calls = searcher(es)
+        for _ in range(3):
+            await cache.search("logs", BODY, fetch)
+        return cache, calls
+    cache, calls = asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.misses == 2 and cache.hits == 1
+
+
+def test_key_order_does_not_matter():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=60)
+        fetch, calls = searcher(es)
+        await cache.search("logs", {"size": 1, "query": {"match_all": {}}}, fetch)
+        await cache.search("logs", {"size": 1, "query": {"match_all": {}}}, fetch)
+        await cache.search("logs", {"query": {"match_all": {}}, "size": 1}, fetch)
+        return cache
+    assert asyncio.run(run()).hits == 1
+
+
+def test_refresh_invalidates_entries():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=0)
+        fetch, calls = searcher(es)
+        await cache.search("logs", BODY, fetch)
+        await cache.search("logs", BODY, fetch)
+        assert cache._entries
+        es.refreshes += 1
+        await cache.search("logs", BODY, fetch)
+        return cache, calls
+    cache, calls = asyncio.run(run())
+    assert len(calls) == 3
+    assert cache.invalidations == 1 and cache.hits == 0
+
+
+def test_state_change_during_search_is_not_stored():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=0)
+        await cache.index_state("logs")
+        # A refresh lands while the search is running
+        es.stats_delay = 0.02
+
+        def refresh():
+            es.refreshes += 1
+        fetch, calls = searcher(es, delay=0.01, during=refresh)
+        await cache.search("logs", BODY, fetch)
+        return cache
+    cache = asyncio.run(run())
+    assert len(cache._entries) == 0
+
+
+def test_identical_queries_share_one_request():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=60)
+        fetch, calls = searcher(es)
+        await asyncio.gather(*(cache.search("logs", BODY, fetch) for _ in range(5)))
+        return calls
+    assert len(asyncio.run(run())) == 1
+
+
+def test_point_in_time_and_now_are_not_cached():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=60)
+        fetch, calls = searcher(es)
+        for _ in range(2):
+            await cache.search("logs", {"pit": {"id": "x"}}, fetch)
+            await cache.search("logs", {"query": {"range": {"t": {"gte": "now-1d"}}}}, fetch)
+        return cache, calls
+    cache, calls = asyncio.run(run())
+    assert len(calls) == 4 and cache.uncacheable == 4
+
+
+def test_errors_are_not_stored():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=1 << 20, check_interval=60)
+        await cache.index_state("logs")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return response({"error": "bad"}, status=400)
+        await cache.search("logs", BODY, fetch)
+        await cache.search("logs", BODY, fetch)
+        return calls
+    assert len(asyncio.run(run())) == 2
+
+
+def test_eviction_keeps_within_max_bytes():
+    async def run():
+        es = StatsTransport()
+        cache = QueryCache(es, max_bytes=400, check_interval=60)
+        await cache.index_state("logs")
+        fetch, calls = searcher(es)
+        for i in range(20):
+            await cache.search("logs", {"size": i}, fetch)
+        return cache
+    cache = asyncio.run(run())
+    assert cache.bytes <= 400 and cache.evictions > 0
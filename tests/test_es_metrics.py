@@ -0,0 +1,49 @@
+import asyncio
+
+import mcp_server
+from es_metrics import Histogram, Metrics, endpoint
+
+
+def test_endpoint_names():
+    assert endpoint("/vehicles/_search") == "_search"
+    assert endpoint("/_cat/indices?format=json") == "_cat/indices"
+    assert endpoint("/_pit") == "_pit"
+    assert endpoint("/") == "/"
+
+
+def test_histogram_quantiles():
+    h = Histogram()
+    for value in (1, 1, 1, 40, 400):
+        h.observe(value)
+    assert h.quantile(0.5) == 1
+    assert h.quantile(0.99) == 400
+    assert h.snapshot()["count"] == 5
+
+
+def test_prometheus_label_values_are_escaped():
+    metrics = Metrics()
+    call = metrics.begin_call()
+    metrics.end_call('bad"tool\\\nname', call, 5.0, error=ValueError("x"))
+    text = metrics.prometheus({"query": {"hits": 1, "misses": 2}})
+    assert 'mcp_tool_errors_total{tool="bad\\"tool\\\\\\nname",error="ValueError"} 1' in text
+    # Every sample stays on one line
+    for line in text.splitlines():
+        assert line.startswith("#") or line.startswith("mcp_")
+
+
+def test_unknown_tool_names_share_one_label(monkeypatch):
+    monkeypatch.setenv("MCP_PROFILES", "0")
+
+    async def run():
+        server = mcp_server.MCPServer()
+        try:
+            for name in ("no_such_tool", "another\nname", "elasticsearch__nope"):
+                reply = await server.handle_message({"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+                                                     "params": {"name": name, "arguments": {}}})
+                assert "error" in reply
+            return server.metrics
+        finally:
+            await server.close()
+    metrics = asyncio.run(run())
+    assert list(metrics.tools) == ["unknown"]
+    assert metrics.tools["unknown"].latency.count == 3
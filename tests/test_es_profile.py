@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import mcp_server
+from es_transport import ESTransport
+from fake_cluster import fake_cluster
+
+
+def run_with_server(monkeypatch, steps, **options):
+    monkeypatch.setenv("MCP_PROFILES", "1")
+    # No snapshot file: profiles live in memory only
+    monkeypatch.setenv("MCP_PROFILE_PATH", "")
+
+    async def run():
+        async with fake_cluster(**options) as (fake, url):
+            server = mcp_server.MCPServer(transport=ESTransport(url))
+            try:
+                return await steps(server, fake)
+            finally:
+                await server.close()
+    return asyncio.run(run())
+
+
+def test_sample_docs_accepts_numeric_strings(monkeypatch):
+    async def steps(server, fake):
+        await server.call_tool("get_profile", {"index": "people"})
+        single = await server.call_tool("sample_docs", {"index": "people", "size": "3"})
+        batch = await server.call_tool("sample_docs", {"indices": ["people", "vehicles"], "size": "2"})
+        return single, batch
+    single, batch = run_with_server(monkeypatch, steps, docs=20)
+    assert len(single) == 3
+    assert batch
+
+
+@pytest.mark.parametrize("args", [{"index": "people", "size": "three"}, {"indices": ["people"], "size": [1]},
+                                  {"index": "people", "size": -1}])
+def test_sample_docs_rejects_bad_sizes(monkeypatch, args):
+    async def steps(server, fake):
+        with pytest.raises(ValueError, match="size must"):
+            await server.call_tool("sample_docs", args)
+    run_with_server(monkeypatch, steps, docs=5)
+
+
+def test_background_build_is_not_billed_to_the_calling_tool(monkeypatch):
+    async def steps(server, fake):
+        call = server.metrics.begin_call()
+        server.profiles.schedule("people", force=True)
+        await server.profiles._building["people"]
+        return call, server.metrics
+    call, metrics = run_with_server(monkeypatch, steps, docs=20)
+    assert call["es_requests"] == 0 and call["es_ms"] == 0.0
+    # The build itself did reach Elasticsearch
+    assert sum(s.latency.count for s in metrics.endpoints.values()) > 0
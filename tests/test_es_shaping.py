@@ -0,0 +1,69 @@
+import es_json
+from es_shaping import budget_bytes, fit_budget
+
+
+def hits(n, size=50):
+    return [{"_id": str(i), "_source": {"id": i, "notes": "x" * size}} for i in range(n)]
+
+
+def test_budget_bytes():
+    assert budget_bytes({"max_bytes": 1000}) == 1000
+    assert budget_bytes({"max_tokens": 100}) == 400
+    assert budget_bytes({}) is None
+    assert budget_bytes("not a dict") is None
+
+
+def test_small_result_is_untouched():
+    result = {"hits": {"total": {"value": 2}, "hits": hits(2)}}
+    trimmed, text = fit_budget(result, 10000)
+    assert trimmed is result
+    assert text == es_json.dumps(result)
+
+
+def test_no_budget_is_untouched():
+    result = hits(100)
+    trimmed, _ = fit_budget(result, None)
+    assert trimmed is result
+
+
+def test_search_response_is_trimmed_to_fit():
+    result = {"took": 1, "hits": {"total": {"value": 100}, "hits": hits(100)}}
+    trimmed, text = fit_budget(result, 2000)
+    assert len(text.encode("utf-8")) <= 2000
+    kept = len(trimmed["hits"]["hits"])
+    assert 0 < kept < 100
+    assert trimmed["_truncated"]["kept"] == kept
+    assert trimmed["_truncated"]["dropped"] == 100 - kept
+    assert trimmed["hits"]["total"] == {"value": 100}
+    # The original (possibly cached) response is not modified
+    assert len(result["hits"]["hits"]) == 100
+
+
+def test_bare_hit_list_is_wrapped():
+    trimmed, text = fit_budget(hits(100), 1500)
+    assert len(text.encode("utf-8")) <= 1500
+    assert isinstance(trimmed["hits"], list)
+    assert trimmed["_truncated"]["kept"] == len(trimmed["hits"])
+
+
+def test_batched_results_are_trimmed_evenly():
+    result = {"results": {"a": hits(50), "b": hits(50)}, "errors": {}}
+    trimmed, text = fit_budget(result, 3000)
+    assert len(text.encode("utf-8")) <= 3000
+    kept_a, kept_b = len(trimmed["results"]["a"]), len(trimmed["results"]["b"])
+    assert kept_a == kept_b > 0
+
+
+def test_call_batch_responses_are_trimmed():
+    result = {"results": [{"arguments": {"index": "a"}, "response": hits(100)}]}
+    trimmed, text = fit_budget(result, 2000)
+    assert len(text.encode("utf-8")) <= 2000
+    assert 0 < len(trimmed["results"][0]["response"]) < 100
+
+
+def test_unfittable_result_keeps_shape_and_says_so():
+    result = {"took": 1, "aggregations": {"a": "y" * 5000}, "hits": {"hits": hits(10)}}
+    trimmed, _ = fit_budget(result, 1000)
+    assert trimmed["hits"]["hits"] == []
+    assert trimmed["aggregations"] == result["aggregations"]
+    assert "note" in trimmed["_truncated"]
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from es_transport import ESTransport, ESTransportError
+from fake_cluster import closed_port_url, fake_cluster, serve
+
+
+def test_read_timeout_is_not_retried():
+    async def run():
+        async with fake_cluster(docs=10, latency_ms=400) as (fake, url):
+            es = ESTransport(url, timeout=0.2, max_retries=3, retry_backoff=0.01)
+            try:
+                with pytest.raises(ESTransportError, match="TimeoutError"):
+                    await es.post("/vehicles/_search", body={"size": 1})
+                assert fake.requests == 1
+                # A slow node is not a dead one
+                assert es._dead_until == {}
+            finally:
+                await es.close()
+    asyncio.run(run())
+
+
+def test_connect_failure_fails_over_to_a_live_node():
+    async def run():
+        async with fake_cluster(docs=10) as (fake, url):
+            dead = closed_port_url()
+            es = ESTransport([dead, url], max_retries=3, retry_backoff=0.01)
+            try:
+                for _ in range(3):
+                    r = await es.get("/_cat/indices", params={"format": "json"})
+                    assert r.status_code == 200
+                assert fake.requests == 3
+                assert dead in es._dead_until and url not in es._dead_until
+            finally:
+                await es.close()
+    asyncio.run(run())
+
+
+def test_unreachable_cluster_reports_error_type():
+    async def run():
+        es = ESTransport(closed_port_url(), max_retries=1, retry_backoff=0.01)
+        try:
+            with pytest.raises(ESTransportError, match=r"failed after 2 attempt\(s\): ClientConnectorError"):
+                await es.get("/_cat/indices")
+        finally:
+            await es.close()
+    asyncio.run(run())
+
+
+def test_gateway_errors_are_retried_unless_disabled():
+    calls = []
+
+    async def unavailable(request):
+        calls.append(request.method)
+        return web.Response(status=503)
+
+    async def run():
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", unavailable)
+        async with serve(app) as url:
+            es = ESTransport(url, max_retries=2, retry_backoff=0.01)
+            try:
+                # The last attempt's response is handed back for the caller to report
+                r = await es.get("/_cat/indices")
+                assert r.status_code == 503 and len(calls) == 3
+                r = await es.post("/vehicles/_pit", retry=False)
+                assert r.status_code == 503 and len(calls) == 4
+            finally:
+                await es.close()
+    asyncio.run(run())
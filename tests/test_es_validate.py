@@ -0,0 +1,115 @@
+from es_validate import flatten_mapping, unknown_fields, validate_body, validate_fields, validate_query
+
+TEXT = {"type": "text", "fields": {"keyword": {"type": "keyword"}}}
+MAPPING = {
+    "vehicles": {
+        "mappings": {
+            "runtime": {
+                "day": {"type": "keyword"},
+                "price_parts": {"type": "composite", "fields": {"net": {"type": "double"}}},
+            },
+            "properties": {
+                "make": TEXT,
+                "year": {"type": "long"},
+                "status": {"type": "keyword"},
+                "sold_at": {"type": "date"},
+                "labels": {"type": "flattened"},
+                "maker": {"type": "alias", "path": "make"},
+                "owners": {"type": "nested", "properties": {"name": TEXT, "since": {"type": "date"}}},
+                "dealer": {"properties": {"city": TEXT}},
+            },
+        }
+    }
+}
+FIELDS = flatten_mapping(MAPPING)
+
+
+def problems(query):
+    return validate_query(FIELDS, "vehicles", query)
+
+
+def test_flatten_mapping():
+    assert FIELDS["make"]["keyword"] == "make.keyword"
+    assert FIELDS["make.keyword"]["types"] == {"keyword"}
+    assert FIELDS["owners.name"]["nested"] == "owners"
+    assert FIELDS["dealer.city"]["nested"] is None
+    assert FIELDS["maker"]["types"] == {"text"}
+    assert FIELDS["day"]["types"] == {"keyword"}
+    assert FIELDS["price_parts.net"]["types"] == {"double"}
+    assert "price_parts" not in FIELDS
+
+
+def test_valid_queries_pass():
+    assert problems({"match": {"make": "Tesla"}}) == []
+    assert problems({"term": {"make.keyword": "Tesla"}}) == []
+    assert problems({"term": {"make": "tesla"}}) == []
+    assert problems({"range": {"year": {"gte": "2020"}}}) == []
+    assert problems({"range": {"sold_at": {"gte": "now-1y"}}}) == []
+    assert problems({"nested": {"path": "owners", "query": {"match": {"owners.name": "ann"}}}}) == []
+    assert problems({"bool": {"filter": [{"term": {"status": "active"}}, {"exists": {"field": "_id"}}]}}) == []
+    assert problems({"multi_match": {"query": "x", "fields": ["make^2", "dealer.*"]}}) == []
+
+
+def test_runtime_and_flattened_fields_are_known():
+    assert problems({"term": {"day": "Monday"}}) == []
+    assert problems({"range": {"price_parts.net": {"gte": 10}}}) == []
+    assert problems({"term": {"labels.priority": "urgent"}}) == []
+    assert problems({"term": {"labels": "urgent"}}) == []
+    assert unknown_fields(FIELDS, "vehicles", {"query": {"term": {"labels.a.b": "x"}}}) == []
+
+
+def test_search_runtime_mappings_are_known():
+    body = {"runtime_mappings": {"decade": {"type": "long"}}, "query": {"range": {"decade": {"gte": "x"}}}}
+    assert len(validate_body(FIELDS, "vehicles", body)) == 1
+
+
+def test_unknown_field_is_a_hint_not_an_error():
+    body = {"query": {"term": {"mkae": "Tesla"}}, "sort": [{"yeer": "asc"}]}
+    assert validate_body(FIELDS, "vehicles", body) == []
+    hints = unknown_fields(FIELDS, "vehicles", body)
+    assert len(hints) == 2
+    assert "'make'" in hints[0]
+    assert "'year'" in hints[1]
+    assert validate_fields(FIELDS, "vehicles", ["owner_id"], "hops[0]") == []
+
+
+def test_term_on_text_with_uppercase():
+    [problem] = problems({"term": {"make": "Tesla"}})
+    assert "make.keyword" in problem
+
+
+def test_non_numeric_value_on_numeric_field():
+    [problem] = problems({"term": {"year": "recent"}})
+    assert "numeric field 'year'" in problem
+
+
+def test_numeric_range_on_keyword():
+    [problem] = problems({"range": {"status": {"gte": 100}}})
+    assert "lexicographically" in problem
+
+
+def test_range_on_text():
+    [problem] = problems({"range": {"make": {"gte": "a"}}})
+    assert "make.keyword" in problem
+
+
+def test_nested_field_without_nested_query():
+    [problem] = problems({"match": {"owners.name": "ann"}})
+    assert '"path": "owners"' in problem
+
+
+def test_nested_path_that_is_not_nested():
+    [problem] = problems({"nested": {"path": "dealer", "query": {"match": {"dealer.city": "x"}}}})
+    assert "not nested" in problem
+
+
+def test_sort_and_aggregate_on_text():
+    body = {"sort": ["make"], "aggs": {"by_make": {"terms": {"field": "make"}}}}
+    found = validate_body(FIELDS, "vehicles", body)
+    assert len(found) == 2
+    assert all("make.keyword" in p for p in found)
+
+
+def test_nested_aggregation_scope():
+    body = {"aggs": {"o": {"nested": {"path": "owners"}, "aggs": {"n": {"terms": {"field": "owners.name.keyword"}}}}}}
+    assert validate_body(FIELDS, "vehicles", body) == []
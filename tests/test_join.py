@@ -0,0 +1,102 @@
+import asyncio
+
+import mcp_server
+from es_transport import ESTransport
+from fake_cluster import serve
+from fake_es import FakeES
+
+
+class TrackingES(FakeES):
+    """FakeES that records how many searches ran and how many overlapped."""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.searches = {}
+        self.running = 0
+        self.peak = 0
+
+    async def search(self, request):
+        index = request.match_info.get("index")
+        self.searches[index] = self.searches.get(index, 0) + 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(0.005)
+            return await super().search(request)
+        finally:
+            self.running -= 1
+
+
+def make_fake():
+    fake = TrackingES(docs=1)
+    fake.indices["vehicles"] = [{"id": i, "make": "Ford" if i % 2 else "Kia"} for i in range(1, 21)]
+    fake.indices["people"] = [{"id": i, "name": f"Person {i}"} for i in range(1, 11)]
+    # Vehicle v is registered once, to person (v % 10) + 1
+    fake.indices["registrations"] = [{"vehicle_id": v, "person_id": v % 10 + 1} for v in range(1, 21)]
+    return fake
+
+
+HOPS = [
+    {"index": "vehicles", "query": {"term": {"make.keyword": "Ford"}}, "join_field": "id", "target_field": "vehicle_id"},
+    {"index": "registrations", "join_field": "person_id", "target_field": "id"},
+    {"index": "people"},
+]
+
+
+def run_join(monkeypatch, args, fake=None, **limits):
+    monkeypatch.setenv("MCP_PROFILES", "0")
+    for name, value in limits.items():
+        monkeypatch.setattr(mcp_server, name, value)
+    fake = fake or make_fake()
+
+    async def run():
+        async with serve(fake.app()) as url:
+            server = mcp_server.MCPServer(transport=ESTransport(url))
+            try:
+                return await server.call_tool("join", args)
+            finally:
+                await server.close()
+    return asyncio.run(run()), fake
+
+
+def test_rows_link_every_hop(monkeypatch):
+    result, _ = run_join(monkeypatch, {"hops": HOPS})
+    assert result["row_count"] == 10 and not result["truncated"]
+    assert [h["matched"] for h in result["hops"]] == [10, 10, 5]
+    for row in result["rows"]:
+        assert row["vehicles"]["make"] == "Ford"
+        assert row["registrations"]["vehicle_id"] == row["vehicles"]["id"]
+        assert row["people"]["id"] == row["registrations"]["person_id"]
+
+
+def test_exact_fit_is_not_truncated(monkeypatch):
+    result, _ = run_join(monkeypatch, {"hops": HOPS, "max_rows": 10})
+    assert result["row_count"] == 10 and not result["truncated"]
+    result, _ = run_join(monkeypatch, {"hops": HOPS, "max_rows": 9})
+    assert result["row_count"] == 9 and result["truncated"]
+
+
+def test_hop_limit_spans_chunks(monkeypatch):
+    # Every vehicle registered twice: ten one-key chunks hold twenty registrations, but the hop keeps ten
+    fake = make_fake()
+    fake.indices["registrations"] += [{"vehicle_id": v, "person_id": (v + 5) % 10 + 1} for v in range(1, 21)]
+    result, fake = run_join(monkeypatch, {"hops": HOPS, "chunk_size": 1}, fake=fake, MAX_JOIN_DOCS=10, JOIN_CHUNK_CONCURRENCY=2)
+    assert result["truncated"]
+    assert [h["matched"] for h in result["hops"][:2]] == [10, 10]
+    assert fake.peak <= 2
+    # Windows of two chunks stop once the hop is past its limit: 4, 8, then 12 documents
+    assert fake.searches["registrations"] == 6
+
+
+def test_hop_limit_exact_fit(monkeypatch):
+    result, fake = run_join(monkeypatch, {"hops": HOPS, "chunk_size": 1}, MAX_JOIN_DOCS=10, JOIN_CHUNK_CONCURRENCY=3)
+    assert not result["truncated"]
+    assert [h["matched"] for h in result["hops"]] == [10, 10, 5] and result["row_count"] == 10
+    assert fake.searches["registrations"] == 10
+
+
+def test_no_matches_stops_early(monkeypatch):
+    hops = [dict(HOPS[0], query={"term": {"make.keyword": "Volvo"}})] + HOPS[1:]
+    result, fake = run_join(monkeypatch, {"hops": hops})
+    assert result["rows"] == [] and not result["truncated"]
+    assert fake.searches == {"vehicles": 1}
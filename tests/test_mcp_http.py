@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+
+import aiohttp
+
+import es_json
+import mcp_server
+from es_transport import ESTransport
+from fake_cluster import fake_cluster, serve
+from mcp_elastic import SESSION_HEADER, HTTPTransport
+
+INITIALIZE = {"jsonrpc": "2.0", "id": 0, "method": "initialize", "params": {}}
+
+
+def tool_call(request_id, name, arguments, **params):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call", "params": dict(params, name=name, arguments=arguments)}
+
+
+@contextlib.asynccontextmanager
+async def http_server(**options):
+    """Serve the HTTP transport over a fake cluster; yields (url, client, fake)."""
+    async with fake_cluster(**options) as (fake, es_url):
+        http = HTTPTransport(mcp_server.MCPServer(transport=ESTransport(es_url)))
+        async with serve(http.app()) as url, aiohttp.ClientSession() as client:
+            yield url + "/mcp", client, fake
+
+
+async def open_session(client, url):
+    async with client.post(url, json=INITIALIZE) as r:
+        assert r.status == 200
+        assert (await r.json())["result"]["serverInfo"]["name"] == "elastic-mcp"
+        return r.headers[SESSION_HEADER]
+
+
+def run(monkeypatch, steps, env=None, **options):
+    monkeypatch.setenv("MCP_PROFILES", "0")
+    for name, value in (env or {}).items():
+        monkeypatch.setenv(name, value)
+
+    async def main():
+        async with http_server(**options) as (url, client, fake):
+            return await steps(url, client, fake)
+    return asyncio.run(main())
+
+
+def test_session_lifecycle(monkeypatch):
+    async def steps(url, client, fake):
+        async with client.post(url, json=tool_call(1, "list_indices", {})) as r:
+            assert r.status == 400
+        async with client.post(url, json=tool_call(1, "list_indices", {}), headers={SESSION_HEADER: "nope"}) as r:
+            assert r.status == 404
+        session = await open_session(client, url)
+        headers = {SESSION_HEADER: session}
+        async with client.post(url, json=tool_call(1, "list_indices", {"index_pattern": "*"}), headers=headers) as r:
+            assert r.status == 200 and r.headers[SESSION_HEADER] == session
+            indices = es_json.loads((await r.json())["result"]["content"][0]["text"])["indices"]
+            assert sorted(indices) == ["people", "registrations", "vehicles"]
+        async with client.post(url, json={"jsonrpc": "2.0", "method": "notifications/initialized"}, headers=headers) as r:
+            assert r.status == 202
+        async with client.delete(url, headers=headers) as r:
+            assert r.status == 204
+        async with client.delete(url, headers=headers) as r:
+            assert r.status == 404
+        async with client.post(url, json=tool_call(2, "list_indices", {}), headers=headers) as r:
+            assert r.status == 404
+    run(monkeypatch, steps, docs=5)
+
+
+def test_batch_gets_a_batch_reply(monkeypatch):
+    async def steps(url, client, fake):
+        headers = {SESSION_HEADER: await open_session(client, url)}
+        batch = [tool_call(1, "count", {"index": "people"}), tool_call(2, "count", {"index": "vehicles"}),
+                 tool_call(2, "count", {"index": "vehicles"})]
+        async with client.post(url, json=batch, headers=headers) as r:
+            replies = await r.json()
+        return replies
+    replies = run(monkeypatch, steps, docs=5)
+    assert sorted(str(reply["id"]) for reply in replies) == ["1", "2", "2"]
+    assert sum("Duplicate request id" in reply.get("error", {}).get("message", "") for reply in replies) == 1
+
+
+def test_session_backpressure(monkeypatch):
+    async def steps(url, client, fake):
+        headers = {SESSION_HEADER: await open_session(client, url)}
+        slow = [asyncio.ensure_future(client.post(url, json=tool_call(i, "count", {"index": "people"}), headers=headers))
+                for i in range(2)]
+        await asyncio.sleep(0.05)
+        async with client.post(url, json=tool_call(9, "count", {"index": "people"}), headers=headers) as r:
+            refused = r.status, r.headers.get("Retry-After")
+        # Another session is not affected
+        other = {SESSION_HEADER: await open_session(client, url)}
+        async with client.post(url, json=tool_call(1, "count", {"index": "people"}), headers=other) as r:
+            other_status = r.status
+        statuses = []
+        for request in slow:
+            async with await request as r:
+                statuses.append(r.status)
+        return refused, other_status, statuses
+    refused, other_status, statuses = run(monkeypatch, steps, env={"MCP_HTTP_SESSION_MAX_PENDING": "2"}, docs=5, latency_ms=200)
+    assert refused == (429, "1")
+    assert other_status == 200
+    assert statuses == [200, 200]
+
+
+def test_server_wide_backpressure(monkeypatch):
+    async def steps(url, client, fake):
+        first = {SESSION_HEADER: await open_session(client, url)}
+        second = {SESSION_HEADER: await open_session(client, url)}
+        slow = asyncio.ensure_future(client.post(url, json=tool_call(1, "count", {"index": "people"}), headers=first))
+        await asyncio.sleep(0.05)
+        async with client.post(url, json=tool_call(1, "count", {"index": "people"}), headers=second) as r:
+            refused = r.status
+        async with await slow as r:
+            return refused, r.status
+    assert run(monkeypatch, steps, env={"MCP_HTTP_MAX_PENDING": "1"}, docs=5, latency_ms=200) == (503, 200)
+
+
+def test_cancelled_call_gets_no_reply(monkeypatch):
+    async def steps(url, client, fake):
+        headers = {SESSION_HEADER: await open_session(client, url)}
+        slow = asyncio.ensure_future(client.post(url, json=tool_call("s", "count", {"index": "people"}), headers=headers))
+        await asyncio.sleep(0.05)
+        cancel = {"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": "s"}}
+        async with client.post(url, json=cancel, headers=headers) as r:
+            assert r.status == 202
+        async with await slow as r:
+            return r.status, await r.read()
+    assert run(monkeypatch, steps, docs=5, latency_ms=500) == (202, b"")
+
+
+def test_progress_is_streamed(monkeypatch):
+    async def steps(url, client, fake):
+        headers = {SESSION_HEADER: await open_session(client, url), "Accept": "application/json, text/event-stream"}
+        call = tool_call(1, "search", {"index": "people", "query_body": {}, "page_size": 5, "max_pages": 3},
+                         _meta={"progressToken": "p"})
+        async with client.post(url, json=call, headers=headers) as r:
+            assert r.headers["Content-Type"].startswith("text/event-stream")
+            text = (await r.read()).decode()
+        return [es_json.loads(line[len("data: "):]) for line in text.splitlines() if line.startswith("data: ")]
+    events = run(monkeypatch, steps, docs=20)
+    progress = [e["params"]["progress"] for e in events if e.get("method") == "notifications/progress"]
+    assert progress == [5, 10, 15]
+    assert events[-1]["id"] == 1 and "result" in events[-1]
+
+
+def test_foreign_origin_is_refused(monkeypatch):
+    async def steps(url, client, fake):
+        async with client.post(url, json=INITIALIZE, headers={"Origin": "http://evil.example"}) as r:
+            refused = r.status
+        async with client.post(url, json=INITIALIZE, headers={"Origin": "http://localhost:3000"}) as r:
+            return refused, r.status
+    assert run(monkeypatch, steps, docs=5) == (403, 200)